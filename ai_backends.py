@@ -0,0 +1,182 @@
+#! /usr/bin/python3
+
+import os
+import shutil
+
+import logging
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY, AI_MODEL, AI_MODEL_PATH, DATA_FOLDER
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_ai_backends')
+logger.setLevel(logging.INFO)
+h = logging.FileHandler(os.path.join(today_log_path, TODAY + '_' + this_script + '.log'))
+f = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+h.setFormatter(f)
+logger.addHandler(h)
+
+# Runtimes supported by ultralytics export => the exported model keeps the YOLO predict/boxes interface
+# pytorch => .pt file used as is (fallback when the export is not possible)
+AI_BACKENDS = {'pytorch': '.pt',
+                'onnx': '.onnx',
+                'ncnn': '_ncnn_model',
+                'openvino': '_openvino_model'}
+
+# INT8 quantization needs a calibration step, only available with OpenVINO (NNCF) in ultralytics
+INT8_BACKENDS = ['openvino']
+
+CALIBRATION_FOLDER = os.path.join(AI_MODEL_PATH, 'calibration')
+
+def get_exported_model_path(model_path, backend, image_width, image_height, quantization='fp32'):
+
+    # Export depends on the image size => one cached model per backend, size and quantization
+    model_name = os.path.splitext(os.path.basename(model_path))[0]
+
+    if quantization == 'int8':
+        model_name += '_int8'
+
+    return os.path.join(AI_MODEL_PATH, f'{model_name}_{image_width}x{image_height}{AI_BACKENDS[backend]}')
+
+def find_original_images(data_folder=DATA_FOLDER, suffix='_original.jpg'):
+
+    # Images saved by images_capture2 on detection => representative of our own sites
+    images = []
+
+    for root, dirs, files in os.walk(data_folder):
+        for file in files:
+            if file.endswith(suffix):
+                images.append(os.path.join(root, file))
+
+    return sorted(images)
+
+def prepare_calibration_data(names, num_images, data_folder=DATA_FOLDER):
+
+    images = find_original_images(data_folder)
+
+    if not images:
+        logger.warning(f'no calibration image found in {data_folder}')
+        return None
+
+    # Spread the selection over all the available nights
+    step = max(1, len(images) // num_images)
+    images = images[::step][:num_images]
+
+    images_folder = os.path.join(CALIBRATION_FOLDER, 'images')
+
+    if os.path.exists(images_folder):
+        shutil.rmtree(images_folder)
+    os.makedirs(images_folder)
+
+    for image in images:
+        os.symlink(image, os.path.join(images_folder, os.path.basename(image)))
+
+    # Dataset description read by ultralytics => no labels needed for calibration
+    from yaml import safe_dump
+
+    dataset_file_path = os.path.join(CALIBRATION_FOLDER, 'calibration.yaml')
+
+    with open(dataset_file_path, 'w') as f:
+        safe_dump({'path': CALIBRATION_FOLDER, 'train': 'images', 'val': 'images', 'names': dict(names)}, f)
+
+    logger.info(f'{len(images)} calibration images => {dataset_file_path}')
+
+    return dataset_file_path
+
+def get_ai_model_path(configuration, model_path=AI_MODEL):
+
+    backend = configuration.ai_detection['backend']
+
+    if backend not in AI_BACKENDS:
+        logger.warning(f'unknown ai backend {backend} => pytorch')
+        backend = 'pytorch'
+
+    quantization = configuration.ai_detection['quantization']
+
+    if quantization == 'int8' and backend not in INT8_BACKENDS:
+        logger.warning(f'int8 quantization not available with {backend} => fp32')
+        quantization = 'fp32'
+
+    if backend == 'pytorch':
+        return model_path
+
+    if configuration.ai_detection['mode'] == 'tiled':
+        # Prediction on square tiles of the main frame
+        image_width = image_height = configuration.ai_detection['tiled']['tile_size']
+    else:
+        image_width = configuration.ai_detection['image_width']
+        image_height = configuration.ai_detection['image_height']
+
+    exported_model_path = get_exported_model_path(model_path, backend, image_width, image_height, quantization)
+
+    if os.path.exists(exported_model_path):
+        logger.info(f'{backend} model found in cache => {exported_model_path}')
+        return exported_model_path
+
+    try:
+
+        from ultralytics import YOLO
+
+        ai_model = YOLO(model_path)
+
+        export_args = {'format': backend, 'imgsz': (image_height, image_width)}
+
+        if quantization == 'int8':
+
+            dataset_file_path = prepare_calibration_data(ai_model.names, configuration.ai_detection['calibration_images'])
+
+            if dataset_file_path:
+                export_args['int8'] = True
+                export_args['data'] = dataset_file_path
+            else:
+                logger.warning('int8 quantization without calibration data => fp32')
+                exported_model_path = get_exported_model_path(model_path, backend, image_width, image_height)
+                if os.path.exists(exported_model_path):
+                    return exported_model_path
+                quantization = 'fp32'
+
+        logger.info(f'exporting {model_path} to {backend} {quantization} ({image_width}x{image_height})')
+
+        export_path = ai_model.export(**export_args)
+
+        shutil.move(export_path, exported_model_path)
+
+        logger.info(f'{backend} model exported => {exported_model_path}')
+
+        return exported_model_path
+
+    except BaseException as e:
+
+        logger.error(f'{backend} export failed => fallback to {model_path}')
+        logger.error(str(e))
+
+        return model_path
+
+def load_ai_model(configuration, model_path=AI_MODEL):
+
+    from ultralytics import YOLO
+
+    ai_model_path = get_ai_model_path(configuration, model_path)
+
+    try:
+
+        ai_model = YOLO(ai_model_path, task='detect')
+
+    except BaseException as e:
+
+        if ai_model_path == model_path:
+            raise
+
+        logger.error(f'{ai_model_path} not loaded => fallback to {model_path}')
+        logger.error(str(e))
+
+        ai_model_path = model_path
+        ai_model = YOLO(ai_model_path, task='detect')
+
+    logger.info(f'ai model loaded => {ai_model_path}')
+
+    return ai_model, ai_model_path
@@ -0,0 +1,497 @@
+#! /usr/bin/python3
+
+import os
+from time import time
+from threading import Thread, Lock
+from queue import Queue, Empty
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import logging
+
+import numpy as np
+
+from cv2 import rectangle, putText, imencode, FONT_HERSHEY_SIMPLEX
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_ai_inference')
+logger.setLevel(logging.INFO)
+h = logging.FileHandler(os.path.join(today_log_path, TODAY + '_' + this_script + '.log'))
+f = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+h.setFormatter(f)
+logger.addHandler(h)
+
+BOXES_COLOR = (0, 0, 255)
+
+# Detection modes
+# lores => one prediction on the lores frame
+# tiled => main frame sliced in overlapping tiles, batched prediction, boxes merged across tiles
+# cascade => low confidence proposals on the lores frame, verified on main frame crops
+DETECTION_MODES = ['lores', 'tiled', 'cascade']
+MAIN_FRAME_MODES = ['tiled', 'cascade']
+# Main frame only needed when the first stage proposed something
+LAZY_MAIN_FRAME_MODES = ['cascade']
+
+def box_intersection(boxes_a, boxes_b):
+
+    # Intersection matrix between two sets of x center, y center, width, height boxes, and their areas
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    a_min, a_max = a[:, None, 0:2] - a[:, None, 2:4] / 2, a[:, None, 0:2] + a[:, None, 2:4] / 2
+    b_min, b_max = b[None, :, 0:2] - b[None, :, 2:4] / 2, b[None, :, 0:2] + b[None, :, 2:4] / 2
+
+    intersection = np.clip(np.minimum(a_max, b_max) - np.maximum(a_min, b_min), 0, None).prod(axis=2)
+
+    return intersection, a[:, None, 2:4].prod(axis=2), b[None, :, 2:4].prod(axis=2)
+
+def box_iou(boxes_a, boxes_b):
+
+    intersection, area_a, area_b = box_intersection(boxes_a, boxes_b)
+
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-9)
+
+def box_ios(boxes_a, boxes_b):
+
+    # Intersection over the smaller box => a box cut by a tile border matches the whole box
+    intersection, area_a, area_b = box_intersection(boxes_a, boxes_b)
+
+    return intersection / np.maximum(np.minimum(area_a, area_b), 1e-9)
+
+def nms(data, threshold, overlap=box_iou):
+
+    # Greedy non maximum suppression per class on Detections data rows
+    if data.shape[0] == 0:
+        return data
+
+    overlaps = overlap(data[:, 0:4], data[:, 0:4])
+    suppressed = np.zeros(data.shape[0], dtype=bool)
+    keep = []
+
+    for i in np.argsort(-data[:, 4]):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= (overlaps[i] > threshold) & (data[:, 5] == data[i, 5])
+
+    return data[keep]
+
+class Detections():
+
+    # One row per box: x center, y center, width, height (normalized), confidence, class
+
+    def __init__(self, data=None, timestamp=0.0, speed=0.0):
+
+        if data is None:
+            data = np.zeros((0, 6), dtype=np.float32)
+
+        self.data = data
+        self.timestamp = timestamp
+        self.speed = speed
+
+        # Set by the tracker => one track id per box
+        self.track_ids = None
+
+    @classmethod
+    def from_prediction(cls, prediction, timestamp=0.0):
+
+        boxes = prediction.boxes
+
+        data = np.hstack((boxes.xywhn.cpu().numpy(), boxes.conf.cpu().numpy().reshape(-1, 1), boxes.cls.cpu().numpy().reshape(-1, 1))).astype(np.float32)
+
+        speed = prediction.speed['preprocess'] + prediction.speed['inference'] + prediction.speed['postprocess']
+
+        return cls(data, timestamp, speed)
+
+    def __len__(self):
+
+        return self.data.shape[0]
+
+    @property
+    def xywhn(self):
+
+        return self.data[:, 0:4]
+
+    @property
+    def conf(self):
+
+        return self.data[:, 4]
+
+    @property
+    def cls(self):
+
+        return self.data[:, 5].astype(int)
+
+    def to_pixels(self, image_width, image_height):
+
+        # Top, bottom, left, right limits of each box in an image of the given size
+        limits = []
+
+        for x, y, w, h in self.xywhn.tolist():
+            x, y, w, h = int(x * image_width), int(y * image_height), int(w * image_width), int(h * image_height)
+            limits.append([int(y-h/2), int(y+h/2), int(x-w/2), int(x+w/2)])
+
+        return limits
+
+    def to_txt(self):
+
+        # Same layout as ultralytics save_txt(save_conf=True) => class x y w h conf [track id]
+        track_ids = [''] * len(self) if self.track_ids is None else [f' {track_id}' for track_id in self.track_ids.tolist()]
+
+        return ''.join(f'{cls} {x:g} {y:g} {w:g} {h:g} {conf:g}{track_id}\n' for (x, y, w, h), conf, cls, track_id in zip(self.xywhn.tolist(), self.conf.tolist(), self.cls.tolist(), track_ids))
+
+    def save_txt(self, txt_file_path):
+
+        with open(txt_file_path, 'w') as f:
+            f.write(self.to_txt())
+
+    def plot(self, frame):
+
+        image = frame.copy()
+
+        for (top, bottom, left, right), conf in zip(self.to_pixels(frame.shape[1], frame.shape[0]), self.conf.tolist()):
+            rectangle(image, (left, top), (right, bottom), BOXES_COLOR, 1)
+            putText(image, f'{conf:.2f}', (left, max(top - 2, 8)), FONT_HERSHEY_SIMPLEX, 0.3, BOXES_COLOR, 1)
+
+        return image
+
+    def to_jpeg(self, frame):
+
+        return imencode('.jpg', self.plot(frame))[1].tobytes()
+
+    def save(self, jpeg_file_path, frame):
+
+        with open(jpeg_file_path, 'wb') as f:
+            f.write(self.to_jpeg(frame))
+
+def make_tiles(image_width, image_height, tile_size, overlap):
+
+    # Left, top, right, bottom limits of overlapping tiles covering the whole image
+    step = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(x, y, min(x + tile_size, image_width), min(y + tile_size, image_height)) for y in starts(image_height) for x in starts(image_width)]
+
+def predict_regions(ai_model, frame, regions, batch_size, predict_args):
+
+    # Batched prediction on left, top, right, bottom regions of the frame
+    # => boxes in frame normalized coordinates, total speed
+    image_height, image_width = frame.shape[0:2]
+
+    # Main frame is BGR ordered (RGB888) while the lores frame is RGB => same channel order as in lores mode
+    crops = [np.ascontiguousarray(frame[top:bottom, left:right, ::-1]) for left, top, right, bottom in regions]
+
+    # batch_size 0 => all regions in a single predict call (pytorch only, see get_detection_args)
+    batch_size = batch_size or len(crops)
+
+    regions_data = [np.zeros((0, 6), dtype=np.float32)]
+    speed = 0.0
+
+    for start in range(0, len(crops), batch_size):
+
+        predictions = ai_model.predict(crops[start:start + batch_size], **predict_args)
+
+        for (left, top, right, bottom), prediction in zip(regions[start:start + batch_size], predictions):
+
+            detections = Detections.from_prediction(prediction)
+            speed += detections.speed
+
+            if len(detections):
+
+                # Region normalized coordinates => frame normalized coordinates
+                data = detections.data.copy()
+                data[:, 0] = (left + data[:, 0] * (right - left)) / image_width
+                data[:, 1] = (top + data[:, 1] * (bottom - top)) / image_height
+                data[:, 2] *= (right - left) / image_width
+                data[:, 3] *= (bottom - top) / image_height
+
+                regions_data.append(data)
+
+    return np.vstack(regions_data), speed
+
+def predict_tiled(ai_model, frame, tiled_args, predict_args, timestamp=0.0):
+
+    image_height, image_width = frame.shape[0:2]
+
+    tiles = make_tiles(image_width, image_height, tiled_args['tile_size'], tiled_args['overlap'])
+
+    data, speed = predict_regions(ai_model, frame, tiles, tiled_args['batch_size'], dict(predict_args, imgsz=tiled_args['tile_size']))
+
+    return Detections(nms(data, tiled_args['merge_threshold'], overlap=box_ios), timestamp, speed)
+
+def make_proposal_regions(detections, image_width, image_height, region_width, region_height, margin):
+
+    # One region per proposal, centered on the box with a margin around it and the aspect ratio
+    # of the model input. Never smaller than the model input => native resolution, no upscaling
+    regions = []
+
+    for x, y, w, h in detections.xywhn:
+
+        scale = max(1.0, w * image_width * (1 + 2 * margin) / region_width, h * image_height * (1 + 2 * margin) / region_height)
+
+        width = min(image_width, int(round(region_width * scale)))
+        height = min(image_height, int(round(region_height * scale)))
+
+        # Region shifted inside the frame rather than truncated
+        left = min(max(0, int(round(x * image_width - width / 2))), image_width - width)
+        top = min(max(0, int(round(y * image_height - height / 2))), image_height - height)
+
+        regions.append((left, top, left + width, top + height))
+
+    return regions
+
+def predict_cascade(ai_model, frame_lores, frame_main, cascade_args, predict_args, timestamp=0.0):
+
+    # First stage => cheap lores prediction with a low confidence threshold
+    prediction = ai_model.predict(frame_lores, **dict(predict_args, conf=cascade_args['proposal_confidence']))[0]
+
+    proposals = Detections.from_prediction(prediction)
+
+    if len(proposals) == 0:
+        return Detections(None, timestamp, proposals.speed)
+
+    # Main frame copied from the camera only now (lazy main)
+    if callable(frame_main):
+        frame_main = frame_main()
+
+    image_height, image_width = frame_main.shape[0:2]
+
+    # Same input size as the first stage => the same exported model is used for both stages
+    region_width, region_height = predict_args['imgsz']
+
+    regions = make_proposal_regions(proposals, image_width, image_height, region_width, region_height, cascade_args['margin'])
+
+    # Second stage => proposals confirmed at min_confidence on native resolution crops
+    data, speed = predict_regions(ai_model, frame_main, regions, cascade_args['batch_size'], predict_args)
+
+    return Detections(nms(data, cascade_args['merge_threshold'], overlap=box_ios), timestamp, proposals.speed + speed)
+
+def get_detection_args(configuration):
+
+    # Plain dict => can be sent to the inference process
+    mode = configuration.ai_detection['mode']
+
+    if mode not in DETECTION_MODES:
+        logger.warning(f'unknown detection mode {mode} => lores')
+        mode = 'lores'
+
+    tiled_args = dict(configuration.ai_detection['tiled'])
+    cascade_args = dict(configuration.ai_detection['cascade'])
+
+    # Models exported by ai_backends.py have a static batch of 1 => one region per predict call
+    if configuration.ai_detection['backend'] != 'pytorch':
+        for args in (tiled_args, cascade_args):
+            if args['batch_size'] != 1:
+                logger.info(f"{configuration.ai_detection['backend']} model with a static batch => batch_size {args['batch_size']} set to 1")
+                args['batch_size'] = 1
+
+    return {'mode': mode,
+            'predict': {'imgsz': (configuration.ai_detection['image_width'], configuration.ai_detection['image_height']),
+                        'conf': configuration.ai_detection['min_confidence'],
+                        'show': False,
+                        'save': False,
+                        'save_txt': False,
+                        'verbose': False},
+            'tiled': tiled_args,
+            'cascade': cascade_args}
+
+def detect(ai_model, frame_lores, frame_main, detection_args, timestamp=0.0):
+
+    # frame_main can be a callable returning the main frame => only called when needed
+
+    if detection_args['mode'] == 'tiled':
+        if callable(frame_main):
+            frame_main = frame_main()
+        return predict_tiled(ai_model, frame_main, detection_args['tiled'], detection_args['predict'], timestamp)
+
+    if detection_args['mode'] == 'cascade':
+        return predict_cascade(ai_model, frame_lores, frame_main, detection_args['cascade'], detection_args['predict'], timestamp)
+
+    prediction = ai_model.predict(frame_lores, **detection_args['predict'])[0]
+
+    return Detections.from_prediction(prediction, timestamp)
+
+def inference_worker(shm_names, frame_shapes, ring_size, model_path, detection_args, requests, results):
+
+    # Executed in the inference process => YOLO is loaded here, never in the capture process
+    from ultralytics import YOLO
+
+    shms = [shared_memory.SharedMemory(name=shm_name) for shm_name in shm_names]
+    rings = [np.ndarray((ring_size, *frame_shape), dtype=np.uint8, buffer=shm.buf) for shm, frame_shape in zip(shms, frame_shapes)]
+
+    ai_model = YOLO(model_path, task='detect')
+
+    results.put(('ready', None, None, 0.0, None))
+
+    while True:
+
+        request = requests.get()
+
+        if request is None:
+            break
+
+        slot, timestamp = request
+
+        try:
+            frame_main = rings[1][slot] if len(rings) > 1 else None
+            detections = detect(ai_model, rings[0][slot], frame_main, detection_args, timestamp)
+            results.put((slot, timestamp, detections.data, detections.speed, None))
+        except Exception as e:
+            # Error sent on its own => speed stays a number for the metrics
+            results.put((slot, timestamp, None, 0.0, str(e)))
+
+    del rings
+    for shm in shms:
+        shm.close()
+
+class InferenceProcess():
+
+    # Lores frames (and main frames if the detection mode needs them) are copied into shared
+    # memory rings => only (slot, timestamp) goes through the queues
+
+    def __init__(self, configuration, model_path, callback=None):
+
+        self.model_path = model_path
+        self.callback = callback
+
+        self.detection_args = get_detection_args(configuration)
+
+        self.frame_shapes = [(configuration.ai_detection['image_height'], configuration.ai_detection['image_width'], 3)]
+        if self.detection_args['mode'] in MAIN_FRAME_MODES:
+            self.frame_shapes.append((configuration.camera['image_height'], configuration.camera['image_width'], 3))
+
+        self.ring_size = configuration.ai_detection['ring_size']
+
+        self.shms = [shared_memory.SharedMemory(create=True, size=self.ring_size * int(np.prod(frame_shape))) for frame_shape in self.frame_shapes]
+        self.rings = [np.ndarray((self.ring_size, *frame_shape), dtype=np.uint8, buffer=shm.buf) for shm, frame_shape in zip(self.shms, self.frame_shapes)]
+
+        # Spawn => the child does not inherit camera, pigpio and threads of the capture process
+        context = mp.get_context('spawn')
+
+        self.requests = context.Queue()
+        self.results = context.Queue()
+
+        self.free_slots = Queue()
+        for slot in range(self.ring_size):
+            self.free_slots.put(slot)
+
+        self.lock = Lock()
+        self.pending = {}
+
+        self.process = context.Process(target=inference_worker,
+                                        args=([shm.name for shm in self.shms], self.frame_shapes, self.ring_size, self.model_path, self.detection_args, self.requests, self.results),
+                                        name='inference',
+                                        daemon=True)
+
+        self.collector = None
+
+        self.started = False
+
+    def start(self):
+
+        if not self.started:
+
+            self.process.start()
+
+            # Wait for the model to be loaded by the inference process
+            while True:
+                try:
+                    self.results.get(timeout=1)
+                    break
+                except Empty:
+                    if not self.process.is_alive():
+                        raise RuntimeError(f'inference process exited with code {self.process.exitcode}')
+
+            self.collector = Thread(target=self.collect, name='inference_results', daemon=True)
+            self.collector.start()
+
+            self.started = True
+
+            logger.info(f'inference process started (pid {self.process.pid}) with a ring of {self.ring_size} frames')
+
+    def stop(self):
+
+        if self.started:
+
+            # Requests already queued are processed before the sentinel
+            self.requests.put(None)
+            self.process.join()
+
+            self.results.put(None)
+            self.collector.join()
+
+            self.started = False
+
+            logger.info('inference process stopped')
+
+        # Shared memory released once => stop() can be called again
+        if self.shms:
+            self.rings = []
+            for shm in self.shms:
+                shm.close()
+                shm.unlink()
+            self.shms = []
+
+    def submit(self, frame_lores, frame_main=None, timestamp=None, context=None):
+
+        if timestamp is None:
+            timestamp = time()
+
+        # Blocks when all slots are in use (backpressure)
+        slot = self.free_slots.get()
+
+        self.rings[0][slot] = frame_lores
+        if len(self.rings) > 1:
+            self.rings[1][slot] = frame_main
+
+        with self.lock:
+            self.pending[slot] = context
+
+        self.requests.put((slot, timestamp))
+
+        return slot
+
+    def collect(self):
+
+        while True:
+
+            result = self.results.get()
+
+            if result is None:
+                break
+
+            slot, timestamp, data, speed, error = result
+
+            with self.lock:
+                context = self.pending.pop(slot, None)
+
+            try:
+
+                if data is None:
+                    logger.error(f'inference failed for frame captured at {timestamp}')
+                    logger.error(error)
+                    data = np.zeros((0, 6), dtype=np.float32)
+
+                if self.callback:
+                    self.callback(Detections(data, timestamp, speed), context)
+
+            except Exception as e:
+                logger.error(f'detections of frame captured at {timestamp} not processed')
+                logger.error(str(e))
+
+            finally:
+                # Slot always given back => submit() never blocked by a failed frame
+                self.free_slots.put(slot)
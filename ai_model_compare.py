@@ -0,0 +1,147 @@
+#! /usr/bin/python3
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+from cv2 import imread, resize, cvtColor, COLOR_BGR2RGB
+
+from configuration2 import Configuration2
+
+from ai_backends import AI_BACKENDS, get_ai_model_path, find_original_images
+from ai_inference import Detections, box_iou
+
+from globals_parameters import AI_MODEL, DATA_FOLDER
+
+# Compare a converted/quantized detector with the FP32 .pt model on our own _original.jpg captures
+# The FP32 detections are the reference => mAP measures the drift of the candidate model
+#
+# Usage: python3 ai_model_compare.py -b openvino -q int8 -n 200
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+def average_precision(references, candidates, iou_threshold):
+
+    scores = []
+    matches = []
+    num_references = 0
+
+    for reference, candidate in zip(references, candidates):
+
+        num_references += len(reference)
+
+        if len(candidate) == 0:
+            continue
+
+        order = np.argsort(-candidate.conf)
+        iou = box_iou(candidate.xywhn[order], reference.xywhn)
+        used = np.zeros(len(reference), dtype=bool)
+
+        for i, k in enumerate(order):
+
+            scores.append(candidate.conf[k])
+
+            valid = ~used & (reference.cls == candidate.cls[k]) & (iou[i] >= iou_threshold)
+
+            if valid.any():
+                j = np.argmax(np.where(valid, iou[i], -1))
+                used[j] = True
+                matches.append(1)
+            else:
+                matches.append(0)
+
+    if num_references == 0:
+        return np.nan
+
+    if not scores:
+        return 0.0
+
+    matches = np.array(matches)[np.argsort(-np.array(scores))]
+
+    true_positives = np.cumsum(matches)
+    precision = true_positives / np.arange(1, len(matches) + 1)
+    recall = true_positives / num_references
+
+    # All points interpolation (as in ultralytics / COCO)
+    recall = np.concatenate(([0.0], recall, [1.0]))
+    precision = np.concatenate(([1.0], precision, [0.0]))
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+
+    return float(np.sum((recall[1:] - recall[:-1]) * precision[1:]))
+
+def run_model(ai_model, frames, configuration):
+
+    detections = []
+    latencies = []
+
+    # Warm up => first inference includes allocations and graph compilation
+    ai_model.predict(frames[0], imgsz=(configuration.ai_detection['image_width'], configuration.ai_detection['image_height']), conf=configuration.ai_detection['min_confidence'], verbose=False)
+
+    for frame in frames:
+
+        s = perf_counter()
+        prediction = ai_model.predict(frame, imgsz=(configuration.ai_detection['image_width'], configuration.ai_detection['image_height']), conf=configuration.ai_detection['min_confidence'], verbose=False)[0]
+        latencies.append(perf_counter() - s)
+
+        detections.append(Detections.from_prediction(prediction))
+
+    return detections, np.array(latencies)
+
+def main():
+
+    parser = argparse.ArgumentParser(prog='ai_model_compare.py')
+
+    parser.add_argument('-f', '--folder', help='Folder searched for _original.jpg images',
+                        required=False, default=DATA_FOLDER)
+    parser.add_argument('-n', '--num_images', help='Number of images compared',
+                        required=False, type=int, default=200)
+    parser.add_argument('-b', '--backend', help='Backend of the compared model',
+                        required=False, choices=list(AI_BACKENDS), default='openvino')
+    parser.add_argument('-q', '--quantization', help='Quantization of the compared model',
+                        required=False, choices=['fp32', 'int8'], default='int8')
+
+    args = parser.parse_args()
+
+    from ultralytics import YOLO
+
+    configuration = Configuration2()
+    configuration.ai_detection['backend'] = args.backend
+    configuration.ai_detection['quantization'] = args.quantization
+
+    images = find_original_images(args.folder)
+
+    if not images:
+        print(f'No _original.jpg image found in {args.folder}')
+        return
+
+    step = max(1, len(images) // args.num_images)
+    images = images[::step][:args.num_images]
+
+    # Same input as the detection during the capture => lores RGB frame
+    frames = [cvtColor(resize(imread(image), (configuration.ai_detection['image_width'], configuration.ai_detection['image_height'])), COLOR_BGR2RGB) for image in images]
+
+    candidate_path = get_ai_model_path(configuration)
+
+    print(f'Reference: {AI_MODEL}')
+    print(f'Candidate: {candidate_path}')
+    print(f'Images: {len(frames)} from {args.folder}')
+
+    references, reference_latencies = run_model(YOLO(AI_MODEL, task='detect'), frames, configuration)
+    candidates, candidate_latencies = run_model(YOLO(candidate_path, task='detect'), frames, configuration)
+
+    aps = [average_precision(references, candidates, iou_threshold) for iou_threshold in IOU_THRESHOLDS]
+
+    print(f'\nmAP50 (candidate vs reference): {aps[0]:.3f} => drift {1 - aps[0]:.3f}')
+    print(f'mAP50-95 (candidate vs reference): {np.nanmean(aps):.3f} => drift {1 - np.nanmean(aps):.3f}')
+    print(f'Boxes: reference {sum(len(d) for d in references)}, candidate {sum(len(d) for d in candidates)}')
+
+    print('\nLatency (ms)    mean     p50     p95')
+    for name, latencies in (('reference', reference_latencies), ('candidate', candidate_latencies)):
+        print(f'{name:12s} {1000 * latencies.mean():7.1f} {1000 * np.percentile(latencies, 50):7.1f} {1000 * np.percentile(latencies, 95):7.1f}')
+
+    print(f'\nSpeed up: x{reference_latencies.mean() / candidate_latencies.mean():.2f}')
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,381 @@
+#! /usr/bin/python3
+
+import os
+import csv
+from json import dumps
+from time import time, perf_counter
+from datetime import datetime
+from collections import deque
+from contextlib import contextmanager
+from queue import Queue, Empty
+from threading import Thread, Lock, Event, current_thread, get_native_id
+
+import logging
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_capture_metrics')
+logger.setLevel(logging.INFO)
+h = logging.FileHandler(os.path.join(today_log_path, TODAY + '_' + this_script + '.log'))
+f = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+h.setFormatter(f)
+logger.addHandler(h)
+
+# Duration of each stage of a capture (spans), recorded by the capture loop, the pipeline
+# workers, the camera and the file writer
+#
+# Every interval seconds, one line per stage is appended to the night CSV file
+# (count and total over the interval, percentiles over the last window durations)
+# and the Prometheus textfile (node_exporter textfile collector) is written again
+#
+# Stages of images_capture2:
+# wait_frame => capture_request() (LEDs sync and burst included), yuv_to_rgb => lores conversion,
+# copy_main => copy of the main frame, inference => model (thread) or model in the inference process,
+# detection_latency => capture to detections, jpeg_encode => each JPEG, file_write => each file,
+# leds_on => LEDs switched on for the capture, capture => LEDs on to frames submitted to the pipeline
+#
+# Stages of sounds_capture2:
+# record => recording of a file, wav_write => WAV file written
+#
+# With trace enabled (images_capture/sounds_capture 'trace'), each span is also written to a
+# Chrome trace-event JSON file, one file per hour (chrome://tracing, https://ui.perfetto.dev)
+
+QUANTILES = [0.5, 0.9, 0.99]
+
+CSV_HEADER = ['date', 'time', 'stage', 'count', 'total_s', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms']
+
+def percentile(sorted_values, q):
+
+    # Nearest rank => no interpolation, always a measured duration
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+class Stage():
+
+    def __init__(self, window):
+
+        self.durations = deque(maxlen=window)
+
+        # Since the last report
+        self.count = 0
+        self.total = 0.0
+
+        # Since start => Prometheus counters
+        self.num_total = 0
+        self.sum_total = 0.0
+
+    def add(self, duration):
+
+        self.durations.append(duration)
+        self.count += 1
+        self.total += duration
+        self.num_total += 1
+        self.sum_total += duration
+
+    def report(self):
+
+        durations = sorted(self.durations)
+
+        report = {'count': self.count,
+                  'total': self.total,
+                  'num_total': self.num_total,
+                  'sum_total': self.sum_total,
+                  'mean': sum(durations) / len(durations) if durations else 0.0,
+                  'max': durations[-1] if durations else 0.0,
+                  'quantiles': [percentile(durations, q) if durations else 0.0 for q in QUANTILES]}
+
+        self.count = 0
+        self.total = 0.0
+
+        return report
+
+class CaptureTrace():
+
+    # Spans queued by the recording threads, written by one thread
+    # Complete events ('X') => begin time and duration of the span in a single event
+    # Array format: the closing ] is optional => a file cut by a power failure stays readable
+
+    flush_interval = 5
+
+    def __init__(self, name, folder):
+
+        self.name = name
+        self.folder = folder
+
+        self.pid = os.getpid()
+
+        self.queue = Queue()
+        self.thread = None
+
+        self.file = None
+        self.file_hour = None
+        self.thread_names = set()
+
+        self.num_events = 0
+
+    def start(self):
+
+        if not self.thread:
+            self.thread = Thread(target=self.writer, name='capture_trace', daemon=True)
+            self.thread.start()
+
+            logger.info(f'{self.name} trace => {self.folder}')
+
+    def stop(self):
+
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+            logger.info(f'{self.num_events} {self.name} trace events written')
+
+    def add(self, stage, start, duration):
+
+        thread = current_thread()
+        self.queue.put((stage, start, duration, get_native_id(), thread.name))
+
+    def open(self, hour):
+
+        self.close()
+
+        # File name: YYYYMMDD_HH_images_capture_trace.json (_N if the script restarted within the hour)
+        file_path = os.path.join(self.folder, hour + '_' + self.name + '_trace.json')
+        n = 1
+        while os.path.exists(file_path):
+            file_path = os.path.join(self.folder, f'{hour}_{self.name}_trace_{n}.json')
+            n += 1
+
+        self.file = open(file_path, 'w')
+        self.file_hour = hour
+        self.thread_names = set()
+
+        self.file.write('[\n')
+        self.write_event({'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'args': {'name': self.name}}, first=True)
+
+    def close(self):
+
+        if self.file:
+            self.file.write('\n]\n')
+            self.file.close()
+            self.file = None
+
+    def write_event(self, event, first=False):
+
+        self.file.write(('' if first else ',\n') + dumps(event, separators=(',', ':')))
+
+    def write(self, stage, start, duration, tid, thread_name):
+
+        # Time of the start of the span => one file per hour
+        hour = datetime.fromtimestamp(start).strftime('%Y%m%d_%H')
+        if hour != self.file_hour:
+            self.open(hour)
+
+        if tid not in self.thread_names:
+            self.write_event({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': thread_name}})
+            self.thread_names.add(tid)
+
+        self.write_event({'name': stage, 'cat': self.name, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                          'ts': round(1E6 * start), 'dur': round(1E6 * duration)})
+
+        self.num_events += 1
+
+    def writer(self):
+
+        running = True
+        last_flush_time = time()
+
+        while running:
+
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except Empty:
+                item = False
+
+            if item is None:
+                running = False
+            elif item:
+                try:
+                    self.write(*item)
+                except OSError as e:
+                    logger.error(f'{self.name} trace event not written')
+                    logger.error(str(e))
+                    self.file = None
+                    self.file_hour = None
+
+            # Events written to the disk every flush_interval seconds, not for each span
+            if self.file and time() - last_flush_time >= self.flush_interval:
+                try:
+                    self.file.flush()
+                except OSError as e:
+                    logger.error(str(e))
+                last_flush_time = time()
+
+        try:
+            self.close()
+        except OSError as e:
+            logger.error(str(e))
+
+class CaptureMetrics():
+
+    def __init__(self, configuration, name, folder, trace=False):
+
+        self.name = name
+
+        self.enable = configuration.metrics['enable']
+        self.interval = configuration.metrics['interval']
+        self.window = configuration.metrics['window']
+
+        # File name: YYYYMMDD_images_capture_metrics.csv
+        self.csv_file_path = os.path.join(folder, TODAY + '_' + name + '_metrics.csv')
+
+        prometheus_folder = configuration.metrics['prometheus_folder']
+        if prometheus_folder and os.path.isdir(prometheus_folder) and os.access(prometheus_folder, os.W_OK):
+            self.prometheus_file_path = os.path.join(prometheus_folder, 'entomoscope_' + name + '.prom')
+        else:
+            self.prometheus_file_path = None
+
+        self.stages = {}
+        self.lock = Lock()
+
+        self.thread = None
+        self.stop_event = Event()
+
+        self.trace = CaptureTrace(name, folder) if trace else None
+
+    def __bool__(self):
+
+        # Metrics and trace disabled => if self.metrics: ... skips the timing
+        return self.enable or self.trace is not None
+
+    def start(self):
+
+        if self.trace:
+            self.trace.start()
+
+        if self.enable and not self.thread:
+
+            self.stop_event.clear()
+            self.thread = Thread(target=self.reporter, name='capture_metrics', daemon=True)
+            self.thread.start()
+
+            logger.info(f'{self.name} metrics every {self.interval} seconds => {self.csv_file_path}')
+            if self.prometheus_file_path:
+                logger.info(f'{self.name} metrics => {self.prometheus_file_path}')
+
+    def stop(self):
+
+        if self.thread:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+            # Last interval
+            self.report()
+
+        if self.trace:
+            self.trace.stop()
+
+    def record(self, stage, duration):
+
+        # Span ending now
+        if self.trace:
+            self.trace.add(stage, time() - duration, duration)
+
+        if not self.enable:
+            return
+
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Stage(self.window)
+            self.stages[stage].add(duration)
+
+    @contextmanager
+    def span(self, stage):
+
+        s = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, perf_counter() - s)
+
+    def reporter(self):
+
+        while not self.stop_event.wait(self.interval):
+            self.report()
+
+    def report(self):
+
+        with self.lock:
+            reports = {stage: self.stages[stage].report() for stage in sorted(self.stages)}
+
+        if not reports:
+            return
+
+        try:
+            self.write_csv(reports)
+        except OSError as e:
+            logger.error(f'{self.csv_file_path} not written')
+            logger.error(str(e))
+
+        if self.prometheus_file_path:
+            try:
+                self.write_prometheus(reports)
+            except OSError as e:
+                logger.error(f'{self.prometheus_file_path} not written')
+                logger.error(str(e))
+
+    def write_csv(self, reports):
+
+        now = datetime.now()
+
+        rows = []
+        for stage, report in reports.items():
+            # Stage without span during the interval => not written
+            if report['count']:
+                rows.append([now.strftime('%Y/%m/%d'), now.strftime('%H:%M:%S'), stage, report['count'], f"{report['total']:.3f}",
+                             f"{1000 * report['mean']:.2f}", *[f'{1000 * value:.2f}' for value in report['quantiles']], f"{1000 * report['max']:.2f}"])
+
+        if not rows:
+            return
+
+        new_file = not os.path.exists(self.csv_file_path)
+
+        with open(self.csv_file_path, 'a', encoding='UTF-8', newline='') as csv_file:
+
+            writer = csv.writer(csv_file, delimiter=';')
+
+            if new_file:
+                writer.writerow(CSV_HEADER)
+
+            writer.writerows(rows)
+
+    def write_prometheus(self, reports):
+
+        metric = 'entomoscope_stage_duration_seconds'
+
+        lines = [f'# HELP {metric} Duration of the capture stages (quantiles over the last spans)',
+                 f'# TYPE {metric} summary']
+
+        for stage, report in reports.items():
+            labels = f'script="{self.name}",stage="{stage}"'
+            for q, value in zip(QUANTILES, report['quantiles']):
+                lines.append(f'{metric}{{{labels},quantile="{q}"}} {value:.6f}')
+            lines.append(f"{metric}_sum{{{labels}}} {report['sum_total']:.6f}")
+            lines.append(f"{metric}_count{{{labels}}} {report['num_total']}")
+
+        lines.append('# HELP entomoscope_metrics_timestamp_seconds Time of the last metrics update')
+        lines.append('# TYPE entomoscope_metrics_timestamp_seconds gauge')
+        lines.append(f'entomoscope_metrics_timestamp_seconds{{script="{self.name}"}} {time():.0f}')
+
+        # Same HELP lines in every file => several scripts can share the textfile collector
+        # Written then renamed => node_exporter never reads a partial file
+        tmp_file_path = self.prometheus_file_path + '.tmp'
+        with open(tmp_file_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_file_path, self.prometheus_file_path)
@@ -0,0 +1,60 @@
+#! /usr/bin/python3
+
+import os
+
+import logging
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_capture_scheduler')
+logger.setLevel(logging.INFO)
+h = logging.FileHandler(os.path.join(today_log_path, TODAY + '_' + this_script + '.log'))
+f = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+h.setFormatter(f)
+logger.addHandler(h)
+
+class CaptureScheduler():
+
+    # Time between two captures adapted to the activity seen by the pipeline
+    # Activity (detection or motion) => min_time_step
+    # No activity => time step multiplied by backoff after each capture, up to max_time_step
+
+    def __init__(self, configuration):
+
+        self.enable = configuration.images_capture['adaptive']['enable']
+        self.min_time_step = configuration.images_capture['adaptive']['min_time_step']
+        self.max_time_step = configuration.images_capture['adaptive']['max_time_step']
+        self.backoff = configuration.images_capture['adaptive']['backoff']
+
+        self.default_time_step = configuration.images_capture['time_step']
+
+        self.reset()
+
+    def reset(self):
+
+        self.time_step = self.default_time_step
+
+    def update(self, activity):
+
+        if not self.enable:
+            return self.time_step
+
+        previous_time_step = self.time_step
+
+        if activity:
+            self.time_step = self.min_time_step
+        else:
+            self.time_step = min(self.max_time_step, max(self.min_time_step, self.time_step * self.backoff))
+
+        if activity and previous_time_step != self.time_step:
+            logger.info(f'activity => time step {self.time_step} seconds')
+        elif self.time_step == self.max_time_step and previous_time_step != self.time_step:
+            logger.info(f'no activity => time step {self.time_step} seconds')
+
+        return self.time_step
@@ -6,9 +6,22 @@ from json import load, dump
 
 DEFAULT_CONFIGURATION_FILE = 'configuration2.json'
 
+def merge_values(default, value):
+
+    # Values of the file, default values for the keys it does not have
+    merged = dict(default)
+
+    for key, item in value.items():
+        if isinstance(merged.get(key), dict) and isinstance(item, dict):
+            merged[key] = merge_values(merged[key], item)
+        else:
+            merged[key] = item
+
+    return merged
+
 class Configuration2():
 
-    _attributes = {'ai_detection', 'camera', 'cooling_system', 'ephemeris', 'files', 'gnss', 'images_capture', 'laser', 'leds', 'microphone', 'monitor_environment', 'schedule', 'site', 'server', 'sounds_capture'}
+    _attributes = {'ai_detection', 'camera', 'cooling_system', 'ephemeris', 'files', 'gnss', 'images_capture', 'laser', 'leds', 'metrics', 'microphone', 'monitor_environment', 'schedule', 'site', 'server', 'sounds_capture'}
 
     def __init__(self, configuration_file=DEFAULT_CONFIGURATION_FILE):
 
@@ -26,9 +39,15 @@ class Configuration2():
     def read(self):
 
         with open(self.configuration_file, 'r') as f:
-            self.configuration = load(f)
+            configuration = load(f)
+
+        # Sections and keys missing in a file written by a previous version => default values
+        self.set_default_values()
+
+        self.configuration = configuration
 
         for attr in self._attributes:
+            self.configuration[attr] = merge_values(getattr(self, attr), configuration.get(attr, {}))
             setattr(self, attr, self.configuration[attr])
 
     def save(self):
@@ -38,12 +57,57 @@ class Configuration2():
 
     def create_configuration_file(self):
 
+        self.set_default_values()
+
+        self.configuration = {key: None for key in self._attributes}
+
+        for attr in self._attributes:
+            self.configuration[attr] = getattr(self, attr)
+
+        self.save()
+
+    def set_default_values(self):
+
         setattr(self, 'ai_detection', {
+                        'backend': 'pytorch',
+                        'calibration_images': 300,
+                        'cascade': {
+                            'batch_size': 0,
+                            'margin': 0.5,
+                            'merge_threshold': 0.5,
+                            'proposal_confidence': 0.1
+                        },
                         'enable': False,
                         'min_confidence': 0.8,
                         'image_height': 320,
                         "image_scale": 1.0,
-                        'image_width': 320
+                        'image_width': 320,
+                        'lazy_main': True,
+                        'mode': 'lores',
+                        'motion_gate': {
+                            'background_alpha': 0.05,
+                            'changed_ratio': 0.002,
+                            'enable': False,
+                            'keyframe_interval': 60,
+                            'pixel_threshold': 25
+                        },
+                        'quantization': 'fp32',
+                        'ring_size': 4,
+                        'tiled': {
+                            'batch_size': 0,
+                            'merge_threshold': 0.5,
+                            'overlap': 0.2,
+                            'tile_size': 640
+                        },
+                        'tracker': {
+                            'centroid_distance': 0.5,
+                            'confidence_gain': 0.05,
+                            'enable': False,
+                            'iou_threshold': 0.3,
+                            'max_age': 120,
+                            'refresh_interval': 600
+                        },
+                        'worker': 'thread'
                         })
 
         setattr(self, 'camera', {
@@ -64,6 +128,7 @@ class Configuration2():
                             'flicker_mode': 'Off',
                             'flicker_period': 10000
                         },
+                        'frame_pool_size': 'auto',
                         'image_adjustments': {
                             'brightness': 0.0,
                             'contrast': 1.0,
@@ -95,7 +160,24 @@ class Configuration2():
                         })
 
         setattr(self, 'files', {
-                            'jpeg_quality': 95
+                            'jpeg_encoder': 'auto',
+                            'jpeg_quality': 95,
+                            'metadata': 'json',
+                            'migration': {
+                                'enable': True,
+                                'max_duration': 240,
+                                'min_age': 600
+                            },
+                            'write_behind': {
+                                'check_interval': 30,
+                                'drop_crops_free_mb': 2000,
+                                'enable': True,
+                                'fsync_interval': 5,
+                                'low_quality': 70,
+                                'low_quality_free_mb': 1000,
+                                'pause_free_mb': 300,
+                                'queue_size': 64
+                            }
                         })
 
         setattr(self, 'gnss', {
@@ -110,9 +192,25 @@ class Configuration2():
                         })
 
         setattr(self, 'images_capture', {
+                            'adaptive': {
+                                'backoff': 1.5,
+                                'enable': False,
+                                'max_time_step': 30,
+                                'min_time_step': 1
+                            },
+                            'burst_frames': 1,
+                            'crop_workers': 4,
                             'enable': False,
+                            'index': {
+                                'batch_size': 32,
+                                'enable': True,
+                                'flush_interval': 10
+                            },
                             'mode': 'trap',
-                            'time_step': 5
+                            'queue_size': 4,
+                            'save_workers': 2,
+                            'time_step': 5,
+                            'trace': False
                         })
 
         setattr(self, 'laser', {
@@ -123,7 +221,15 @@ class Configuration2():
                             'delay_off': 0,
                             'delay_on': 0,
                             'intensity_front': 0,
-                            'intensity_rear_deported_uv': 90
+                            'intensity_rear_deported_uv': 90,
+                            'sync': False
+                        })
+
+        setattr(self, 'metrics', {
+                            'enable': True,
+                            'interval': 60,
+                            'prometheus_folder': '/var/lib/prometheus/node-exporter',
+                            'window': 1000
                         })
 
         setattr(self, 'microphone', {
@@ -159,16 +265,10 @@ class Configuration2():
 
         setattr(self, 'sounds_capture', {
                             'duration': 3,
-                            'enable': False
+                            'enable': False,
+                            'trace': False
                         })
 
-        self.configuration = {key: None for key in self._attributes}
-
-        for attr in self._attributes:
-            self.configuration[attr] = getattr(self, attr)
-
-        self.save()
-
     def get(self):
 
         return self.configuration
@@ -17,3 +17,16 @@ for job in cron:
         print(job)
 
 
+
+# Migration of the data saved on the SD card to the external disk (see data_migration.py)
+migration_minute = 5
+migration_comment = f'Move SD card data to the external disk every {migration_minute} minutes'
+migration_command = '/usr/bin/python /home/entomoscope/Entomoscope/data_migration.py 2>&1 | logger -t data_mig_entomoscope'
+
+if not any(job.comment.startswith('Move SD card data to the external disk every') for job in cron):
+
+    job = cron.new(command=migration_command, comment=migration_comment)
+    job.minute.every(migration_minute)
+
+    cron.write()
+    print(job)
@@ -0,0 +1,342 @@
+#! /usr/bin/python3
+
+import os
+import fcntl
+import hashlib
+from json import dumps, loads
+from time import time
+from subprocess import run
+
+import logging
+from logging.handlers import RotatingFileHandler
+
+from configuration2 import Configuration2
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY, DESKTOP_FOLDER, EXTERNAL_DISK_FOLDER
+
+# Files saved on the SD card (external disk missing or not writable at boot) are moved
+# to the external disk as soon as it is available
+#
+# Each file is copied to a .part file, synced, hashed back and renamed before the source is deleted
+# Every step is appended to a journal on the SD card => a power cut mid-copy is resumed at the next run
+#
+# Scripts started once the disk is mounted write the same relative paths on it (environment CSV,
+# metrics, detections.sqlite...) => an existing destination is never overwritten, the SD card copy
+# is renamed with the _sd suffix (_sd1, _sd2... if needed), or just deleted if both files are identical
+#
+# This scripts should be run in background using crontab
+# Use "crontab -e" to edit the crontab file
+# Use "crontab -l" to see the crontab file content
+
+# Job added by crontab_management.py, or to run the script every 5 minutes (CPU and IO priorities lowered by the script), add this line in the crontab file:
+# */5 * * * * /usr/bin/python /home/entomoscope/Entomoscope/data_migration.py 2>&1 | logger -t data_mig_entomoscope
+
+# To search for all errors
+# journalctl -t data_mig_entomoscope
+
+SD_DATA_FOLDER = os.path.join(DESKTOP_FOLDER, 'Data')
+
+JOURNAL_FILE = os.path.join(SD_DATA_FOLDER, 'migration_journal.jsonl')
+LOCK_FILE = os.path.join(SD_DATA_FOLDER, 'migration.lock')
+
+PART_SUFFIX = '.part'
+
+# Added to the name of an SD card file whose destination already exists on the external disk
+CONFLICT_SUFFIX = '_sd'
+
+CHUNK_SIZE = 1024 * 1024
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_data_migration')
+filename = os.path.join(today_log_path, TODAY + '_' + this_script + '.log')
+file_handler = RotatingFileHandler(filename, mode="a", maxBytes=50000, backupCount=100, encoding="utf-8")
+logger.addHandler(file_handler)
+formatter = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+file_handler.setFormatter(formatter)
+logger.setLevel("DEBUG")
+
+def lower_priority():
+
+    os.nice(19)
+
+    # Idle IO class => the capture scripts always get the disks first
+    try:
+        run(['ionice', '-c', '3', '-p', str(os.getpid())], check=False)
+    except OSError:
+        pass
+
+def file_hash(file_path):
+
+    # BLAKE2b => fast on the Raspberry Pi CPU, no extra dependency
+    h = hashlib.blake2b(digest_size=16)
+
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+def conflict_free_path(file_path):
+
+    # data.csv => data_sd.csv, data_sd1.csv... first name not used yet
+    root, extension = os.path.splitext(file_path)
+
+    candidate = root + CONFLICT_SUFFIX + extension
+    index = 1
+    while os.path.exists(candidate) or os.path.exists(candidate + PART_SUFFIX):
+        candidate = f'{root}{CONFLICT_SUFFIX}{index}{extension}'
+        index += 1
+
+    return candidate
+
+def sync_folder(folder):
+
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Journal():
+
+    # Append only, one JSON line per step, synced after each line
+    # copying => .part file may be incomplete, verified => destination complete, done => source deleted
+
+    def __init__(self, journal_file_path=JOURNAL_FILE):
+
+        self.journal_file_path = journal_file_path
+        self.file = None
+
+    def pending(self):
+
+        # Last state of each file not done
+        states = {}
+
+        if os.path.exists(self.journal_file_path):
+            with open(self.journal_file_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = loads(line)
+                    except ValueError:
+                        # Last line cut by a power failure
+                        continue
+                    states[entry['source']] = entry
+
+        return [entry for entry in states.values() if entry['state'] != 'done']
+
+    def open(self):
+
+        self.file = open(self.journal_file_path, 'a')
+
+    def append(self, state, source, destination, digest=None):
+
+        self.file.write(dumps({'state': state, 'source': source, 'destination': destination, 'hash': digest, 'time': time()}) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self, compact=False):
+
+        self.file.close()
+        self.file = None
+
+        # Everything done => the journal starts again empty
+        if compact and not self.pending():
+            os.remove(self.journal_file_path)
+
+class Migration():
+
+    def __init__(self, configuration, source_folder=SD_DATA_FOLDER, destination_folder=EXTERNAL_DISK_FOLDER):
+
+        self.source_folder = source_folder
+        self.destination_folder = destination_folder
+
+        self.min_age = configuration.files['migration']['min_age']
+        self.max_duration = configuration.files['migration']['max_duration']
+
+        self.journal = Journal()
+
+        self.num_files = 0
+        self.num_bytes = 0
+
+    def destination_available(self):
+
+        return os.path.ismount(self.destination_folder) and os.access(self.destination_folder, os.W_OK)
+
+    def completed_files(self):
+
+        # Files not modified for min_age seconds => no more written by the capture scripts
+        now = time()
+
+        for root, dirs, files in os.walk(self.source_folder):
+
+            dirs.sort()
+
+            for file in sorted(files):
+
+                file_path = os.path.join(root, file)
+
+                if file_path in (JOURNAL_FILE, LOCK_FILE):
+                    continue
+
+                # SQLite index still opened => its -wal file exists
+                if os.path.exists(file_path + '-wal') or file.endswith('-wal') or file.endswith('-shm'):
+                    continue
+
+                try:
+                    if now - os.path.getmtime(file_path) >= self.min_age:
+                        yield file_path
+                except OSError:
+                    continue
+
+    def move(self, source, digest=None):
+
+        destination = os.path.join(self.destination_folder, os.path.relpath(source, self.source_folder))
+
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+        if digest is None:
+            digest = file_hash(source)
+
+        if os.path.exists(destination):
+
+            # Same content already on the external disk => only the source is deleted
+            if file_hash(destination) == digest:
+                logger.info(f'{source} already on the external disk')
+                self.journal.append('verified', source, destination, digest)
+                self.delete_source(source, destination, digest)
+                return
+
+            # Newer data written on the external disk => kept, the SD card copy is renamed
+            destination = conflict_free_path(destination)
+            logger.warning(f'{source} moved to {destination} (destination already exists)')
+
+        part = destination + PART_SUFFIX
+
+        self.journal.append('copying', source, destination, digest)
+
+        with open(source, 'rb') as f_source, open(part, 'wb') as f_part:
+            while chunk := f_source.read(CHUNK_SIZE):
+                f_part.write(chunk)
+            f_part.flush()
+            os.fsync(f_part.fileno())
+
+        # Copy hashed again before the source is deleted
+        if file_hash(part) != digest:
+            os.remove(part)
+            raise IOError(f'hash mismatch for {part}')
+
+        # Destination created since the check above => never overwritten
+        if os.path.exists(destination):
+            os.remove(part)
+            raise FileExistsError(f'{destination} created during the copy => migration retried at next run')
+
+        os.replace(part, destination)
+        sync_folder(os.path.dirname(destination))
+
+        self.journal.append('verified', source, destination, digest)
+
+        self.delete_source(source, destination, digest)
+
+    def delete_source(self, source, destination, digest):
+
+        os.remove(source)
+
+        self.journal.append('done', source, destination, digest)
+
+        self.num_files += 1
+        self.num_bytes += os.path.getsize(destination)
+
+    def resume(self):
+
+        # Steps interrupted by the previous run (power cut, disk removed)
+        for entry in self.journal.pending():
+
+            source, destination, digest = entry['source'], entry['destination'], entry['hash']
+
+            try:
+                if entry['state'] == 'verified':
+                    if os.path.exists(source):
+                        self.delete_source(source, destination, digest)
+                    else:
+                        self.journal.append('done', source, destination, digest)
+                    logger.info(f'{source} migration completed')
+                else:
+                    if os.path.exists(destination + PART_SUFFIX):
+                        os.remove(destination + PART_SUFFIX)
+                    if os.path.exists(source):
+                        logger.info(f'{source} copy restarted')
+                        self.move(source)
+                    else:
+                        self.journal.append('done', source, destination, digest)
+            except OSError as e:
+                # Retried at next run, the other files are migrated
+                logger.error(f'{source} migration not resumed')
+                logger.error(str(e))
+
+    def run(self):
+
+        start_time = time()
+
+        self.journal.open()
+
+        try:
+
+            self.resume()
+
+            for source in self.completed_files():
+
+                if time() - start_time > self.max_duration:
+                    logger.info('maximum duration reached => migration continued at next run')
+                    break
+
+                try:
+                    self.move(source)
+                except OSError as e:
+                    logger.error(f'{source} not migrated')
+                    logger.error(str(e))
+                    if not self.destination_available():
+                        logger.error('external disk not available any more')
+                        break
+
+        finally:
+
+            self.journal.close(compact=True)
+
+        if self.num_files:
+            logger.info(f'{self.num_files} files ({self.num_bytes / 1E6:.1f} MB) moved to {self.destination_folder} in {time() - start_time:.0f} seconds')
+
+def main():
+
+    configuration = Configuration2()
+
+    if not configuration.files['migration']['enable']:
+        return
+
+    if not os.path.exists(SD_DATA_FOLDER):
+        return
+
+    migration = Migration(configuration)
+
+    if not migration.destination_available():
+        return
+
+    lower_priority()
+
+    # Only one migration at a time (a run can last longer than the crontab period)
+    with open(LOCK_FILE, 'w') as lock:
+
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+
+        migration.run()
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,308 @@
+#! /usr/bin/python3
+
+import os
+import argparse
+import sqlite3
+import csv
+from json import dumps, loads
+from time import time
+from queue import Queue, Empty
+from threading import Thread
+
+import logging
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY, IMAGES_CAPTURE_FOLDER, ENVIRONMENT_MONITORING_FOLDER
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_detection_index')
+logger.setLevel(logging.INFO)
+h = logging.FileHandler(os.path.join(today_log_path, TODAY + '_' + this_script + '.log'))
+f = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+h.setFormatter(f)
+logger.addHandler(h)
+
+# One SQLite database per night in the images capture folder, append only
+# captures => one row per saved detection, boxes => one row per box
+# A capture detected again (images_redetection.py) gets new rows, the previous ones are kept
+# => latest_captures: last row of each capture, without the captures left with no box
+#
+# Usage: python3 detection_index.py [-f images_capture_folder]
+
+INDEX_FILE = 'detections.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    file_path TEXT NOT NULL,
+    files TEXT NOT NULL,
+    num_boxes INTEGER NOT NULL,
+    exposure_time INTEGER,
+    analogue_gain REAL,
+    lux REAL,
+    colour_temperature INTEGER,
+    environment TEXT,
+    source TEXT NOT NULL DEFAULT 'capture'
+);
+CREATE TABLE IF NOT EXISTS boxes (
+    capture_id INTEGER NOT NULL REFERENCES captures(id),
+    box_num INTEGER NOT NULL,
+    track_id INTEGER,
+    cls INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    w REAL NOT NULL,
+    h REAL NOT NULL,
+    conf REAL NOT NULL,
+    file_name TEXT
+);
+CREATE INDEX IF NOT EXISTS captures_timestamp ON captures(timestamp);
+CREATE INDEX IF NOT EXISTS captures_file_path ON captures(file_path);
+CREATE INDEX IF NOT EXISTS boxes_capture_id ON boxes(capture_id);
+CREATE INDEX IF NOT EXISTS boxes_track_id ON boxes(track_id);
+'''
+
+# Created once the columns added since the first index version exist
+VIEWS = '''
+CREATE VIEW IF NOT EXISTS latest_captures AS
+    SELECT * FROM captures
+    WHERE id IN (SELECT MAX(id) FROM captures GROUP BY file_path) AND num_boxes > 0;
+'''
+
+# Columns added to the indexes written before them
+COLUMNS = {'source': "TEXT NOT NULL DEFAULT 'capture'"}
+
+def open_index(index_file_path):
+
+    connection = sqlite3.connect(index_file_path, check_same_thread=False)
+
+    # WAL => readers (server, analysis) never block the writer
+    journal_mode = connection.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    if journal_mode.lower() != 'wal':
+        logger.warning(f'WAL mode not available on this disk => journal mode {journal_mode}')
+
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(captures)')]
+    for column, definition in COLUMNS.items():
+        if column not in columns:
+            connection.execute(f'ALTER TABLE captures ADD COLUMN {column} {definition}')
+            logger.info(f'column {column} added to {index_file_path}')
+
+    connection.executescript(VIEWS)
+    connection.commit()
+
+    return connection
+
+def make_record(timestamp, file_path, files, detections, box_files, metadata, environment=None, source='capture'):
+
+    # => (capture row, box rows) for write_records()
+    # source => 'capture' (images_capture2.py) or 'redetection' (images_redetection.py)
+    metadata = metadata or {}
+
+    boxes = []
+    for i, ((x, y, w, h), conf, cls) in enumerate(zip(detections.xywhn.tolist(), detections.conf.tolist(), detections.cls.tolist())):
+        track_id = int(detections.track_ids[i]) if detections.track_ids is not None else None
+        file_name = box_files.get(i + 1)
+        boxes.append((i + 1, track_id, cls, x, y, w, h, conf, file_name))
+
+    return ((timestamp, os.path.basename(file_path), dumps(files), len(detections),
+                metadata.get('ExposureTime'), metadata.get('AnalogueGain'), metadata.get('Lux'), metadata.get('ColourTemperature'),
+                dumps(environment) if environment else None, source),
+            boxes)
+
+def write_records(connection, records):
+
+    # One transaction, rows only added
+    with connection:
+        for capture, boxes in records:
+            capture_id = connection.execute('INSERT INTO captures (timestamp, file_path, files, num_boxes, exposure_time, analogue_gain, lux, colour_temperature, environment, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', capture).lastrowid
+            connection.executemany('INSERT INTO boxes (capture_id, box_num, track_id, cls, x, y, w, h, conf, file_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [(capture_id, *box) for box in boxes])
+
+class EnvironmentSnapshot():
+
+    # Last line of the night environment CSV written by environment_monitoring.py
+    # Read again only when the file changed
+
+    def __init__(self, csv_file_path=os.path.join(ENVIRONMENT_MONITORING_FOLDER, TODAY + '_environment.csv')):
+
+        self.csv_file_path = csv_file_path
+        self.mtime = None
+        self.snapshot = None
+
+    def get(self):
+
+        try:
+            mtime = os.path.getmtime(self.csv_file_path)
+        except OSError:
+            return None
+
+        if mtime != self.mtime:
+
+            with open(self.csv_file_path, 'r', encoding='UTF-8', newline='') as csv_file:
+                rows = list(csv.reader(csv_file, delimiter=';'))
+
+            if len(rows) > 1:
+                self.snapshot = dict(zip(rows[0], rows[-1]))
+
+            self.mtime = mtime
+
+        return self.snapshot
+
+class DetectionIndex():
+
+    # Records queued by the save workers, written by one thread in batches
+    # => one transaction per batch_size records or per flush_interval seconds
+
+    def __init__(self, configuration, folder=IMAGES_CAPTURE_FOLDER):
+
+        self.index_file_path = os.path.join(folder, INDEX_FILE)
+
+        self.batch_size = configuration.images_capture['index']['batch_size']
+        self.flush_interval = configuration.images_capture['index']['flush_interval']
+
+        self.environment = EnvironmentSnapshot()
+
+        self.queue = Queue()
+        self.thread = None
+
+        self.num_records = 0
+
+    def start(self):
+
+        self.thread = Thread(target=self.writer, name='detection_index', daemon=True)
+        self.thread.start()
+
+        logger.info(f'detection index => {self.index_file_path}')
+
+    def stop(self):
+
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+            logger.info(f'{self.num_records} records written to {self.index_file_path}')
+
+    def add(self, timestamp, file_path, files, detections, box_files, metadata):
+
+        self.queue.put(make_record(timestamp, file_path, files, detections, box_files, metadata, self.environment.get()))
+
+    def writer(self):
+
+        connection = open_index(self.index_file_path)
+
+        running = True
+
+        while running:
+
+            records = []
+            deadline = time() + self.flush_interval
+
+            while len(records) < self.batch_size:
+                try:
+                    record = self.queue.get(timeout=max(0, deadline - time()))
+                except Empty:
+                    break
+                if record is None:
+                    running = False
+                    break
+                records.append(record)
+
+            if not records:
+                continue
+
+            try:
+
+                write_records(connection, records)
+
+                self.num_records += len(records)
+
+            except sqlite3.Error as e:
+
+                logger.error(f'{len(records)} records not written to {self.index_file_path}')
+                logger.error(str(e))
+
+        connection.close()
+
+class DetectionRecords(DetectionIndex):
+
+    # Records kept in memory and written by another process (images_replay.py)
+    # => one writer per index file, no "database is locked" between processes
+
+    def __init__(self, configuration, folder=IMAGES_CAPTURE_FOLDER):
+
+        super().__init__(configuration, folder)
+
+        self.records = []
+
+    def start(self):
+
+        pass
+
+    def stop(self):
+
+        self.num_records = len(self.records)
+
+    def add(self, timestamp, file_path, files, detections, box_files, metadata):
+
+        self.records.append(make_record(timestamp, file_path, files, detections, box_files, metadata, self.environment.get()))
+
+def read_captures(index_file_path, start=None, end=None):
+
+    # => list of captures (dict) with their boxes, between two timestamps, last detection of each capture
+    connection = sqlite3.connect(f'file:{index_file_path}?mode=ro', uri=True)
+    connection.row_factory = sqlite3.Row
+
+    limits = (start or 0, end or float('inf'))
+
+    query = 'SELECT * FROM latest_captures WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp'
+    captures = [dict(row) for row in connection.execute(query, limits)]
+
+    query = 'SELECT boxes.* FROM boxes JOIN latest_captures ON latest_captures.id = boxes.capture_id WHERE latest_captures.timestamp BETWEEN ? AND ? ORDER BY boxes.capture_id, boxes.box_num'
+    boxes = {}
+    for row in connection.execute(query, limits):
+        boxes.setdefault(row['capture_id'], []).append(dict(row))
+
+    connection.close()
+
+    for capture in captures:
+        capture['files'] = loads(capture['files'])
+        capture['environment'] = loads(capture['environment']) if capture['environment'] else None
+        capture['boxes'] = boxes.get(capture['id'], [])
+
+    return captures
+
+def main():
+
+    parser = argparse.ArgumentParser(prog='detection_index.py')
+
+    parser.add_argument('-f', '--folder', help='Images capture folder of the night',
+                        required=False, default=IMAGES_CAPTURE_FOLDER)
+
+    args = parser.parse_args()
+
+    index_file_path = os.path.join(args.folder, INDEX_FILE)
+
+    if not os.path.exists(index_file_path):
+        print(f'No detection index in {args.folder}')
+        return
+
+    s = time()
+    captures = read_captures(index_file_path)
+    print(f'{len(captures)} captures read in {1000 * (time() - s):.1f} ms')
+
+    if captures:
+        num_boxes = sum(capture['num_boxes'] for capture in captures)
+        num_tracks = len({box['track_id'] for capture in captures for box in capture['boxes'] if box['track_id']})
+        print(f'{num_boxes} boxes, {num_tracks} tracks')
+
+if __name__ == '__main__':
+
+    main()
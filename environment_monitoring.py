@@ -3,6 +3,7 @@ import os
 import logging
 import csv
 from datetime import datetime
+import hardware
 from gpiozero import CPUTemperature
 from globals_parameters import LOGS_DESKTOP_FOLDER, ENVIRONMENT_MONITORING_FOLDER, TODAY
 from sensors.sht31 import SHT31
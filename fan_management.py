@@ -7,6 +7,7 @@ from logging.handlers import RotatingFileHandler
 
 from datetime import datetime
 
+import hardware
 from gpiozero import CPUTemperature
 
 from configuration2 import Configuration2
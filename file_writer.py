@@ -0,0 +1,245 @@
+#! /usr/bin/python3
+
+import os
+import shutil
+from time import time, perf_counter
+from queue import Queue, Full, Empty
+from threading import Thread, Lock
+
+import logging
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_file_writer')
+logger.setLevel(logging.INFO)
+h = logging.FileHandler(os.path.join(today_log_path, TODAY + '_' + this_script + '.log'))
+f = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+h.setFormatter(f)
+logger.addHandler(h)
+
+# Storage levels, from the free space of the disk
+# normal => everything is written
+# drop_crops => the _box_N.jpg crops are not written any more
+# low_quality => crops dropped and images encoded with low_quality
+# paused => nothing written, captures paused
+STORAGE_LEVELS = ['normal', 'drop_crops', 'low_quality', 'paused']
+
+class FileWriter():
+
+    # Write-behind queue: encoded files are queued by the save workers and written by one thread
+    # => a slow disk (USB, ntfs-3g) delays the writer thread, not the capture loop
+    # Written files are fsynced together every fsync_interval seconds
+    # Without the writer thread (enable false), write() is called by the save and crop workers at the
+    # same time => counters and files to sync protected by a lock
+
+    def __init__(self, configuration, folder, metrics=None):
+
+        self.folder = folder
+        self.metrics = metrics
+
+        self.enable = configuration.files['write_behind']['enable']
+        self.queue_size = configuration.files['write_behind']['queue_size']
+        self.fsync_interval = configuration.files['write_behind']['fsync_interval']
+        self.check_interval = configuration.files['write_behind']['check_interval']
+
+        # Free space thresholds (MB) => drop_crops, low_quality, paused
+        self.thresholds = [configuration.files['write_behind']['drop_crops_free_mb'],
+                            configuration.files['write_behind']['low_quality_free_mb'],
+                            configuration.files['write_behind']['pause_free_mb']]
+        self.low_quality = configuration.files['write_behind']['low_quality']
+
+        self.queue = Queue(maxsize=self.queue_size)
+        self.thread = None
+
+        self.level = 0
+        self.last_check_time = 0
+
+        self.lock = Lock()
+
+        self.unsynced = []
+
+        self.num_files = 0
+        self.num_bytes = 0
+        self.num_dropped = 0
+        self.write_times = []
+        self.max_depth = 0
+
+        self.check_free_space()
+
+    @property
+    def drop_crops(self):
+
+        return self.level >= STORAGE_LEVELS.index('drop_crops')
+
+    @property
+    def quality(self):
+
+        # None => quality of the configuration
+        return self.low_quality if self.level >= STORAGE_LEVELS.index('low_quality') else None
+
+    @property
+    def paused(self):
+
+        # Without writer thread, write() is not called any more once paused => free space checked here
+        if not self.thread and self.level >= STORAGE_LEVELS.index('paused') and time() - self.last_check_time > self.check_interval:
+            self.check_free_space()
+
+        return self.level >= STORAGE_LEVELS.index('paused')
+
+    def check_free_space(self):
+
+        self.last_check_time = time()
+
+        try:
+            free = shutil.disk_usage(self.folder).free / 1E6
+        except OSError as e:
+            logger.error(str(e))
+            return
+
+        level = sum(free < threshold for threshold in self.thresholds)
+
+        if level != self.level:
+            if level > self.level:
+                logger.warning(f'{free:.0f} MB free on {self.folder} => storage {STORAGE_LEVELS[level]}')
+            else:
+                logger.info(f'{free:.0f} MB free on {self.folder} => storage {STORAGE_LEVELS[level]}')
+            self.level = level
+
+    def start(self):
+
+        if self.enable:
+            self.thread = Thread(target=self.writer, name='file_writer', daemon=True)
+            self.thread.start()
+
+            logger.info(f'write-behind queue of {self.queue_size} files, fsync every {self.fsync_interval} seconds')
+
+    def stop(self):
+
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+        self.sync()
+        self.log_stats()
+
+    def write(self, file_path, data):
+
+        if not data:
+            return
+
+        # Without writer thread => checks done by the caller
+        if not self.thread and time() - self.last_check_time > self.check_interval:
+            self.sync()
+            self.check_free_space()
+            self.log_stats()
+
+        if self.level >= STORAGE_LEVELS.index('paused'):
+            with self.lock:
+                self.num_dropped += 1
+            return
+
+        if not self.thread:
+            self.write_file(file_path, data)
+            return
+
+        try:
+            self.queue.put_nowait((file_path, data))
+        except Full:
+            logger.warning('write queue full => save worker waiting')
+            s = time()
+            self.queue.put((file_path, data))
+            logger.warning(f'write queue released after {time() - s:.3f} seconds')
+
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def write_file(self, file_path, data):
+
+        s = perf_counter()
+
+        try:
+            with open(file_path, 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            logger.error(f'{file_path} not written')
+            logger.error(str(e))
+            # Disk full or gone => level checked again now
+            self.check_free_space()
+            return
+
+        write_time = perf_counter() - s
+
+        if self.metrics:
+            self.metrics.record('file_write', write_time)
+
+        with self.lock:
+            self.write_times.append(write_time)
+            self.num_files += 1
+            self.num_bytes += len(data)
+            self.unsynced.append(file_path)
+
+    def sync(self):
+
+        # fsync on a new descriptor flushes the pages written through the previous one
+        s = perf_counter()
+
+        with self.lock:
+            unsynced, self.unsynced = self.unsynced, []
+
+        for file_path in unsynced:
+            try:
+                fd = os.open(file_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logger.error(f'{file_path} not synced')
+                logger.error(str(e))
+
+        if unsynced:
+            logger.debug(f'{len(unsynced)} files synced in {perf_counter() - s:.3f} seconds')
+
+    def log_stats(self):
+
+        with self.lock:
+            write_times = sorted(self.write_times)
+            self.write_times = []
+            max_depth = self.max_depth
+            self.max_depth = 0
+
+        if write_times:
+            logger.info(f'{self.num_files} files written ({self.num_bytes / 1E6:.1f} MB), queue depth {self.queue.qsize()} (max {max_depth}), '
+                        f'write latency mean {1000 * sum(write_times) / len(write_times):.1f} ms, max {1000 * write_times[-1]:.1f} ms, '
+                        f'{self.num_dropped} files dropped, storage {STORAGE_LEVELS[self.level]}')
+
+    def writer(self):
+
+        last_sync_time = time()
+        running = True
+
+        while running:
+
+            try:
+                item = self.queue.get(timeout=max(0, last_sync_time + self.fsync_interval - time()))
+            except Empty:
+                item = False
+
+            if item is None:
+                running = False
+            elif item:
+                self.write_file(*item)
+
+            if time() - last_sync_time >= self.fsync_interval:
+                self.sync()
+                last_sync_time = time()
+
+            if time() - self.last_check_time > self.check_interval:
+                self.check_free_space()
+                self.log_stats()
@@ -16,6 +16,7 @@ from datetime import datetime
 
 from functools import partial
 
+import hardware
 import pigpio
 
 pi = pigpio.pi()
@@ -0,0 +1,39 @@
+#! /usr/bin/python3
+
+import os
+import sys
+
+# Hardware backend of the peripherals, selected by the ENTOMOSCOPE_HARDWARE environment variable
+#
+# rpi (default) => pigpio, smbus, picamera2, libcamera, pyaudio, serial and gpiozero of the Raspberry Pi
+# simulated => the same modules from the simulation folder => the capture scripts and server.py
+# run unchanged on any Linux computer (profiling, pipeline and configuration changes...)
+#
+# Imported by the peripherals and the scripts before any hardware module:
+# the simulation folder is put first in sys.path (import pigpio => simulation/pigpio.py)
+# and simulation/bin first in the PATH (simulated AudioMoth-USB-Microphone command)
+# The environment is inherited => scripts started by the simulated scripts are simulated too
+#
+# Files played back by the simulated camera, GNSS and microphone: see simulation/simulated_hardware.py
+#
+# Usage: ENTOMOSCOPE_HARDWARE=simulated python3 images_capture2.py
+
+HARDWARE_BACKENDS = ['rpi', 'simulated']
+
+SIMULATION_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simulation')
+
+HARDWARE = os.environ.get('ENTOMOSCOPE_HARDWARE', 'rpi').lower()
+
+if HARDWARE not in HARDWARE_BACKENDS:
+    raise ValueError(f"unknown hardware backend {HARDWARE} (ENTOMOSCOPE_HARDWARE: {', '.join(HARDWARE_BACKENDS)})")
+
+SIMULATED = HARDWARE == 'simulated'
+
+if SIMULATED:
+
+    if SIMULATION_FOLDER not in sys.path:
+        sys.path.insert(0, SIMULATION_FOLDER)
+
+    bin_folder = os.path.join(SIMULATION_FOLDER, 'bin')
+    if bin_folder not in os.environ.get('PATH', '').split(os.pathsep):
+        os.environ['PATH'] = bin_folder + os.pathsep + os.environ.get('PATH', '')
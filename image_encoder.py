@@ -0,0 +1,133 @@
+#! /usr/bin/python3
+
+import os
+import time
+from json import dumps
+
+import logging
+
+import numpy as np
+
+from cv2 import imencode, IMWRITE_JPEG_QUALITY
+
+# libjpeg-turbo encoder used by picamera2 itself, much faster than OpenCV on ARM
+try:
+    import simplejpeg
+    SIMPLEJPEG_AVAILABLE = True
+except ImportError:
+    SIMPLEJPEG_AVAILABLE = False
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
+from jpeg_metadata import embed_metadata
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_image_encoder')
+logger.setLevel(logging.INFO)
+h = logging.FileHandler(os.path.join(today_log_path, TODAY + '_' + this_script + '.log'))
+f = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+h.setFormatter(f)
+logger.addHandler(h)
+
+# JPEG encoding and metadata of the captures, without picamera2
+# => shared by Camera2 and the offline replay (images_replay.py)
+
+JPEG_ENCODERS = ['auto', 'opencv', 'simplejpeg']
+
+class ImageEncoder():
+
+    encode_param = [int(IMWRITE_JPEG_QUALITY), 90]
+
+    def __init__(self, configuration=None):
+
+        # Per instance => the quality of one encoder does not change the others
+        self.encode_param = list(self.encode_param)
+
+        self.jpeg_encoder = 'opencv'
+
+        # CaptureMetrics set by the capture script => duration of each stage of the captures
+        self.metrics = None
+
+        self.perf = False
+
+        if configuration:
+            self.set_jpeg_encoder(configuration.files['jpeg_encoder'])
+            self.set_encode_parameter(configuration.files['jpeg_quality'])
+
+    def encode_jpeg(self, frame, crop=None, quality=None):
+
+        # No shared state => safe to call from several threads
+
+        if self.perf:
+            s = time.perf_counter_ns()
+
+        if self.metrics:
+            t = time.perf_counter()
+
+        if crop:
+            frame = frame[crop[0]:crop[1],crop[2]:crop[3],:]
+
+        if self.jpeg_encoder == 'simplejpeg':
+            # RGB888 main stream is stored as BGR in memory
+            jpeg_data = simplejpeg.encode_jpeg(np.ascontiguousarray(frame), quality=quality or self.encode_param[1], colorspace='BGR', colorsubsampling='420')
+        else:
+            jpeg_data = imencode('.jpg', frame, [self.encode_param[0], quality or self.encode_param[1]])[1].tobytes()
+
+        if self.metrics:
+            self.metrics.record('jpeg_encode', time.perf_counter() - t)
+
+        if self.perf:
+            print(f'Frame to JPEG ({self.jpeg_encoder}) {(time.perf_counter_ns() - s)/1E9}')
+
+        return jpeg_data
+
+    def merge_metadata(self, metadata, extra_metadata=None):
+
+        if extra_metadata:
+            all_metadata = {}
+            all_metadata.update(metadata)
+            all_metadata.update(extra_metadata)
+        else:
+            all_metadata = metadata
+
+        return all_metadata
+
+    def metadata_to_json(self, metadata, extra_metadata=None):
+
+        # Same content as write_json => bytes for the write-behind queue
+        if metadata:
+            return dumps(self.merge_metadata(metadata, extra_metadata), indent=4, sort_keys=True, separators=(',', ': ')).encode('utf-8')
+
+        return None
+
+    def embed_metadata(self, jpeg_data, metadata, extra_metadata=None):
+
+        # Metadata in an APP15 segment of the JPEG => no .json file (read back with jpeg_metadata.py)
+        if jpeg_data and metadata:
+            return embed_metadata(jpeg_data, self.merge_metadata(metadata, extra_metadata))
+
+        return jpeg_data
+
+    def set_encode_parameter(self, param_value):
+
+        self.encode_param[1] = param_value
+
+    def set_jpeg_encoder(self, jpeg_encoder):
+
+        if jpeg_encoder not in JPEG_ENCODERS:
+            logger.warning(f'unknown jpeg encoder {jpeg_encoder} => auto')
+            jpeg_encoder = 'auto'
+
+        if jpeg_encoder == 'auto':
+            jpeg_encoder = 'simplejpeg' if SIMPLEJPEG_AVAILABLE else 'opencv'
+        elif jpeg_encoder == 'simplejpeg' and not SIMPLEJPEG_AVAILABLE:
+            logger.warning('simplejpeg not available => opencv')
+            jpeg_encoder = 'opencv'
+
+        self.jpeg_encoder = jpeg_encoder
+
+        logger.info(f'jpeg encoder {self.jpeg_encoder}')
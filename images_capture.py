@@ -4,6 +4,7 @@ from datetime import datetime
 
 import logging
 
+import hardware
 import pigpio
 
 pi = pigpio.pi()
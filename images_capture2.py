@@ -1,41 +1,40 @@
 import os
-from time import time, sleep
+from time import time, sleep, perf_counter
 from datetime import datetime
 
 import logging
 from logging.handlers import RotatingFileHandler
 
+import hardware
 import pigpio
 
-pi = pigpio.pi()
-
 from configuration2 import Configuration2
 
-from peripherals.camera2 import Camera2
 from peripherals.leds import Leds
 from peripherals.laser import Laser
 from peripherals.pinout2 import IMAGES_CAPTURE_ACTIVITY_PIN, SHUTDOWN_PIN, LEDS_REAR_DEPORTED_UV_PIN, LEDS_FRONT_PIN
 from peripherals.rpi import Rpi
+from peripherals.signals import Signals
+
+from images_pipeline import ImagesPipeline
+from capture_scheduler import CaptureScheduler
+from capture_metrics import CaptureMetrics
+from ai_backends import get_ai_model_path, load_ai_model
 
-from globals_parameters import IMAGES_CAPTURE_FOLDER, AI_MODEL, LOGS_DESKTOP_FOLDER, TODAY, AI_MODEL_FILE
+from globals_parameters import IMAGES_CAPTURE_FOLDER, LOGS_DESKTOP_FOLDER, TODAY, AI_MODEL_FILE
 
-# Vérification que le Raspberry Pi peut prendre en charge l'IA
-rpi = Rpi()
-if rpi.arch_version == '64-bit':
-    AI_AVAILABLE = True
-    from ultralytics import YOLO
-else:
-    AI_AVAILABLE = False
+# Pas d'accès au matériel à l'import du script (pigpio, broches, caméra) : le processus d'inférence
+# (multiprocessing spawn) réimporte ce script en tant que __mp_main__
 
 this_script = os.path.basename(__file__)[:-3]
 
-def isSignalToShutdownReceived():
+def isSignalToShutdownReceived(signals):
 
-    return pi.read(SHUTDOWN_PIN)
+    return signals.shutdown()
 
-def isSignalToStandByReceived():
+def isSignalToStandByReceived(signals):
 
-    return pi.read(IMAGES_CAPTURE_ACTIVITY_PIN)
+    return signals.standby()
 
 def main():
 
@@ -55,20 +54,32 @@ def main():
 
     logger.info(f'images capture folder: {IMAGES_CAPTURE_FOLDER}')
 
-    if isSignalToStandByReceived():
+    # Importé ici => picamera2 n'est pas chargé dans le processus d'inférence
+    from peripherals.camera2 import Camera2
 
-        logger.info('in standby mode. Wait for resume signal to start capturing images')
+    pi = pigpio.pi()
 
-        # Tant que la broche IMAGES_CAPTURE_ACTIVITY_PIN est à l'état haut => capture d'image en pause
-        while isSignalToStandByReceived():
+    # Vérification que le Raspberry Pi peut prendre en charge l'IA
+    rpi = Rpi()
+    # Le modèle (ultralytics) est chargé par ai_backends selon ai_detection['backend']
+    if rpi.arch_version == '64-bit':
+        ai_available = True
+    else:
+        ai_available = False
 
-            # Si la broche SHUTDOWN_PIN passe à l'état haut => arret capture d'image
-            if isSignalToShutdownReceived():
-                logger.info('shutdown signal received')
-                logger.info('stopped')
-                exit()
+    # Niveaux des broches SHUTDOWN_PIN et IMAGES_CAPTURE_ACTIVITY_PIN mis à jour sur front (callbacks pigpio)
+    signals = Signals(pi, SHUTDOWN_PIN, IMAGES_CAPTURE_ACTIVITY_PIN)
 
-            sleep(0.5)
+    if isSignalToStandByReceived(signals):
+
+        logger.info('in standby mode. Wait for resume signal to start capturing images')
+
+        # Tant que la broche IMAGES_CAPTURE_ACTIVITY_PIN est à l'état haut => capture d'image en pause
+        # Si la broche SHUTDOWN_PIN passe à l'état haut => arret capture d'image
+        if not signals.wait_for_resume():
+            logger.info('shutdown signal received')
+            logger.info('stopped')
+            exit()
 
         # La broche IMAGES_CAPTURE_ACTIVITY_PIN est à l'état bas, le script se poursuit
         logger.info('resume signal received')
@@ -79,6 +90,10 @@ def main():
 
     logger.info(f"capturing images using mode {configuration.images_capture['mode']}")
     logger.info(f"capturing images using time step of {configuration.images_capture['time_step']} seconds")
+    if configuration.images_capture['burst_frames'] > 1:
+        logger.info(f"sharpest of {configuration.images_capture['burst_frames']} frames kept for each capture")
+    if configuration.images_capture['adaptive']['enable']:
+        logger.info(f"time step adapted to activity between {configuration.images_capture['adaptive']['min_time_step']} and {configuration.images_capture['adaptive']['max_time_step']} seconds")
 
     # Paramétrage des LEDs Front
     leds_front = Leds(LEDS_FRONT_PIN)
@@ -104,6 +119,8 @@ def main():
 
     logger.info(f"delay LEDs on before image capture {configuration.leds['delay_on']} seconds")
     logger.info(f"delay LEDs off after image capture {configuration.leds['delay_on']} seconds")
+    if configuration.leds['sync']:
+        logger.info('capture synchronised with the LEDs switching (sensor timestamps)')
 
     # Configuration des périodes d'alternance On/Off de capture d'images
     on_duration = configuration.schedule['on_duration'] * 60
@@ -112,25 +129,42 @@ def main():
     logger.info(f"capture off duration: {configuration.schedule['off_duration']} minutes")
 
     # Activation de l'IA si disponible et activée dans le fichier de configuration
-    if AI_AVAILABLE:
+    if ai_available:
 
         if configuration.ai_detection['enable']:
 
             logger.info('AI detection enabled')
 
-            ai_model = YOLO(AI_MODEL)
+            # En mode process, le modèle est chargé dans le processus d'inférence du pipeline
+            if configuration.ai_detection['worker'] == 'process':
+                ai_model = None
+                ai_model_path = get_ai_model_path(configuration)
+                logger.info(f'YOLO ai_model loaded in inference process => {ai_model_path}')
+            else:
+                ai_model, ai_model_path = load_ai_model(configuration)
+                logger.info(f'YOLO ai_model loaded => {ai_model_path}')
 
-            logger.info(f'YOLO ai_model loaded => {AI_MODEL}')
             logger.info(f"detection using images of size {configuration.ai_detection['image_width']}x{configuration.ai_detection['image_height']}")
             logger.info(f"detection using minimal confidence of {configuration.ai_detection['min_confidence']}")
 
+            if configuration.ai_detection['mode'] == 'tiled':
+                logger.info(f"detection on {configuration.ai_detection['tiled']['tile_size']} pixels tiles of the main frame ({configuration.ai_detection['tiled']['overlap']} overlap)")
+            elif configuration.ai_detection['mode'] == 'cascade':
+                logger.info(f"detection proposals at {configuration.ai_detection['cascade']['proposal_confidence']} confidence verified on main frame crops")
+
+            if configuration.ai_detection['motion_gate']['enable']:
+                logger.info(f"detection gated by motion (pixel threshold {configuration.ai_detection['motion_gate']['pixel_threshold']}, changed ratio {configuration.ai_detection['motion_gate']['changed_ratio']}, keyframe every {configuration.ai_detection['motion_gate']['keyframe_interval']} seconds)")
+
         else:
 
             ai_model = None
+            ai_model_path = None
             logger.info('AI detection disabled')
 
     else:
 
+        ai_model = None
+        ai_model_path = None
         logger.info('AI not available on 32-bit system')
 
     # Configuration du laser
@@ -158,6 +192,16 @@ def main():
         logger.info('stopped')
         exit()
 
+    logger.info(f'images encoded using {camera.jpeg_encoder} jpeg encoder')
+
+    # Durée de chaque étape des captures => fichier CSV de la nuit et fichier Prometheus
+    # Trace activée => chaque étape dans un fichier Chrome trace-event JSON par heure
+    metrics = CaptureMetrics(configuration, 'images_capture', IMAGES_CAPTURE_FOLDER, trace=configuration.images_capture['trace'])
+    camera.metrics = metrics
+    metrics.start()
+    if configuration.images_capture['trace']:
+        logger.info(f'capture stages traced to {IMAGES_CAPTURE_FOLDER}')
+
     # Démarrage de la caméra
     camera.start()
 
@@ -174,9 +218,10 @@ def main():
                         'EntomoscopeLedsRearDeportedUvIntensity': configuration.leds['intensity_rear_deported_uv'],
                         'EntomoscopeLedsDelayOn': configuration.leds['delay_on'],
                         'EntomoscopeLedsDelayOff': configuration.leds['delay_off'],
-                        'EntomoscopeAiAvailable': AI_AVAILABLE,
+                        'EntomoscopeAiAvailable': ai_available,
                         'EntomoscopeAiEnable': configuration.ai_detection['enable'],
-                        'EntomoscopeAiModel': AI_MODEL_FILE}
+                        'EntomoscopeAiModel': AI_MODEL_FILE,
+                        'EntomoscopeAiBackend': configuration.ai_detection['backend']}
 
     # Copie du fichier de configuration dans le dossier où les images sont enregistrées
     # Nom du fichier : configuration_YYYYMMDDHHMMSS.json
@@ -185,6 +230,14 @@ def main():
     configuration.copy_to(file_path)
     logger.info(f'configuration file saved to {file_path}')
 
+    # Démarrage du pipeline capture => détection => encodage/enregistrement
+    pipeline = ImagesPipeline(camera, configuration, ai_model=ai_model, ai_model_path=ai_model_path, extra_metadata=extra_metadata, metrics=metrics)
+    pipeline.start()
+
+    # Période entre deux captures adaptée à l'activité
+    scheduler = CaptureScheduler(configuration)
+    time_step = scheduler.time_step
+
     shutdown_signal_received = False
 
     # Forçage du système à démarrer en mode On avec capture d'image immédiate
@@ -194,6 +247,26 @@ def main():
     previous_on_time = time()
     previous_off_time = time()
     previous_capture_time = 0
+    leds_on_time = 0
+
+    # Gestion des LEDs après capture d'image en fonction du mode
+    def turn_leds_after_capture():
+
+        if configuration.images_capture['mode'] == 'trap': # Front Off et Rear Off
+            leds_front.turn_off()
+            leds_rear_deported_uv.turn_off()
+        elif configuration.images_capture['mode'] == 'moth': # Front Off et UV On
+            leds_front.turn_off()
+            leds_rear_deported_uv.turn_on()
+        elif configuration.images_capture['mode'] == 'lepinoc': # Front Off et UV On
+            leds_front.turn_off()
+            leds_rear_deported_uv.turn_on()
+        elif configuration.images_capture['mode'] == 'deported': # Front Off et Deported Off
+            leds_front.turn_off()
+            leds_rear_deported_uv.turn_off()
+
+        if metrics:
+            metrics.record('leds_on', perf_counter() - leds_on_time)
 
     # Démarrage du code de capture
     logger.info('start capturing images')
@@ -213,22 +286,38 @@ def main():
 
             previous_on_time = time()
             previous_capture_time = 0
+            scheduler.reset()
+            time_step = scheduler.time_step
             on = True
             off = False
             force_on = False
             logger.info('images capture on')
 
+        # Disque presque plein => captures suspendues (LEDs et caméra inutiles), période suivante attendue
+        if on and pipeline.writer.paused and (time() - previous_capture_time > time_step):
+            previous_capture_time = time()
+
         # Si On et période entre deux captures terminée => capture
-        if on and (time() - previous_capture_time > configuration.images_capture['time_step']):
+        if on and (time() - previous_capture_time > time_step):
 
-            previous_capture_time = time()
+            # La cadence de capture ne dépend que de time_step (recalage si retard d'au moins une période)
+            if time() - previous_capture_time > 2 * time_step:
+                previous_capture_time = time()
+            else:
+                previous_capture_time += time_step
 
-            # Récupération date et heure courante
-            now_str = datetime.now().strftime('%Y%m%d%H%M%S')
+            # Récupération date et heure courante (microsecondes => pas de collision entre captures rapprochées)
+            now_str = datetime.now().strftime('%Y%m%d%H%M%S_%f')
 
             # Création du nom du fichier de base avec la date courante
             file_path = os.path.join(IMAGES_CAPTURE_FOLDER, now_str)
 
+            # Si IA disponible et IA activée et mode différent de Lepinoc => analyse de l'image capturée par le pipeline
+            # Fichiers : YYYYMMDDHHMMSS_ffffff_boxes_conf.txt, YYYYMMDDHHMMSS_ffffff_boxes_conf.jpg, YYYYMMDDHHMMSS_ffffff_original.jpg/.json et YYYYMMDDHHMMSS_ffffff_box_N.jpg
+            # Si IA indisponible ou désactivée => mode timelapse => chaque capture est enregistrée
+            # Fichiers : YYYYMMDDHHMMSS_ffffff_no_ai_detection.jpg/.json
+            detection = ai_available and configuration.ai_detection['enable'] and configuration.images_capture['mode'] != 'lepinoc'
+
             # Gestion des LEDs avant capture d'image en fonction du mode
             if configuration.images_capture['mode'] == 'trap': # Front On et Rear On
                 leds_front.turn_on()
@@ -242,94 +331,50 @@ def main():
             elif configuration.images_capture['mode'] == 'deported': # Front Off et Deported On
                 leds_front.turn_off()
                 leds_rear_deported_uv.turn_on()
+            leds_on_time = perf_counter()
 
             # Attente avant la capture d'image pour permettre à la caméra de se stabiliser
             if configuration.leds['delay_on']:
                 sleep(configuration.leds['delay_on'])
 
             # Capture de l'image avec metadata
-            camera.capture(get_metadata=True)
+            # En détection, l'image pleine résolution n'est copiée que si des boites sont détectées
+            # En timelapse, elle est encodée directement depuis le buffer de la requête (pas de copie)
+            if configuration.leds['sync']:
+                # Première image dont toute l'exposition suit la commutation des LEDs
+                # LEDs éteintes dès la fin de l'exposition, avant la copie des images
+                camera.capture(get_metadata=True, hold_main=configuration.ai_detection['lazy_main'],
+                                exposed_after=max(leds_front.switch_time, leds_rear_deported_uv.switch_time),
+                                on_request=turn_leds_after_capture,
+                                burst=configuration.images_capture['burst_frames'])
+            else:
+                camera.capture(get_metadata=True, hold_main=configuration.ai_detection['lazy_main'],
+                                burst=configuration.images_capture['burst_frames'])
 
-            # Attente après la capture d'image pour éviter d'éteindre avant la fin de la capture
-            if configuration.leds['delay_off']:
-                sleep(configuration.leds['delay_off'])
+                # Attente après la capture d'image pour éviter d'éteindre avant la fin de la capture
+                if configuration.leds['delay_off']:
+                    sleep(configuration.leds['delay_off'])
 
-            # Gestion des LEDs après capture d'image en fonction du mode
-            if configuration.images_capture['mode'] == 'trap': # Front Off et Rear Off
-                leds_front.turn_off()
-                leds_rear_deported_uv.turn_off()
-            elif configuration.images_capture['mode'] == 'moth': # Front Off et UV On
-                leds_front.turn_off()
-                leds_rear_deported_uv.turn_on()
-            elif configuration.images_capture['mode'] == 'lepinoc': # Front Off et UV On
-                leds_front.turn_off()
-                leds_rear_deported_uv.turn_on()
-            elif configuration.images_capture['mode'] == 'deported': # Front Off et Deported Off
-                leds_front.turn_off()
-                leds_rear_deported_uv.turn_off()
+                turn_leds_after_capture()
 
-            # Si IA disponible et IA activée et mode différent de Lepinoc => analyse de l'image capturée
-            if AI_AVAILABLE and configuration.ai_detection['enable'] and configuration.images_capture['mode'] != 'lepinoc' :
-
-                # Exécution du script IA
-                prediction = ai_model.predict(camera.frame_data_lores,
-                                                imgsz=(configuration.ai_detection['image_width'], configuration.ai_detection['image_height']),
-                                                conf=configuration.ai_detection['min_confidence'],
-                                                show=False,
-                                                save=False,
-                                                save_txt=False,
-                                                verbose=False)[0]
-
-                # Insecte détecté si boites dans prediction
-                insect_detected = len(prediction.boxes) > 0
-
-                if insect_detected is True:
-
-                    # Enregistrement du fichier résultat prediction
-                    # Nom du fichier YYYYMMDDHHMMSS_boxes_conf.txt
-                    prediction.save_txt(file_path + '_boxes_conf.txt', save_conf=True)
-
-                    # Enregistrement de l'image (taille détection) avec les boites de détection
-                    # Nom du fichier YYYYMMDDHHMMSS_boxes_conf.jpg
-                    prediction.save(file_path + '_boxes_conf.jpg')
-
-                    # Enregistrement de l'image entière et des metadata
-                    # Nom du fichier : YYYYMMDDHHMMSS_original.jpg et YYYYMMDDHHMMSS_original.json
-                    camera.frame_to_jpeg(stream='main')
-                    jpeg_file_path, json_file_path = camera.save_capture(file_path + '_original.jpg', save_metadata=True, extra_metadata=extra_metadata)
-
-                    # Enregistrement de chaque boite de détection dans une image
-                    # Nom du fichier : YYYYMMDDHHMMSS_box_N.jpg
-                    box_num = 0;
-                    for box in prediction.boxes:
-                        box_lists = box.xywhn.tolist()
-                        for box_list in box_lists:
-                            x, y, w, h = int(box_list[0] * configuration.camera['image_width']), int(box_list[1] * configuration.camera['image_height']), int(box_list[2] * configuration.camera['image_width']), int(box_list[3] * configuration.camera['image_height'])
-                            camera.frame_to_jpeg(stream='main', crop=[int(y-h/2),int(y+h/2),int(x-w/2),int(x+w/2)])
-                            box_num += 1
-                            camera.save_jpeg(file_path + f'_box_{box_num}.jpg')
-
-            # Si laser et laser détecte quelque chose
-            # elif laser and laser.detect_something():
-            #
-            #    # Enregistrement de l'image entière et des metadata
-            #    # Nom du fichier : YYYYMMDDHHMMSS_original.jpg et YYYYMMDDHHMMSS_original.json
-            #    camera.frame_to_jpeg(stream='main')
-            #    jpeg_file_path, json_file_path = camera.save_capture(file_path + '_original.jpg', save_metadata=True, extra_metadata=extra_metadata)
+            # Les images sont transmises au pipeline => la boucle de capture n'attend ni la détection ni l'enregistrement
+            pipeline.submit(file_path, camera.frame_data_main, camera.frame_data_lores, camera.metadata, detection=detection, held_request=camera.held_request, frame_buffer=camera.frame_buffer)
 
-            # Si IA indisponible ou désactivée => mode timelapse => chaque capture est enregistrée
-            else:
+            if metrics:
+                metrics.record('capture', perf_counter() - leds_on_time)
 
-                # Enregistrement de l'image entière
-                # Nom du fichier : YYYYMMDDHHMMSS_no_ai_detection.jpg
-                camera.frame_to_jpeg(stream='main')
-                jpeg_file_path, json_file_path = camera.save_capture(file_path + '_no_ai_detection.jpg', save_metadata=True, extra_metadata=extra_metadata)
+            # Période suivante raccourcie si mouvement ou détection, allongée sinon (détection uniquement)
+            if detection:
+                time_step = scheduler.update(pipeline.pop_activity())
 
         # Si la broche IMAGES_CAPTURE_ACTIVITY_PIN passe à l'état haut => capture d'image en pause
-        if isSignalToStandByReceived():
+        if isSignalToStandByReceived(signals):
 
             logger.info('standby signal received. Images capture paused')
 
+            # Fin des traitements en attente avant la pause
+            pipeline.stop()
+
             # Extinction des LEDs
             if configuration.images_capture['mode'] == 'trap' or configuration.images_capture['mode'] == 'lepinoc' or configuration.images_capture['mode'] == 'deported' or configuration.images_capture['mode'] == 'moth':
                 leds_rear_deported_uv.turn_off()
@@ -337,15 +382,12 @@ def main():
                 leds_front.turn_off()
 
             # Tant que la broche IMAGES_CAPTURE_ACTIVITY_PIN est à l'état haut => capture d'image en pause
-            while isSignalToStandByReceived():
-                # Si la broche SHUTDOWN_PIN passe à l'état haut => arret capture d'image
-                if isSignalToShutdownReceived():
-                    shutdown_signal_received = True
-                    break
-                sleep(0.5)
+            # Si la broche SHUTDOWN_PIN passe à l'état haut => arret capture d'image
+            if not signals.wait_for_resume():
+                shutdown_signal_received = True
 
             # Si la broche IMAGES_CAPTURE_ACTIVITY_PIN est à l'état bas => capture d'image reprend
-            if not isSignalToStandByReceived():
+            if not isSignalToStandByReceived(signals):
 
                 logger.info('resume signal received')
 
@@ -389,9 +431,10 @@ def main():
                                 'EntomoscopeLedsRearDeportedUvIntensity': configuration.leds['intensity_rear_deported_uv'],
                                 'EntomoscopeLedsDelayOn': configuration.leds['delay_on'],
                                 'EntomoscopeLedsDelayOff': configuration.leds['delay_off'],
-                                'EntomoscopeAiAvailable': AI_AVAILABLE,
+                                'EntomoscopeAiAvailable': ai_available,
                                 'EntomoscopeAiEnable': configuration.ai_detection['enable'],
-                                'EntomoscopeAiModel': AI_MODEL_FILE}
+                                'EntomoscopeAiModel': AI_MODEL_FILE,
+                                'EntomoscopeAiBackend': configuration.ai_detection['backend']}
 
                 logger.info(f"delay LEDs on before image capture {configuration.leds['delay_on']} seconds")
                 logger.info(f"delay LEDs off after image capture {configuration.leds['delay_on']} seconds")
@@ -403,41 +446,65 @@ def main():
                 logger.info(f"off duration: {configuration.schedule['off_duration']} minutes")
 
                 # Activation de l'IA si disponible et activée dans le fichier de configuration
-                if AI_AVAILABLE and configuration.ai_detection['enable']:
+                if ai_available and configuration.ai_detection['enable']:
 
                     logger.info('AI detection enabled')
 
-                    if ai_model is None:
-                        ai_model = YOLO(AI_MODEL) # load .pt file
+                    if configuration.ai_detection['worker'] == 'process':
+                        ai_model = None
+                        ai_model_path = get_ai_model_path(configuration)
+                        logger.info(f'YOLO ai_model loaded in inference process => {ai_model_path}')
+                    elif ai_model is None or get_ai_model_path(configuration) != ai_model_path:
+                        ai_model, ai_model_path = load_ai_model(configuration)
 
-                        logger.info(f'YOLO ai_model loaded => {AI_MODEL}')
+                        logger.info(f'YOLO ai_model loaded => {ai_model_path}')
                         logger.info(f"detection using images of size {configuration.ai_detection['image_width']}x{configuration.ai_detection['image_height']}")
                         logger.info(f"detection using minimal confidence of {configuration.ai_detection['min_confidence']}")
 
                 else:
 
                     ai_model = None
+                    ai_model_path = None
                     logger.info('AI detection disabled')
 
+                # Redémarrage du pipeline avec la nouvelle configuration
+                pipeline = ImagesPipeline(camera, configuration, ai_model=ai_model, ai_model_path=ai_model_path, extra_metadata=extra_metadata, metrics=metrics)
+                pipeline.start()
+
+                scheduler = CaptureScheduler(configuration)
+                time_step = scheduler.time_step
+
                 # Forçage du système à redémarrer en mode On  avec capture immédiate
                 force_on = True
 
         # Si la broche SHUTDOWN_PIN passe à l'état haut, on arrete le script
-        if isSignalToShutdownReceived() or shutdown_signal_received:
+        if isSignalToShutdownReceived(signals) or shutdown_signal_received:
             logger.info('shutdown signal received')
             break
 
-        sleep(0.1)
+        # Attente de la prochaine échéance (capture, On/Off) ou d'un front sur les broches standby/shutdown
+        if on:
+            next_time = min(previous_capture_time + time_step, previous_on_time + on_duration)
+        else:
+            next_time = previous_off_time + off_duration
+        signals.wait(max(0.01, next_time - time()))
 
     logger.info('stop capturing images')
 
+    # Fin des traitements en attente
+    pipeline.stop()
+
     # Extinction des LEDs
     leds_rear_deported_uv.turn_off()
     leds_front.turn_off()
 
+    metrics.stop()
+
     # Arret caméra
     camera.stop()
 
+    signals.cancel()
+
     logger.info('stopped')
 
 if __name__=='__main__':
@@ -23,6 +23,7 @@ from json import dump
 
 import cv2
 import time
+import hardware
 import libcamera
 
 from configuration import Configuration
@@ -0,0 +1,363 @@
+#! /usr/bin/python3
+
+import os
+from time import time, perf_counter
+from queue import Queue, Full
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import logging
+
+from ai_inference import InferenceProcess, MAIN_FRAME_MODES, LAZY_MAIN_FRAME_MODES, get_detection_args, detect
+from motion_gate import MotionGate
+from tracker import Tracker
+from detection_index import DetectionIndex
+from file_writer import FileWriter
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY, IMAGES_CAPTURE_FOLDER
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_images_pipeline')
+logger.setLevel(logging.INFO)
+h = logging.FileHandler(os.path.join(today_log_path, TODAY + '_' + this_script + '.log'))
+f = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+h.setFormatter(f)
+logger.addHandler(h)
+
+# Étages du traitement des captures d'images : détection, encodage et écriture des fichiers
+# faits par des workers, la boucle de capture ne fait que transmettre les images
+# Files bornées => submit() bloque si les workers prennent du retard (contre-pression)
+# Utilisé par images_capture2.py et par images_replay.py (images enregistrées)
+
+class CaptureJob():
+
+    def __init__(self, file_path, frame_data_main, frame_data_lores, metadata, detection, held_request=None, frame_buffer=None, capture_time=None):
+
+        self.file_path = file_path
+        self.frame_data_main = frame_data_main
+        self.frame_data_lores = frame_data_lores
+        self.metadata = metadata
+        self.detection = detection
+        self.detections = None
+        self.save_boxes = None
+        self.held_request = held_request
+        self.frame_buffer = frame_buffer
+        self.capture_time = capture_time or time()
+
+    def make_main(self):
+
+        # Copie de l'image pleine résolution seulement si elle est enregistrée
+        if self.frame_data_main is None and self.held_request is not None:
+            self.frame_data_main = self.held_request.make_main()
+
+        return self.frame_data_main
+
+    def release(self):
+
+        # Fin de vie de la capture => requête caméra et buffer rendus à la caméra
+        if self.held_request is not None:
+            self.held_request.release()
+
+        if self.frame_buffer is not None:
+            self.frame_buffer.release()
+
+class ImagesPipeline():
+
+    def __init__(self, camera, configuration, ai_model=None, ai_model_path=None, extra_metadata=None, metrics=None, folder=IMAGES_CAPTURE_FOLDER):
+
+        self.camera = camera
+        self.configuration = configuration
+        self.ai_model = ai_model
+        self.extra_metadata = extra_metadata
+        self.metrics = metrics
+
+        # 'jpeg' => métadonnées dans les _original.jpg/_no_ai_detection.jpg, pas de fichier .json
+        self.metadata_in_jpeg = configuration.files['metadata'] == 'jpeg'
+
+        if ai_model_path and configuration.ai_detection['worker'] == 'process':
+            self.inference_process = InferenceProcess(configuration, ai_model_path, callback=self.on_detections)
+        else:
+            self.inference_process = None
+
+        self.detection_available = self.ai_model is not None or self.inference_process is not None
+
+        self.detection_args = get_detection_args(configuration)
+
+        # Détection sur l'image pleine résolution => pas de copie différée possible
+        # sauf en cascade dans le thread d'inférence (copie seulement si le premier étage propose une boite)
+        if self.detection_args['mode'] in LAZY_MAIN_FRAME_MODES and not self.inference_process:
+            self.main_frame_needed = False
+        else:
+            self.main_frame_needed = self.detection_args['mode'] in MAIN_FRAME_MODES
+
+        self.motion_gate = MotionGate(configuration)
+        self.tracker = Tracker(configuration)
+
+        # Mouvement ou détection depuis le dernier appel à pop_activity() => cadence de capture
+        self.activity = False
+
+        self.queue_size = configuration.images_capture['queue_size']
+        self.num_save_workers = configuration.images_capture['save_workers']
+        self.num_crop_workers = configuration.images_capture['crop_workers']
+
+        self.inference_queue = Queue(maxsize=self.queue_size)
+        self.save_queue = Queue(maxsize=self.queue_size)
+
+        self.inference_thread = None
+        self.save_threads = []
+
+        self.crop_executor = None
+
+        self.writer = FileWriter(configuration, folder, metrics)
+
+        # Index SQLite de la nuit => une ligne par détection enregistrée
+        if configuration.images_capture['index']['enable']:
+            self.index = DetectionIndex(configuration, folder)
+        else:
+            self.index = None
+
+        self.started = False
+
+    def start(self):
+
+        if not self.started:
+
+            if self.inference_process:
+                self.inference_process.start()
+            else:
+                self.inference_thread = Thread(target=self.inference_worker, name='inference', daemon=True)
+                self.inference_thread.start()
+
+            if self.index:
+                self.index.start()
+
+            self.writer.start()
+
+            if self.num_crop_workers > 0:
+                self.crop_executor = ThreadPoolExecutor(max_workers=self.num_crop_workers, thread_name_prefix='crop')
+
+            self.save_threads = []
+            for i in range(self.num_save_workers):
+                thread = Thread(target=self.save_worker, name=f'save_{i}', daemon=True)
+                thread.start()
+                self.save_threads.append(thread)
+
+            self.started = True
+
+            logger.info(f'pipeline started with queue size {self.queue_size} and {self.num_save_workers} save workers')
+
+    def stop(self):
+
+        if self.started:
+
+            # Les sentinelles suivent les captures en attente => les files sont vidées avant l'arrêt
+            if self.inference_process:
+                self.inference_process.stop()
+            else:
+                self.inference_queue.put(None)
+                self.inference_thread.join()
+
+            for thread in self.save_threads:
+                self.save_queue.put(None)
+            for thread in self.save_threads:
+                thread.join()
+
+            if self.crop_executor:
+                self.crop_executor.shutdown(wait=True)
+                self.crop_executor = None
+
+            self.writer.stop()
+
+            # Après les workers d'enregistrement => tous les enregistrements sont écrits
+            if self.index:
+                self.index.stop()
+
+            self.started = False
+
+            if self.detection_available:
+                logger.info(f'motion gate: {self.motion_gate}')
+                logger.info(f'tracker: {self.tracker}')
+
+            logger.info('pipeline stopped')
+
+    def submit(self, file_path, frame_data_main, frame_data_lores, metadata, detection=True, held_request=None, frame_buffer=None, capture_time=None):
+
+        # capture_time => heure de la capture rejouée (images_replay.py), sinon heure courante
+        job = CaptureJob(file_path, frame_data_main, frame_data_lores, metadata, detection and self.detection_available, held_request, frame_buffer, capture_time)
+
+        # Disque presque plein => plus rien n'est enregistré
+        if self.writer.paused:
+            job.release()
+            return
+
+        # Scène inchangée et pas d'image clé => pas de détection
+        if job.detection and not self.motion_gate.check(job.frame_data_lores, job.capture_time):
+            job.release()
+            return
+
+        # Porte désactivée => motion toujours vrai, l'activité vient alors des seules détections
+        if job.detection and self.motion_gate.enable and self.motion_gate.motion:
+            self.activity = True
+
+        # Timelapse => requête gardée jusqu'à l'encodage, directement depuis le buffer de la requête
+        if job.detection and self.main_frame_needed:
+            job.make_main()
+
+        if job.detection and self.inference_process:
+            self.inference_process.submit(job.frame_data_lores, job.frame_data_main, job.capture_time, context=job)
+        elif job.detection:
+            self.put(self.inference_queue, job, 'inference')
+        else:
+            self.put(self.save_queue, job, 'save')
+
+    def pop_activity(self):
+
+        activity = self.activity
+        self.activity = False
+
+        return activity
+
+    def put(self, queue, job, name):
+
+        try:
+            queue.put_nowait(job)
+        except Full:
+            logger.warning(f'{name} queue full => capture waiting')
+            s = time()
+            queue.put(job)
+            logger.warning(f'{name} queue released after {time() - s:.3f} seconds')
+
+    def inference_worker(self):
+
+        while True:
+
+            job = self.inference_queue.get()
+
+            if job is None:
+                break
+
+            try:
+
+                s = perf_counter()
+                detections = detect(self.ai_model, job.frame_data_lores, job.make_main, self.detection_args, job.capture_time)
+                if self.metrics:
+                    self.metrics.record('inference', perf_counter() - s)
+
+            except BaseException as e:
+
+                logger.error(f'inference failed for {job.file_path}')
+                logger.error(str(e))
+                job.release()
+                continue
+
+            self.on_detections(detections, job)
+
+    def on_detections(self, detections, job):
+
+        job.detections = detections
+
+        if self.metrics:
+            # Processus d'inférence => durée mesurée par le modèle (ms), sans le transfert des images
+            if self.inference_process:
+                self.metrics.record('inference', job.detections.speed / 1000)
+            self.metrics.record('detection_latency', time() - job.capture_time)
+
+        # Appelé dans l'ordre des captures => suivi des boites d'une détection à l'autre
+        job.detections.track_ids, job.save_boxes = self.tracker.update(job.detections, job.capture_time)
+
+        if len(job.detections) > 0:
+            self.activity = True
+
+        # Rien à enregistrer si aucune boite détectée ou seulement des insectes déjà enregistrés
+        if job.save_boxes.any():
+            # La requête caméra est rendue avant l'attente dans la file d'enregistrement
+            job.make_main()
+            self.put(self.save_queue, job, 'save')
+        else:
+            job.release()
+
+    def save_worker(self):
+
+        while True:
+
+            job = self.save_queue.get()
+
+            if job is None:
+                break
+
+            try:
+
+                if job.detection:
+                    self.save_detection(job)
+                else:
+                    self.save_timelapse(job)
+
+            except BaseException as e:
+
+                logger.error(f'save failed for {job.file_path}')
+                logger.error(str(e))
+
+            job.release()
+
+    def save_detection(self, job):
+
+        # Nom du fichier YYYYMMDDHHMMSS_ffffff_boxes_conf.txt
+        self.writer.write(job.file_path + '_boxes_conf.txt', job.detections.to_txt().encode('utf-8'))
+
+        # Nom du fichier YYYYMMDDHHMMSS_ffffff_boxes_conf.jpg
+        self.writer.write(job.file_path + '_boxes_conf.jpg', job.detections.to_jpeg(job.frame_data_lores))
+
+        # Nom du fichier : YYYYMMDDHHMMSS_ffffff_original.jpg et YYYYMMDDHHMMSS_ffffff_original.json (sauf métadonnées dans le jpeg)
+        # Nom du fichier : YYYYMMDDHHMMSS_ffffff_box_N.jpg (N dans l'ordre des détections, boites déjà enregistrées par le suivi ignorées)
+        crops = [(job.file_path + '_original.jpg', None)]
+        box_files = {}
+        for box_num, (crop, save) in enumerate(zip(job.detections.to_pixels(self.configuration.camera['image_width'], self.configuration.camera['image_height']), job.save_boxes), 1):
+            # Disque en cours de remplissage => pas de vignettes
+            if save and not self.writer.drop_crops:
+                crops.append((job.file_path + f'_box_{box_num}.jpg', crop))
+                box_files[box_num] = os.path.basename(crops[-1][0])
+
+        if self.crop_executor and len(crops) > 1:
+            futures = [self.crop_executor.submit(self.save_crop, job.frame_data_main, jpeg_file_path, crop, job.metadata if crop is None else None) for jpeg_file_path, crop in crops]
+            if not self.metadata_in_jpeg:
+                self.writer.write(job.file_path + '_original.json', self.camera.metadata_to_json(job.metadata, self.extra_metadata))
+            # Attente de tous les fichiers avant de rendre le buffer, puis première erreur remontée
+            wait(futures)
+            for future in futures:
+                future.result()
+        else:
+            for jpeg_file_path, crop in crops:
+                self.save_crop(job.frame_data_main, jpeg_file_path, crop, job.metadata if crop is None else None)
+            if not self.metadata_in_jpeg:
+                self.writer.write(job.file_path + '_original.json', self.camera.metadata_to_json(job.metadata, self.extra_metadata))
+
+        if self.index:
+            files = [os.path.basename(job.file_path + suffix) for suffix in ('_boxes_conf.txt', '_boxes_conf.jpg', '_original.jpg')]
+            if not self.metadata_in_jpeg:
+                files.append(os.path.basename(job.file_path + '_original.json'))
+            files.extend(box_files.values())
+            self.index.add(job.capture_time, job.file_path, files, job.detections, box_files, job.metadata)
+
+    def save_crop(self, frame, jpeg_file_path, crop=None, metadata=None, held_request=None):
+
+        # held_request => image pleine résolution non copiée, encodée depuis le buffer de la requête
+        if held_request is not None:
+            jpeg_data = held_request.encode_jpeg(crop=crop, quality=self.writer.quality)
+        else:
+            jpeg_data = self.camera.encode_jpeg(frame, crop=crop, quality=self.writer.quality)
+        if metadata and self.metadata_in_jpeg:
+            jpeg_data = self.camera.embed_metadata(jpeg_data, metadata, self.extra_metadata)
+        self.writer.write(jpeg_file_path, jpeg_data)
+
+    def save_timelapse(self, job):
+
+        # Nom du fichier : YYYYMMDDHHMMSS_ffffff_no_ai_detection.jpg et YYYYMMDDHHMMSS_ffffff_no_ai_detection.json (sauf métadonnées dans le jpeg)
+        self.save_crop(job.frame_data_main, job.file_path + '_no_ai_detection.jpg', metadata=job.metadata,
+                        held_request=job.held_request if job.frame_data_main is None else None)
+        if not self.metadata_in_jpeg:
+            self.writer.write(job.file_path + '_no_ai_detection.json', self.camera.metadata_to_json(job.metadata, self.extra_metadata))
@@ -0,0 +1,332 @@
+#! /usr/bin/python3
+
+import os
+import argparse
+from glob import glob, escape
+from json import dump, load
+from time import perf_counter
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from cv2 import imread, resize, cvtColor, COLOR_BGR2RGB, INTER_AREA
+
+from configuration2 import Configuration2, DEFAULT_CONFIGURATION_FILE
+
+from ai_backends import load_ai_model
+from ai_inference import Detections, get_detection_args
+from detection_index import INDEX_FILE, open_index, make_record, write_records
+from image_encoder import ImageEncoder
+from images_replay import set_configuration_value
+from jpeg_metadata import read_metadata
+
+from globals_parameters import DATA_FOLDER
+
+# Detection run again on the timelapse captures (_no_ai_detection.jpg) of a DATA_FOLDER tree,
+# typically after a model update
+#
+# Worker processes decode the images and build the lores frames, the model runs in this process
+# on batches of lores frames. Frames with boxes go back to the workers which write the results
+# with the layout of images_capture2, next to the image:
+# YYYYMMDDHHMMSS_ffffff_boxes_conf.txt, YYYYMMDDHHMMSS_ffffff_boxes_conf.jpg, YYYYMMDDHHMMSS_ffffff_box_N.jpg
+# The files of a previous detection are removed first, also when no box is found any more
+#
+# The detections are added to the detections.sqlite index of the folder (detection_index.py),
+# after those of the capture and of previous re-detections (kept), without environment snapshot
+#
+# Only a bounded number of frames is in flight => the memory does not grow with the size of a night
+# The last image processed in each folder is saved in a checkpoint file after each batch
+# => an interrupted run continues after it (same model), even if images were added to the folder
+# since (night still captured, data migrated from the SD card), --restart starts again
+#
+# Detection on the lores frames only (ai_detection mode 'lores'), tiled and cascade need the main frames
+#
+# Usage: python3 images_redetection.py [-f data_folder] [-b 16] [-w 4] [-s ai_detection.min_confidence=0.5]
+
+CHECKPOINT_FILE = 'redetection_checkpoint.json'
+
+SOURCE_SUFFIX = '_no_ai_detection.jpg'
+
+# Worker process state, set once by init_worker()
+worker_encoder = None
+
+def init_worker(configuration_file, settings):
+
+    global worker_encoder
+
+    configuration = Configuration2(configuration_file)
+    for setting in settings:
+        set_configuration_value(configuration, setting)
+
+    worker_encoder = ImageEncoder(configuration)
+
+def load_lores(image_path, lores_size):
+
+    # Only the lores frame goes back to the main process
+    frame = imread(image_path)
+
+    if frame is None:
+        return image_path, None
+
+    # Same input as the detection during the capture => lores RGB frame
+    return image_path, cvtColor(resize(frame, lores_size, interpolation=INTER_AREA), COLOR_BGR2RGB)
+
+def capture_time(base_path):
+
+    # YYYYMMDDHHMMSS_ffffff, YYYYMMDDHHMMSS for the captures saved before the sub-second filenames
+    name = os.path.basename(base_path)
+
+    try:
+        return datetime.strptime(name[:21], '%Y%m%d%H%M%S_%f').timestamp()
+    except ValueError:
+        pass
+
+    try:
+        return datetime.strptime(name[:14], '%Y%m%d%H%M%S').timestamp()
+    except ValueError:
+        return os.path.getmtime(base_path + SOURCE_SUFFIX)
+
+def capture_metadata(image_path):
+
+    # .json file next to the image, or metadata embedded in the JPEG
+    json_file_path = image_path[:-len('.jpg')] + '.json'
+
+    try:
+        if os.path.exists(json_file_path):
+            with open(json_file_path, 'r') as f:
+                return load(f)
+        return read_metadata(image_path)
+    except (OSError, ValueError):
+        return None
+
+def remove_results(base_path):
+
+    # Files of a previous detection => no _box_N.jpg left from a detection with more boxes
+    file_paths = [base_path + '_boxes_conf.txt', base_path + '_boxes_conf.jpg'] + glob(escape(base_path) + '_box_*.jpg')
+
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+def save_results(image_path, data, frame_lores):
+
+    # => files written and box files by box number, for the detection index
+    detections = Detections(data)
+
+    base_path = image_path[:-len(SOURCE_SUFFIX)]
+
+    remove_results(base_path)
+
+    with open(base_path + '_boxes_conf.txt', 'w') as f:
+        f.write(detections.to_txt())
+
+    with open(base_path + '_boxes_conf.jpg', 'wb') as f:
+        f.write(detections.to_jpeg(frame_lores))
+
+    # Crops from the full resolution image, decoded again only when there are boxes
+    frame = imread(image_path)
+
+    box_files = {}
+
+    for box_num, crop in enumerate(detections.to_pixels(frame.shape[1], frame.shape[0]), 1):
+        with open(base_path + f'_box_{box_num}.jpg', 'wb') as f:
+            f.write(worker_encoder.encode_jpeg(frame, crop=crop))
+        box_files[box_num] = os.path.basename(base_path + f'_box_{box_num}.jpg')
+
+    files = [os.path.basename(base_path + suffix) for suffix in ('_boxes_conf.txt', '_boxes_conf.jpg', SOURCE_SUFFIX)]
+    files.extend(box_files.values())
+
+    return image_path, data, files, box_files, capture_metadata(image_path)
+
+def find_image_folders(data_folder):
+
+    # Folders in capture order (nights), images in capture order
+    for root, dirs, files in os.walk(data_folder):
+
+        dirs.sort()
+
+        images = sorted(file for file in files if file.endswith(SOURCE_SUFFIX))
+
+        if images:
+            yield root, [os.path.join(root, image) for image in images]
+
+def bounded_map(executor, fn, items, max_pending, *args):
+
+    # Same as executor.map but at most max_pending items decoded ahead of the consumer
+    pending = deque()
+
+    for item in items:
+
+        pending.append(executor.submit(fn, item, *args))
+
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+def batched(items, batch_size):
+
+    batch = []
+
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+class Checkpoint():
+
+    # Name of the last image processed in each folder => images sorted by name are in capture order
+
+    def __init__(self, checkpoint_file_path, model_path):
+
+        self.checkpoint_file_path = checkpoint_file_path
+        self.model_path = model_path
+
+        self.last_images = {}
+
+    def load(self):
+
+        if not os.path.exists(self.checkpoint_file_path):
+            return
+
+        with open(self.checkpoint_file_path, 'r') as f:
+            checkpoint = load(f)
+
+        # Another model => everything is detected again
+        if checkpoint['model'] != self.model_path:
+            print(f"Checkpoint of {checkpoint['model']} ignored")
+        elif 'last_images' not in checkpoint:
+            print('Checkpoint with image positions ignored')
+        else:
+            self.last_images = checkpoint['last_images']
+
+    def remaining(self, folder, images):
+
+        # Images after the last one processed, wherever new images were inserted
+        last_image = self.last_images.get(folder)
+
+        if last_image is None:
+            return images
+
+        return [image for image in images if os.path.basename(image) > last_image]
+
+    def save(self, folder, image):
+
+        self.last_images[folder] = os.path.basename(image)
+
+        # Written then renamed => a checkpoint cut by a power failure is never read
+        tmp_file_path = self.checkpoint_file_path + '.tmp'
+        with open(tmp_file_path, 'w') as f:
+            dump({'model': self.model_path, 'last_images': self.last_images}, f, indent=4, sort_keys=True, separators=(',', ': '))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file_path, self.checkpoint_file_path)
+
+def main():
+
+    parser = argparse.ArgumentParser(prog='images_redetection.py')
+
+    parser.add_argument('-f', '--folder', help='Data folder searched for _no_ai_detection.jpg images',
+                        required=False, default=DATA_FOLDER)
+    parser.add_argument('-b', '--batch_size', help='Number of frames per predict call (1 for models exported with a static batch)',
+                        required=False, type=int, default=16)
+    parser.add_argument('-w', '--workers', help='Number of worker processes decoding and writing the images',
+                        required=False, type=int, default=os.cpu_count())
+    parser.add_argument('-c', '--configuration', help='Configuration file',
+                        required=False, default=DEFAULT_CONFIGURATION_FILE)
+    parser.add_argument('-s', '--set', help='Configuration value changed for the detection (section.key=value)',
+                        required=False, action='append', default=[])
+    parser.add_argument('--restart', help='Ignore the checkpoint and detect all the images again',
+                        required=False, action='store_true')
+
+    args = parser.parse_args()
+
+    configuration = Configuration2(args.configuration)
+    for setting in args.set:
+        set_configuration_value(configuration, setting)
+
+    if configuration.ai_detection['mode'] != 'lores':
+        print(f"Detection mode {configuration.ai_detection['mode']} not available for re-detection => lores")
+
+    detection_args = get_detection_args(configuration)
+    lores_size = (configuration.ai_detection['image_width'], configuration.ai_detection['image_height'])
+
+    ai_model, ai_model_path = load_ai_model(configuration)
+
+    checkpoint = Checkpoint(os.path.join(args.folder, CHECKPOINT_FILE), ai_model_path)
+    if not args.restart:
+        checkpoint.load()
+
+    print(f'Model: {ai_model_path}')
+    print(f'Images: {SOURCE_SUFFIX} in {args.folder}, batches of {args.batch_size}, {args.workers} workers')
+
+    num_images = 0
+    num_boxes = 0
+
+    s = perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.configuration, args.set)) as executor:
+
+        for folder, images in find_image_folders(args.folder):
+
+            remaining = checkpoint.remaining(folder, images)
+
+            if not remaining:
+                continue
+
+            print(f'{folder}: {len(remaining)} images' + (f' (after {remaining[0]})' if len(remaining) < len(images) else ''))
+
+            # Written by this process, batch by batch => the index never lags behind the checkpoint
+            connection = open_index(os.path.join(folder, INDEX_FILE))
+
+            for batch in batched(bounded_map(executor, load_lores, remaining, 2 * args.batch_size + args.workers, lores_size), args.batch_size):
+
+                frames = [(image_path, frame_lores) for image_path, frame_lores in batch if frame_lores is not None]
+
+                if frames:
+
+                    predictions = ai_model.predict([frame_lores for image_path, frame_lores in frames], **detection_args['predict'])
+
+                    futures = []
+                    records = []
+                    for (image_path, frame_lores), prediction in zip(frames, predictions):
+                        detections = Detections.from_prediction(prediction)
+                        if len(detections):
+                            futures.append(executor.submit(save_results, image_path, detections.data, frame_lores))
+                        else:
+                            # Row without box => a capture with boxes in a previous detection leaves latest_captures
+                            base_path = image_path[:-len(SOURCE_SUFFIX)]
+                            remove_results(base_path)
+                            records.append(make_record(capture_time(base_path), base_path, [os.path.basename(image_path)], detections, {}, None, source='redetection'))
+
+                    # Results of the batch written and indexed before the checkpoint moves forward
+                    for future in futures:
+                        image_path, data, files, box_files, metadata = future.result()
+                        detections = Detections(data)
+                        base_path = image_path[:-len(SOURCE_SUFFIX)]
+                        # Past night => no environment snapshot
+                        records.append(make_record(capture_time(base_path), base_path, files, detections, box_files, metadata, source='redetection'))
+                        num_boxes += len(detections)
+
+                    write_records(connection, records)
+
+                num_images += len(batch)
+
+                checkpoint.save(folder, batch[-1][0])
+
+            connection.close()
+
+            print(f'{num_images} images, {num_boxes} boxes, {num_images / (perf_counter() - s):.1f} images/s')
+
+    print(f'\nTotal: {num_images} images in {perf_counter() - s:.1f} seconds, {num_boxes} boxes')
+
+if __name__ == '__main__':
+
+    main()
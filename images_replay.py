@@ -0,0 +1,298 @@
+#! /usr/bin/python3
+
+import os
+import argparse
+from json import loads
+from time import time, perf_counter
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cv2 import imread, resize, cvtColor, ellipse, COLOR_BGR2RGB, INTER_AREA
+
+from configuration2 import Configuration2, DEFAULT_CONFIGURATION_FILE
+
+from image_encoder import ImageEncoder
+from images_pipeline import ImagesPipeline
+from detection_index import INDEX_FILE, DetectionRecords, open_index, write_records
+from ai_backends import load_ai_model, find_original_images
+from jpeg_metadata import read_metadata
+
+# Saved captures (or synthetic frames) replayed through the ImagesPipeline of images_capture2
+# => same motion gate, detection, tracker, crops, JPEG encoding and write-behind queue,
+# without Picamera2 nor pigpio, as fast as the pipeline accepts the frames
+#
+# The frames are split in contiguous chunks, one per worker process
+# => the tracker follows the boxes within each chunk
+# The detection index records go back to this process, the only writer of detections.sqlite
+#
+# Configuration values can be changed for the replay (backend, thresholds, storage...)
+# with -s section.key=value (JSON value), e.g. -s ai_detection.min_confidence=0.5
+#
+# Usage: python3 images_replay.py -f images_folder -o output_folder [-w 4] [-s ai_detection.backend=onnx]
+#        python3 images_replay.py -n 500 -o output_folder [--no_ai]
+
+REPLAY_SUFFIXES = ['_original.jpg', '_no_ai_detection.jpg']
+
+NUM_SYNTHETIC_INSECTS = 5
+
+def find_replay_images(folder):
+
+    images = []
+    for suffix in REPLAY_SUFFIXES:
+        images.extend(find_original_images(folder, suffix))
+
+    # Capture order => YYYYMMDDHHMMSS_ffffff file names
+    return sorted(images, key=os.path.basename)
+
+def capture_name(image_path):
+
+    name = os.path.basename(image_path)
+    for suffix in REPLAY_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+
+    return os.path.splitext(name)[0]
+
+def capture_time(name):
+
+    # YYYYMMDDHHMMSS_ffffff (images_capture2) or YYYYMMDDHHMMSS (older captures)
+    for date_format in ('%Y%m%d%H%M%S_%f', '%Y%m%d%H%M%S'):
+        try:
+            return datetime.strptime(name, date_format).timestamp()
+        except ValueError:
+            pass
+
+    return None
+
+def read_capture_metadata(image_path):
+
+    # .json file next to the image, else metadata embedded in the JPEG
+    json_file_path = os.path.splitext(image_path)[0] + '.json'
+
+    try:
+        if os.path.exists(json_file_path):
+            with open(json_file_path, 'r') as f:
+                return loads(f.read())
+        return read_metadata(image_path) or {}
+    except (OSError, ValueError):
+        return {}
+
+def set_configuration_value(configuration, setting):
+
+    # section.key.subkey=value => value read as JSON, as a string otherwise
+    keys, value = setting.split('=', 1)
+    keys = keys.split('.')
+
+    try:
+        value = loads(value)
+    except ValueError:
+        pass
+
+    parameters = getattr(configuration, keys[0])
+    for key in keys[1:-1]:
+        parameters = parameters[key]
+
+    if keys[-1] not in parameters:
+        raise KeyError(f'unknown configuration key {setting}')
+
+    parameters[keys[-1]] = value
+
+class SyntheticFrames():
+
+    # Dark ellipses moving on a light textured background => motion and boxes for the detector
+    # Frame N only depends on N => the workers generate their own chunk
+
+    def __init__(self, width, height, time_step, start_time):
+
+        self.width = width
+        self.height = height
+        self.time_step = time_step
+        self.start_time = start_time
+
+        rng = np.random.default_rng(0)
+        self.background = np.clip(rng.normal(190, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+
+        self.positions = rng.uniform((0, 0), (width, height), (NUM_SYNTHETIC_INSECTS, 2))
+        self.speeds = rng.uniform(-0.01, 0.01, (NUM_SYNTHETIC_INSECTS, 2)) * (width, height)
+        self.sizes = rng.uniform(0.01, 0.03, NUM_SYNTHETIC_INSECTS) * width
+
+    def frame(self, index):
+
+        frame = self.background.copy()
+
+        for position, speed, size in zip(self.positions, self.speeds, self.sizes):
+            x, y = (position + index * speed) % (self.width, self.height)
+            ellipse(frame, (int(x), int(y)), (int(size), int(size / 2)), int(index) % 180, 0, 360, (40, 30, 20), -1)
+
+        timestamp = self.start_time + index * self.time_step
+        name = datetime.fromtimestamp(timestamp).strftime('%Y%m%d%H%M%S_%f')
+
+        return frame, {}, timestamp, name
+
+def replay_worker(worker_num, configuration_file, settings, output_folder, detection, images=None, indexes=None, start_time=None):
+
+    configuration = Configuration2(configuration_file)
+    for setting in settings:
+        set_configuration_value(configuration, setting)
+
+    # Pool of processes => inference thread in each worker, no inference process
+    configuration.ai_detection['worker'] = 'thread'
+
+    if images:
+        # Size of the replayed captures => crops computed as during the capture
+        first_frame = imread(images[0])
+        configuration.camera['image_width'] = first_frame.shape[1]
+        configuration.camera['image_height'] = first_frame.shape[0]
+    else:
+        synthetic_frames = SyntheticFrames(configuration.camera['image_width'], configuration.camera['image_height'],
+                                            configuration.images_capture['time_step'], start_time)
+
+    main_size = (configuration.camera['image_width'], configuration.camera['image_height'])
+    lores_size = (configuration.ai_detection['image_width'], configuration.ai_detection['image_height'])
+
+    if detection:
+        ai_model, ai_model_path = load_ai_model(configuration)
+    else:
+        ai_model = None
+
+    encoder = ImageEncoder(configuration)
+
+    pipeline = ImagesPipeline(encoder, configuration, ai_model=ai_model, folder=output_folder)
+
+    # Index written by the main process => records only collected here
+    if pipeline.index:
+        pipeline.index = DetectionRecords(configuration, output_folder)
+
+    pipeline.start()
+
+    num_frames = 0
+    read_time = 0.0
+
+    s = perf_counter()
+
+    for item in (images if images else indexes):
+
+        r = perf_counter()
+
+        if images:
+            frame = imread(item)
+            if frame is None:
+                continue
+            if (frame.shape[1], frame.shape[0]) != main_size:
+                frame = resize(frame, main_size, interpolation=INTER_AREA)
+            name = capture_name(item)
+            metadata = read_capture_metadata(item)
+            timestamp = capture_time(name)
+        else:
+            frame, metadata, timestamp, name = synthetic_frames.frame(item)
+
+        # Same input as the capture => lores RGB, main BGR (RGB888 of picamera2)
+        frame_lores = cvtColor(resize(frame, lores_size, interpolation=INTER_AREA), COLOR_BGR2RGB)
+
+        read_time += perf_counter() - r
+
+        pipeline.submit(os.path.join(output_folder, name), frame, frame_lores, metadata, detection=detection, capture_time=timestamp)
+        num_frames += 1
+
+    # Files written and index updated before the time is read
+    pipeline.stop()
+
+    return {'worker': worker_num,
+            'frames': num_frames,
+            'elapsed': perf_counter() - s,
+            'read_time': read_time,
+            'files': pipeline.writer.num_files,
+            'bytes': pipeline.writer.num_bytes,
+            'dropped': pipeline.writer.num_dropped,
+            'motion_gate': str(pipeline.motion_gate),
+            'tracker': str(pipeline.tracker),
+            'records': pipeline.index.records if pipeline.index else []}
+
+def main():
+
+    parser = argparse.ArgumentParser(prog='images_replay.py')
+
+    parser.add_argument('-f', '--folder', help='Folder searched for _original.jpg and _no_ai_detection.jpg images',
+                        required=False, default=None)
+    parser.add_argument('-n', '--num_synthetic', help='Number of synthetic frames replayed instead of saved images',
+                        required=False, type=int, default=0)
+    parser.add_argument('-o', '--output', help='Output folder of the replayed captures',
+                        required=True)
+    parser.add_argument('-w', '--workers', help='Number of worker processes',
+                        required=False, type=int, default=os.cpu_count())
+    parser.add_argument('-c', '--configuration', help='Configuration file',
+                        required=False, default=DEFAULT_CONFIGURATION_FILE)
+    parser.add_argument('-s', '--set', help='Configuration value changed for the replay (section.key=value)',
+                        required=False, action='append', default=[])
+    parser.add_argument('--no_ai', help='Replay without detection (timelapse)',
+                        required=False, action='store_true')
+
+    args = parser.parse_args()
+
+    if not args.folder and not args.num_synthetic:
+        parser.error('one of -f/--folder or -n/--num_synthetic is required')
+
+    os.makedirs(args.output, exist_ok=True)
+
+    detection = not args.no_ai
+
+    if args.folder:
+
+        images = find_replay_images(args.folder)
+
+        if not images:
+            print(f'No image to replay found in {args.folder}')
+            return
+
+        chunks = [chunk.tolist() for chunk in np.array_split(images, args.workers) if len(chunk)]
+        jobs = [dict(images=chunk) for chunk in chunks]
+        num_frames = len(images)
+        source = args.folder
+
+    else:
+
+        chunks = [chunk.tolist() for chunk in np.array_split(np.arange(args.num_synthetic), args.workers) if len(chunk)]
+        start_time = time()
+        jobs = [dict(indexes=chunk, start_time=start_time) for chunk in chunks]
+        num_frames = args.num_synthetic
+        source = 'synthetic frames'
+
+    print(f'Replay of {num_frames} frames from {source} with {len(jobs)} workers ({"detection" if detection else "no detection"})')
+
+    s = perf_counter()
+
+    with ProcessPoolExecutor(max_workers=len(jobs)) as executor:
+        futures = [executor.submit(replay_worker, i, args.configuration, args.set, args.output, detection, **job) for i, job in enumerate(jobs)]
+        results = [future.result() for future in futures]
+
+    records = sorted((record for result in results for record in result['records']), key=lambda record: record[0][0])
+
+    if records:
+        connection = open_index(os.path.join(args.output, INDEX_FILE))
+        write_records(connection, records)
+        connection.close()
+
+    elapsed = perf_counter() - s
+
+    print('\nWorker  frames  frames/s  read (ms/frame)   files      MB')
+    for result in results:
+        print(f"{result['worker']:6d} {result['frames']:7d} {result['frames'] / result['elapsed']:9.2f} {1000 * result['read_time'] / max(1, result['frames']):16.1f} "
+              f"{result['files']:7d} {result['bytes'] / 1E6:7.1f}")
+
+    for result in results:
+        print(f"\nWorker {result['worker']}")
+        print(f"motion gate: {result['motion_gate']}")
+        print(f"tracker: {result['tracker']}")
+        if result['dropped']:
+            print(f"{result['dropped']} files dropped (storage)")
+
+    print(f'\nTotal: {num_frames} frames in {elapsed:.1f} seconds => {num_frames / elapsed:.2f} frames/s')
+    print(f"Files: {sum(result['files'] for result in results)} ({sum(result['bytes'] for result in results) / 1E6:.1f} MB) in {args.output}")
+    if records:
+        print(f'Index: {len(records)} records in {os.path.join(args.output, INDEX_FILE)}')
+
+if __name__ == '__main__':
+
+    main()
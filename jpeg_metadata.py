@@ -0,0 +1,113 @@
+#! /usr/bin/python3
+
+import os
+import argparse
+from json import dumps, loads, dump
+
+# Capture metadata stored inside the JPEG as compact JSON in APP15 segments
+# => one file per image instead of a .jpg and a .json
+#
+# Segment layout: 0xFF 0xEF, length (2 bytes, big endian, includes itself), METADATA_ID, JSON chunk
+# Metadata larger than one segment is split over consecutive segments
+#
+# Usage: python3 jpeg_metadata.py image.jpg [image.jpg ...] [-x]
+
+APP15 = b'\xff\xef'
+METADATA_ID = b'Entomoscope\x00'
+
+MAX_SEGMENT_LENGTH = 65535
+MAX_CHUNK_SIZE = MAX_SEGMENT_LENGTH - 2 - len(METADATA_ID)
+
+def make_segments(metadata):
+
+    data = dumps(metadata, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+    segments = []
+
+    for start in range(0, len(data), MAX_CHUNK_SIZE):
+        chunk = data[start:start + MAX_CHUNK_SIZE]
+        segments.append(APP15 + (2 + len(METADATA_ID) + len(chunk)).to_bytes(2, 'big') + METADATA_ID + chunk)
+
+    return b''.join(segments)
+
+def embed_metadata(jpeg_data, metadata):
+
+    if jpeg_data[0:2] != b'\xff\xd8':
+        raise ValueError('not a JPEG (no SOI marker)')
+
+    # After SOI and the APP0 (JFIF) segment if any => JFIF stays the first segment
+    position = 2
+    if jpeg_data[2:4] == b'\xff\xe0':
+        position += 2 + int.from_bytes(jpeg_data[4:6], 'big')
+
+    return jpeg_data[:position] + make_segments(metadata) + jpeg_data[position:]
+
+def extract_metadata(jpeg_data):
+
+    if jpeg_data[0:2] != b'\xff\xd8':
+        raise ValueError('not a JPEG (no SOI marker)')
+
+    chunks = []
+    position = 2
+
+    # Walk the segments up to the start of the compressed data (SOS)
+    while position + 4 <= len(jpeg_data) and jpeg_data[position] == 0xff:
+
+        marker = jpeg_data[position:position + 2]
+
+        if marker == b'\xff\xda':
+            break
+
+        length = int.from_bytes(jpeg_data[position + 2:position + 4], 'big')
+        payload = jpeg_data[position + 4:position + 2 + length]
+
+        if marker == APP15 and payload.startswith(METADATA_ID):
+            chunks.append(payload[len(METADATA_ID):])
+
+        position += 2 + length
+
+    if not chunks:
+        return None
+
+    return loads(b''.join(chunks).decode('utf-8'))
+
+def read_metadata(jpeg_file_path):
+
+    with open(jpeg_file_path, 'rb') as f:
+        return extract_metadata(f.read())
+
+def main():
+
+    parser = argparse.ArgumentParser(prog='jpeg_metadata.py')
+
+    parser.add_argument('files', nargs='+', help='JPEG files')
+    parser.add_argument('-x', '--extract', help='Write the metadata to a .json file next to each image',
+                        required=False, action='store_true')
+
+    args = parser.parse_args()
+
+    for jpeg_file_path in args.files:
+
+        try:
+            metadata = read_metadata(jpeg_file_path)
+        except (OSError, ValueError) as e:
+            print(f'{jpeg_file_path}: {e}')
+            continue
+
+        if metadata is None:
+            print(f'{jpeg_file_path}: no metadata')
+            continue
+
+        if args.extract:
+            # Same layout as Camera2.write_json
+            json_file_path = os.path.splitext(jpeg_file_path)[0] + '.json'
+            with open(json_file_path, 'w') as f:
+                dump(metadata, f, indent=4, sort_keys=True, separators=(',', ': '))
+            print(f'{jpeg_file_path} => {json_file_path}')
+        else:
+            print(f'{jpeg_file_path}')
+            print(dumps(metadata, indent=4, sort_keys=True, separators=(',', ': ')))
+
+if __name__ == '__main__':
+
+    main()
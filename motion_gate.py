@@ -0,0 +1,92 @@
+#! /usr/bin/python3
+
+import os
+from time import time
+
+import logging
+
+import numpy as np
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_motion_gate')
+logger.setLevel(logging.INFO)
+h = logging.FileHandler(os.path.join(today_log_path, TODAY + '_' + this_script + '.log'))
+f = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+h.setFormatter(f)
+logger.addHandler(h)
+
+class MotionGate():
+
+    # Running background on the lores frame => detection only when enough pixels changed
+    # or when a keyframe is due (so that a slowly arriving insect is never missed for long)
+    # Keyframes timed with the capture time of the frames => same gating on replayed captures (images_replay.py)
+
+    def __init__(self, configuration):
+
+        self.enable = configuration.ai_detection['motion_gate']['enable']
+        self.pixel_threshold = configuration.ai_detection['motion_gate']['pixel_threshold']
+        self.changed_ratio = configuration.ai_detection['motion_gate']['changed_ratio']
+        self.background_alpha = configuration.ai_detection['motion_gate']['background_alpha']
+        self.keyframe_interval = configuration.ai_detection['motion_gate']['keyframe_interval']
+
+        self.background = None
+        self.last_keyframe_time = 0
+
+        self.motion = False
+        self.ratio = 0.0
+
+        self.num_run = 0
+        self.num_skipped = 0
+
+    def check(self, frame, capture_time=None):
+
+        if capture_time is None:
+            capture_time = time()
+
+        if not self.enable:
+            self.motion = True
+            self.num_run += 1
+            return True
+
+        # Mean of the 3 channels is a good enough luminance for change detection
+        gray = frame.mean(axis=2, dtype=np.float32)
+
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            self.ratio = 1.0
+        else:
+            self.ratio = np.count_nonzero(np.abs(gray - self.background) > self.pixel_threshold) / gray.size
+            # background = (1 - alpha) * background + alpha * gray
+            self.background += self.background_alpha * (gray - self.background)
+
+        self.motion = self.ratio >= self.changed_ratio
+
+        # Capture time going backwards (another night replayed) => keyframe too
+        keyframe = not 0 <= capture_time - self.last_keyframe_time < self.keyframe_interval
+
+        if keyframe:
+            self.last_keyframe_time = capture_time
+            logger.info(f'keyframe => detection run on {self.num_run} frames, skipped on {self.num_skipped} frames')
+
+        if self.motion or keyframe:
+            self.num_run += 1
+            return True
+        else:
+            self.num_skipped += 1
+            return False
+
+    def __str__(self):
+
+        total = self.num_run + self.num_skipped
+
+        if total:
+            return f'detection run on {self.num_run} frames, skipped on {self.num_skipped} frames ({100 * self.num_skipped / total:.1f} % saved)'
+        else:
+            return 'no frame checked'
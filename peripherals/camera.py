@@ -6,14 +6,15 @@ from json import dump
 
 import logging
 
-import libcamera
-
-from picamera2 import Picamera2, Controls
-
 from cv2 import imencode, IMWRITE_JPEG_QUALITY, cvtColor, COLOR_YUV420p2RGB
 
 sys.path.append('..')
 
+import hardware
+import libcamera
+
+from picamera2 import Picamera2, Controls
+
 from globals_parameters import LOGS_FOLDER, TODAY
 
 picamera2_logger = logging.getLogger('picamera2')
@@ -7,21 +7,24 @@ from json import dump
 import logging
 
 import io
-from threading import Condition
-
-import libcamera
-
-from picamera2 import Picamera2, Controls
-from picamera2.encoders import MJPEGEncoder
-from picamera2.outputs import FileOutput
+from threading import Condition, Lock
+from queue import Queue, Empty
 
 import numpy as np
 
-from cv2 import imencode, IMWRITE_JPEG_QUALITY, cvtColor, COLOR_YUV420p2RGB
+from cv2 import cvtColor, COLOR_YUV420p2RGB, Laplacian, CV_16S
 
 sys.path.append('..')
 
+import hardware
+import libcamera
+
+from picamera2 import Picamera2, Controls, MappedArray
+from picamera2.encoders import MJPEGEncoder
+from picamera2.outputs import FileOutput
+
 from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
+from image_encoder import ImageEncoder
 
 this_script = os.path.basename(__file__)[:-3]
 
@@ -49,6 +52,21 @@ logger.addHandler(h)
 PREVIEW_WIDTH_MAX = 885
 PREVIEW_HEIGHT_MAX = 500
 
+BUFFER_COUNT = 4
+# Buffers left to libcamera when requests are held => the stream never starves
+MAX_HELD_REQUESTS = BUFFER_COUNT - 2
+
+# Frames dropped at most while waiting for a frame exposed after the LEDs switched
+MAX_SYNC_FRAMES = 8
+
+# Seconds waited for a free buffer of the frame pool before allocating a new frame
+FRAME_POOL_TIMEOUT = 1.0
+# Part of the available memory the frame pool may take when sized automatically
+FRAME_POOL_MEMORY_RATIO = 0.25
+
+# Quality of the annotated preview frames (server.py) => OpenCV default, as before encode_jpeg
+PREVIEW_JPEG_QUALITY = 95
+
 class StreamingOutput(io.BufferedIOBase):
     def __init__(self):
         self.frame = None
@@ -59,12 +77,166 @@ class StreamingOutput(io.BufferedIOBase):
             self.frame = buf
             self.condition.notify_all()
 
-class Camera2():
+class FrameBuffer():
+
+    def __init__(self, pool, index, main_shape, lores_shape):
+
+        # index None => buffer allocated outside the pool when it was empty, not reused
+        self.pool = pool
+        self.index = index
+        self.main = np.empty(main_shape, dtype=np.uint8)
+        self.lores = np.empty(lores_shape, dtype=np.uint8)
+        self.in_use = False
+
+    def release(self):
+
+        self.pool.release(self)
+
+class FramePool():
+
+    # Fixed ring of main/lores buffers written by capture => no allocation per frame
+    # A buffer belongs to its holder from acquire() until release(), then it is reused
+
+    def __init__(self, size, main_shape, lores_shape, timeout=FRAME_POOL_TIMEOUT):
+
+        self.size = size
+        self.main_shape = main_shape
+        self.lores_shape = lores_shape
+        self.timeout = timeout
+        self.buffers = [FrameBuffer(self, i, main_shape, lores_shape) for i in range(size)]
+
+        self.lock = Lock()
+        self.free = Queue()
+        for frame_buffer in self.buffers:
+            self.free.put(frame_buffer)
+
+        self.num_allocated = 0
+
+    def acquire(self):
+
+        try:
+            frame_buffer = self.free.get_nowait()
+        except Empty:
+            logger.warning('frame pool empty => capture waiting for a buffer')
+            s = time.perf_counter()
+            try:
+                frame_buffer = self.free.get(timeout=self.timeout)
+                logger.warning(f'frame buffer released after {time.perf_counter() - s:.3f} seconds')
+            except Empty:
+                # Pipeline stalled => the capture goes on with a frame allocated once
+                self.num_allocated += 1
+                logger.warning(f'no frame buffer released after {self.timeout} seconds => frame allocated ({self.num_allocated} since start)')
+                frame_buffer = FrameBuffer(self, None, self.main_shape, self.lores_shape)
+
+        frame_buffer.in_use = True
+
+        return frame_buffer
+
+    def release(self, frame_buffer):
+
+        with self.lock:
+            if not frame_buffer.in_use:
+                return
+            frame_buffer.in_use = False
+
+        if frame_buffer.index is not None:
+            self.free.put(frame_buffer)
+
+def frame_pool_size(configuration, main_shape, lores_shape):
+
+    # 'auto' => one buffer per frame the pipeline may hold: both queues full, one frame in inference,
+    # one per save worker and the frame being captured, within a part of the available memory
+    size = configuration.camera['frame_pool_size']
+
+    if size != 'auto':
+        return size
+
+    size = 2 * configuration.images_capture['queue_size'] + configuration.images_capture['save_workers'] + 2
+
+    frame_bytes = np.prod(main_shape) + np.prod(lores_shape)
+    try:
+        available_bytes = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError):
+        available_bytes = None
+
+    if available_bytes:
+        size = min(size, int(FRAME_POOL_MEMORY_RATIO * available_bytes // frame_bytes))
+
+    return max(size, 2)
+
+def copy_main(request, frame_buffer=None):
+
+    if frame_buffer is None:
+        return request.make_array('main')
+
+    with MappedArray(request, 'main') as m:
+        np.copyto(frame_buffer.main, m.array)
+
+    return frame_buffer.main
+
+def lores_sharpness(request):
+
+    # Variance of the Laplacian of the lores luminance => Y plane of the YUV420 stream, no conversion
+    width, height = request.config['lores']['size']
+
+    with MappedArray(request, 'lores') as m:
+        return float(Laplacian(m.array[:height, :width], CV_16S).var())
+
+class HeldRequest():
+
+    # CompletedRequest kept until we know whether the main frame is needed
+
+    def __init__(self, camera, request, frame_buffer=None):
+
+        self.camera = camera
+        self.request = request
+        self.frame_buffer = frame_buffer
+        self.frame_data_main = None
+        self.lock = Lock()
+
+    def make_main(self):
+
+        with self.lock:
+            if self.frame_data_main is None and self.request is not None:
+                if self.camera.metrics:
+                    s = time.perf_counter()
+                self.frame_data_main = copy_main(self.request, self.frame_buffer)
+                if self.camera.metrics:
+                    self.camera.metrics.record('copy_main', time.perf_counter() - s)
+                self.release_request()
+
+        return self.frame_data_main
+
+    def encode_jpeg(self, crop=None, quality=None):
+
+        # Main frame not copied => JPEG encoded straight from the request buffer, no copy
+        with self.lock:
+            if self.frame_data_main is None and self.request is not None:
+                with MappedArray(self.request, 'main') as m:
+                    return self.camera.encode_jpeg(m.array, crop=crop, quality=quality)
+
+        return self.camera.encode_jpeg(self.frame_data_main, crop=crop, quality=quality)
 
-    encode_param = [int(IMWRITE_JPEG_QUALITY), 90]
+    def release(self):
+
+        with self.lock:
+            self.release_request()
+
+    def release_request(self):
+
+        if self.request is not None:
+            self.request.release()
+            self.request = None
+            self.camera.request_released(self)
+
+class Camera2(ImageEncoder):
+
+    # JPEG encoding and metadata (encode_jpeg, metadata_to_json, embed_metadata...) from ImageEncoder
 
     def __init__(self, camera_number=0, configuration=None, mode='detection', verbose=False, perf=False):
 
+        ImageEncoder.__init__(self)
+
         try:
 
             self.camera = Picamera2(camera_number)
@@ -80,6 +252,18 @@ class Camera2():
             self.autofocus_available = False
 
             self.frame_data = None
+            self.frame_data_main = None
+            self.frame_data_lores = None
+            self.held_request = None
+            self.frame_pool = None
+            self.frame_buffer = None
+            # HeldRequest objects still holding a request, oldest first
+            self.held_requests = []
+            # Frames dropped by the last capture synchronised with the LEDs
+            self.num_sync_frames = 0
+            # Sharpness of the frame kept by the last burst capture
+            self.sharpness = 0.0
+            self.held_requests_lock = Lock()
             self.metadata = None
             self.jpeg_data = None
 
@@ -179,6 +363,8 @@ class Camera2():
 
             controls = controls.make_dict()
 
+            self.set_jpeg_encoder(configuration.files['jpeg_encoder'])
+
             image_width = configuration.camera['image_width']
             image_height = configuration.camera['image_height']
 
@@ -200,7 +386,7 @@ class Camera2():
                                                                         display=None,
                                                                         encode=None,
                                                                         transform=libcamera.Transform(vflip=True, hflip=True),
-                                                                        buffer_count=4, # speed up capture_array()
+                                                                        buffer_count=BUFFER_COUNT, # speed up capture_array()
                                                                         controls=controls)
 
                 self.encode_param[1] = configuration.files['jpeg_quality']
@@ -215,6 +401,15 @@ class Camera2():
                     logger.info(f'lores format {lores_format}')
                     logger.info(f'lores size {lores_size}')
 
+                    main_shape = (main_size[1], main_size[0], 3)
+                    lores_shape = (lores_size[1], lores_size[0], 3)
+                    size = frame_pool_size(configuration, main_shape, lores_shape)
+                    if size > 0:
+                        self.frame_pool = FramePool(size, main_shape, lores_shape)
+                        logger.info(f'frame pool of {size} buffers ({size * np.prod(main_shape) / 1E6:.0f} MB)')
+                    else:
+                        self.frame_pool = None
+
                 except RuntimeError as e:
 
                     logger.error('camera not configured')
@@ -239,6 +434,8 @@ class Camera2():
                                                                             transform=libcamera.Transform(vflip=True, hflip=True),
                                                                             controls=controls)
 
+                self.encode_param[1] = PREVIEW_JPEG_QUALITY
+
                 try:
 
                     self.camera.configure(self.camera_config)
@@ -380,28 +577,145 @@ class Camera2():
 
         return image_width, image_height
 
-    def capture(self, flush=True, to_jpeg=True, get_metadata=True):
+    def capture(self, flush=True, to_jpeg=True, get_metadata=True, hold_main=False, exposed_after=None, on_request=None, burst=1):
+
+        # hold_main => the main frame is not copied, the request is kept in self.held_request
+        # and the copy is done by held_request.make_main() only if really needed
+        # exposed_after => time.monotonic_ns() before which no row of the frame may have been exposed
+        # on_request => called as soon as the request is completed (the exposure is over)
+        # burst => number of consecutive frames from the running stream, only the sharpest one is kept
 
         if self.started:
             if self.perf:
                 s = time.perf_counter_ns()
 
-            request = self.camera.capture_request(flush=flush)
+            # With a frame pool, the frames are written into a preallocated buffer
+            # which must be released by its last holder (frame_buffer.release())
+            if self.frame_pool:
+                self.frame_buffer = self.frame_pool.acquire()
+            else:
+                self.frame_buffer = None
+
+            # Burst => 2 requests held during the capture instead of 1, taken from the held requests budget
+            if burst > 1:
+                self.free_held_requests(MAX_HELD_REQUESTS - 1)
+
+            if self.metrics:
+                t = time.perf_counter()
+
+            if exposed_after is None:
+                request = self.camera.capture_request(flush=flush)
+            else:
+                request = self.capture_request_exposed_after(exposed_after)
+
+            if burst > 1:
+                request = self.select_sharpest(request, burst)
 
-            self.frame_data_main = request.make_array('main')
+            if self.metrics:
+                self.metrics.record('wait_frame', time.perf_counter() - t)
 
-            self.frame_data_lores = cvtColor(request.make_array('lores'), COLOR_YUV420p2RGB)
+            if on_request:
+                on_request()
+
+            if self.metrics:
+                t = time.perf_counter()
+
+            if self.frame_buffer:
+                with MappedArray(request, 'lores') as m:
+                    self.frame_data_lores = cvtColor(m.array, COLOR_YUV420p2RGB, dst=self.frame_buffer.lores)
+            else:
+                self.frame_data_lores = cvtColor(request.make_array('lores'), COLOR_YUV420p2RGB)
+
+            if self.metrics:
+                self.metrics.record('yuv_to_rgb', time.perf_counter() - t)
 
             if get_metadata:
                 self.metadata = request.get_metadata()
+                if burst > 1:
+                    self.metadata['EntomoscopeBurstFrames'] = burst
+                    self.metadata['EntomoscopeSharpness'] = self.sharpness
             else:
                 self.metadata = None
 
-            request.release()
+            with self.held_requests_lock:
+                hold_main = hold_main and len(self.held_requests) < MAX_HELD_REQUESTS
+                if hold_main:
+                    self.frame_data_main = None
+                    self.held_request = HeldRequest(self, request, self.frame_buffer)
+                    self.held_requests.append(self.held_request)
+
+            if not hold_main:
+                if self.metrics:
+                    t = time.perf_counter()
+                self.frame_data_main = copy_main(request, self.frame_buffer)
+                if self.metrics:
+                    self.metrics.record('copy_main', time.perf_counter() - t)
+                self.held_request = None
+                request.release()
 
             if self.perf:
                 print(f'Capture {(time.perf_counter_ns() - s)/1E9}')
 
+    def select_sharpest(self, request, burst):
+
+        # Only the sharpest request is kept => at most 2 requests held during the burst
+        best_request = request
+        self.sharpness = lores_sharpness(request)
+
+        for i in range(burst - 1):
+
+            request = self.camera.capture_request(flush=False)
+            sharpness = lores_sharpness(request)
+
+            if sharpness > self.sharpness:
+                best_request.release()
+                best_request = request
+                self.sharpness = sharpness
+            else:
+                request.release()
+
+        return best_request
+
+    def capture_request_exposed_after(self, start_time):
+
+        # SensorTimestamp (time.monotonic_ns() clock) is the start of the readout of the first row
+        # => first row exposed from SensorTimestamp - ExposureTime, last row read before the request completes
+        for num_frames in range(MAX_SYNC_FRAMES):
+
+            request = self.camera.capture_request(flush=start_time)
+
+            metadata = request.get_metadata()
+
+            if metadata['SensorTimestamp'] - 1000 * metadata['ExposureTime'] >= start_time:
+                self.num_sync_frames = num_frames
+                return request
+
+            request.release()
+
+        logger.warning(f'no frame exposed after the switch in {MAX_SYNC_FRAMES} frames => next frame used')
+
+        self.num_sync_frames = MAX_SYNC_FRAMES
+
+        return self.camera.capture_request(flush=True)
+
+    def request_released(self, held_request):
+
+        with self.held_requests_lock:
+            self.held_requests.remove(held_request)
+
+    def free_held_requests(self, num_requests):
+
+        # Main frames of the oldest held requests copied until at most num_requests are held
+        # => their buffers are given back to libcamera
+        while True:
+
+            with self.held_requests_lock:
+                if len(self.held_requests) <= num_requests:
+                    return
+                held_request = self.held_requests[0]
+
+            held_request.make_main()
+
     def get_frame(self, stream='main'):
 
         if stream == 'lores':
@@ -411,22 +725,10 @@ class Camera2():
 
     def frame_to_jpeg(self, stream='main', crop=None):
 
-        if self.perf:
-            s = time.perf_counter_ns()
-
         if stream == 'lores':
-            if crop:
-                self.jpeg_data = imencode('.jpg', self.frame_data_lores[crop[0]:crop[1],crop[2]:crop[3],:], self.encode_param)[1].tobytes()
-            else:
-                self.jpeg_data = imencode('.jpg', self.frame_data_lores, self.encode_param)[1].tobytes()
+            self.jpeg_data = self.encode_jpeg(self.frame_data_lores, crop)
         else:
-            if crop:
-                self.jpeg_data = imencode('.jpg', self.frame_data_main[crop[0]:crop[1],crop[2]:crop[3],:], self.encode_param)[1].tobytes()
-            else:
-                self.jpeg_data = imencode('.jpg', self.frame_data_main, self.encode_param)[1].tobytes()
-
-        if self.perf:
-            print(f'Frame to JPEG {(time.perf_counter_ns() - s)/1E9}')
+            self.jpeg_data = self.encode_jpeg(self.frame_data_main, crop)
 
     def save_capture(self, file_path, save_metadata=True, extra_metadata=None):
 
@@ -448,23 +750,24 @@ class Camera2():
 
     def save_jpeg(self, jpeg_file_path):
 
-        if self.jpeg_data:
-            with open(jpeg_file_path, 'wb') as f:
-                f.write(self.jpeg_data)
+        self.write_jpeg(jpeg_file_path, self.jpeg_data)
 
     def save_json(self, json_file_path, extra_metadata=None):
 
-        if self.metadata:
+        self.write_json(json_file_path, self.metadata, extra_metadata)
 
-            if extra_metadata:
-                metadata = {}
-                metadata.update(self.metadata)
-                metadata.update(extra_metadata)
-            else:
-                metadata = self.metadata
+    def write_jpeg(self, jpeg_file_path, jpeg_data):
+
+        if jpeg_data:
+            with open(jpeg_file_path, 'wb') as f:
+                f.write(jpeg_data)
+
+    def write_json(self, json_file_path, metadata, extra_metadata=None):
+
+        if metadata:
 
             with open(json_file_path, 'w') as f:
-                dump(metadata, f, indent=4, sort_keys=True, separators=(',', ': '))
+                dump(self.merge_metadata(metadata, extra_metadata), f, indent=4, sort_keys=True, separators=(',', ': '))
 
     def get_controls(self):
 
@@ -486,10 +789,6 @@ class Camera2():
 
         self.camera.set_controls(control)
 
-    def set_encode_parameter(self, param_value):
-
-        self.encode_param[1] = param_value
-
     def set_auto_white_balance(self, awb_enable, awb_mode='Auto'):
 
         if awb_mode == 'Auto':
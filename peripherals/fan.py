@@ -1,4 +1,5 @@
 import argparse
+import hardware
 import pigpio
 from gpiozero import CPUTemperature
 
@@ -2,8 +2,6 @@
 
 import os
 import sys
-from serial import Serial
-import serial.tools.list_ports
 import logging
 
 from time import time
@@ -11,6 +9,10 @@ from datetime import datetime
 
 sys.path.append('..')
 
+import hardware
+from serial import Serial
+import serial.tools.list_ports
+
 from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
 
 this_script = os.path.basename(__file__)[:-3]
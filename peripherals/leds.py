@@ -1,4 +1,4 @@
-from time import sleep, time
+from time import sleep, time, monotonic_ns
 
 # Ornithoscope board
 # LED 1 Blue    GPIO23
@@ -17,6 +17,7 @@ from time import sleep, time
 # from gpiozero.pins.pigpio import PiGPIOFactory
 # from gpiozero.pins.native import NativeFactory
 # from gpiozero import PWMLED, Device
+import hardware
 import pigpio
 
 from math import exp
@@ -72,6 +73,9 @@ class Leds():
 
         self.is_on = False
 
+        # Time of the last switch (time.monotonic_ns(), same clock as the camera SensorTimestamp)
+        self.switch_time = 0
+
         self.intensity = intensity
 
         self.set_intensity(intensity)
@@ -97,6 +101,7 @@ class Leds():
             if dimming_level >= value:
                 pwm = self.dimming_curve[dimming_level]
                 self.pi.set_PWM_dutycycle(self.pin, int(100*pwm))
+                self.timestamp_switch()
                 break
 
         self.is_on = True
@@ -106,9 +111,15 @@ class Leds():
         if self.is_on:
 
             self.pi.set_PWM_dutycycle(self.pin, 0)
+            self.timestamp_switch()
 
             self.is_on = False
 
+    def timestamp_switch(self):
+
+        # set_PWM_dutycycle returns once pigpiod changed the PWM => the LEDs are switched
+        self.switch_time = monotonic_ns()
+
 if __name__ == '__main__':
 
     leds = [Leds(23, intensity=0), Leds(24, intensity=0)]
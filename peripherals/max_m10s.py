@@ -1,3 +1,4 @@
+import hardware
 import serial
 import time
 import threading
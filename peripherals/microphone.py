@@ -1,3 +1,4 @@
+import hardware
 import pyaudio
 import wave
 
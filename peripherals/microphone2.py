@@ -1,6 +1,5 @@
 import sys
 import os
-import pyaudio
 import wave
 
 from time import sleep
@@ -11,6 +10,9 @@ from subprocess import check_output
 
 sys.path.append('..')
 
+import hardware
+import pyaudio
+
 from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
 
 # ~ A TESTER : pyalsaaudio
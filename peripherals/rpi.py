@@ -182,7 +182,8 @@ class Rpi():
 
         try:
 
-            if 'aarch64' in check_output('uname -m', shell=True).decode('utf-8').strip():
+            # aarch64 on the Raspberry Pi, x86_64 with the simulated hardware
+            if check_output('uname -m', shell=True).decode('utf-8').strip().endswith('64'):
                 arch_version = '64-bit'
             else:
                 arch_version = '32-bit'
@@ -0,0 +1,104 @@
+from threading import Condition
+from time import monotonic
+
+import hardware
+import pigpio
+
+# Levels of the shutdown and standby pins followed with pigpio edge callbacks
+# => the capture loops block on wait() instead of reading the pins every 0.1-0.5 s
+#
+# Callbacks are triggered by pigpiod for any level change, including a pin written
+# by another script (shutdown.py, startup2.py, server.py)
+# While waiting for the resume, the pins are also read every poll_interval seconds
+# => an edge missed by pigpiod (daemon restarted) never blocks the capture
+
+class Signals():
+
+    # Edges shorter than this are ignored (microseconds)
+    glitch_filter = 1000
+
+    # Pins read again while waiting for the resume (seconds)
+    poll_interval = 1.0
+
+    def __init__(self, pi, shutdown_pin, standby_pin):
+
+        self.pi = pi
+
+        self.shutdown_pin = shutdown_pin
+        self.standby_pin = standby_pin
+
+        self.condition = Condition()
+
+        # Levels set before the callbacks => an edge can be received at once
+        self.levels = {}
+        self.read_levels()
+
+        self.callbacks = []
+
+        for pin in (self.shutdown_pin, self.standby_pin):
+            self.pi.set_glitch_filter(pin, self.glitch_filter)
+            self.callbacks.append(self.pi.callback(pin, pigpio.EITHER_EDGE, self.on_edge))
+
+        # Read again once the callbacks are set => no edge lost in between
+        self.read_levels()
+
+    def read_levels(self):
+
+        levels = {pin: self.pi.read(pin) for pin in (self.shutdown_pin, self.standby_pin)}
+
+        with self.condition:
+            if levels != self.levels:
+                self.levels.update(levels)
+                self.condition.notify_all()
+
+    def on_edge(self, pin, level, tick):
+
+        # level 2 => watchdog timeout, no level change
+        if level == 2:
+            return
+
+        with self.condition:
+            self.levels[pin] = level
+            self.condition.notify_all()
+
+    def shutdown(self):
+
+        return self.levels[self.shutdown_pin]
+
+    def standby(self):
+
+        return self.levels[self.standby_pin]
+
+    def wait(self, timeout=None):
+
+        # Returns after timeout seconds or as soon as the shutdown or standby pin changes
+        with self.condition:
+            levels = dict(self.levels)
+            self.condition.wait_for(lambda: self.levels != levels, timeout)
+
+    def wait_for_resume(self, timeout=None):
+
+        # Blocks while in standby => True if resumed, False if shutdown, None after timeout seconds
+        end_time = None if timeout is None else monotonic() + timeout
+
+        def resumed():
+            return self.levels[self.shutdown_pin] or not self.levels[self.standby_pin]
+
+        while True:
+
+            with self.condition:
+                wait_time = self.poll_interval if end_time is None else min(self.poll_interval, end_time - monotonic())
+                if self.condition.wait_for(resumed, max(0, wait_time)):
+                    return not self.levels[self.shutdown_pin]
+
+            if end_time is not None and monotonic() >= end_time:
+                return None
+
+            self.read_levels()
+
+    def cancel(self):
+
+        for callback in self.callbacks:
+            callback.cancel()
+
+        self.callbacks = []
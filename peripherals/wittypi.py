@@ -1,6 +1,5 @@
 import sys
 import os
-import smbus
 from time import sleep
 
 import logging
@@ -8,6 +7,9 @@ from logging.handlers import RotatingFileHandler
 
 sys.path.append('..')
 
+import hardware
+import smbus
+
 from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
 
 this_script = os.path.basename(__file__)[:-3]
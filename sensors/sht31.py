@@ -1,3 +1,4 @@
+import hardware
 import smbus
 from time import sleep
 
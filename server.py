@@ -17,6 +17,7 @@ from logging.handlers import RotatingFileHandler
 
 import base64
 
+import hardware
 import libcamera
 
 from crontab import CronTab
@@ -107,13 +108,13 @@ rpi = Rpi()
 
 if rpi.arch_version == '64-bit' and AI_ENABLE:
     AI_AVAILABLE = True
-    from ultralytics import YOLO
+    from ai_backends import load_ai_model
 else:
     AI_AVAILABLE = False
 
 if AI_AVAILABLE and AI_ENABLE:
-    ai_model = YOLO(AI_MODEL)
-    app.logger.info(f'ai model loaded: {AI_MODEL}')
+    ai_model, ai_model_path = load_ai_model(configuration)
+    app.logger.info(f'ai model loaded: {ai_model_path}')
 
 sd_card = Storage('sd')
 
@@ -749,7 +750,8 @@ def generate_frames():
                             if idx_color > len(ai_boxes_color):
                                 idx_color = 0
 
-                    img_encode = cv2.imencode('.jpg', frame2)[1]
+                    # Encodeur JPEG le plus rapide disponible (voir Camera2.set_jpeg_encoder)
+                    frame = camera.encode_jpeg(frame2)
 
                     if CAPTURE_DETECTION:
 
@@ -757,11 +759,7 @@ def generate_frames():
 
                         file_path = os.path.join(IMAGES_CAPTURE_FOLDER, now_str + '_detection_test.jpg')
 
-                        camera.jpeg_data = img_encode.tobytes()
-                        camera.save_jpeg(file_path)
-
-                    data_encode = np.array(img_encode)
-                    frame = data_encode.tobytes()
+                        camera.write_jpeg(file_path, frame)
 
             if capture_next_image:
 
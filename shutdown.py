@@ -1,4 +1,5 @@
 import os
+import hardware
 import pigpio
 from time import sleep
 import logging
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+
+from cv2 import imread, resize, cvtColor, COLOR_BGR2YUV_I420, INTER_AREA
+
+from images_replay import SyntheticFrames, find_replay_images
+from simulated_hardware import FRAMES_FOLDER, logger
+
+# Frames of the simulated camera, main (BGR, RGB888 of picamera2) and lores (YUV420 planar)
+#
+# Images of ENTOMOSCOPE_SIMULATION_FRAMES (captures _original.jpg/_no_ai_detection.jpg, any image
+# otherwise) or synthetic frames of images_replay.py, converted once when the camera is configured
+# and then replayed in a loop => no decoding cost during the captures, as with the ISP
+
+# Memory used by the frames replayed in a loop (bytes)
+MAX_FRAMES_MEMORY = 512 * 1024 * 1024
+
+MAX_FRAMES = 32
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
+def find_images(folder):
+
+    images = find_replay_images(folder)
+
+    if not images:
+        images = sorted(os.path.join(folder, file) for file in os.listdir(folder) if file.lower().endswith(IMAGE_SUFFIXES))
+
+    return images
+
+class CameraFrames():
+
+    def __init__(self, main_size, lores_size, frame_duration):
+
+        self.main_size = main_size
+        self.lores_size = lores_size
+
+        frame_bytes = main_size[0] * main_size[1] * 3 + (lores_size[0] * lores_size[1] * 3 // 2 if lores_size else 0)
+        num_frames = max(2, min(MAX_FRAMES, MAX_FRAMES_MEMORY // frame_bytes))
+
+        self.frames = []
+
+        if FRAMES_FOLDER:
+            try:
+                for image_path in find_images(FRAMES_FOLDER)[:num_frames]:
+                    frame = imread(image_path)
+                    if frame is not None:
+                        self.frames.append(self.make_frame(resize(frame, main_size, interpolation=INTER_AREA)))
+                logger.info(f'camera => {len(self.frames)} images of {FRAMES_FOLDER}')
+            except OSError as e:
+                logger.error(f'{FRAMES_FOLDER} not read => synthetic frames')
+                logger.error(str(e))
+
+        if not self.frames:
+            synthetic_frames = SyntheticFrames(main_size[0], main_size[1], frame_duration, 0)
+            self.frames = [self.make_frame(synthetic_frames.frame(i)[0]) for i in range(num_frames)]
+            logger.info(f'camera => {num_frames} synthetic frames')
+
+    def make_frame(self, main):
+
+        if self.lores_size:
+            lores = cvtColor(resize(main, self.lores_size, interpolation=INTER_AREA), COLOR_BGR2YUV_I420)
+        else:
+            lores = None
+
+        return {'main': np.ascontiguousarray(main), 'lores': lores}
+
+    def frame(self, index):
+
+        return self.frames[index % len(self.frames)]
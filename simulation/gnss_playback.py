@@ -0,0 +1,107 @@
+from time import gmtime, strftime
+from functools import reduce
+
+from simulated_hardware import GNSS_FILE, logger
+
+# Messages of the simulated GNSS receiver, one epoch per second
+#
+# Log file (ENTOMOSCOPE_SIMULATION_GNSS) => NMEA sentences and UBX messages of a u-blox log
+# (u-center .ubx or NMEA text) played back in a loop, epochs starting with the RMC sentence
+# (or the UBX NAV-PVT message for a log without NMEA)
+# No log file => RMC, VTG, GGA, GSA and GLL sentences of a fixed position at the current UTC time
+
+UBX_SYNC = b'\xb5\x62'
+
+UBX_NAV_PVT = (0x01, 0x07)
+
+# Position of the built-in fix (ddmm.mmmmm, dddmm.mmmmm, m)
+BUILTIN_LATITUDE = ('4337.15017', 'N')
+BUILTIN_LONGITUDE = ('00119.40006', 'E')
+BUILTIN_ALTITUDE = 183.9
+
+def split_messages(data):
+
+    # NMEA => from $ to \r\n, UBX => sync chars, class, id, length (little endian), payload, checksum
+    messages = []
+    i = 0
+
+    while i < len(data):
+
+        if data[i:i + 2] == UBX_SYNC and i + 6 <= len(data):
+            end = i + 8 + int.from_bytes(data[i + 4:i + 6], 'little')
+            messages.append(data[i:end])
+            i = end
+        elif data[i:i + 1] == b'$':
+            end = data.find(b'\n', i)
+            end = len(data) if end == -1 else end + 1
+            messages.append(data[i:end].rstrip(b'\r\n') + b'\r\n')
+            i = end
+        else:
+            i += 1
+
+    return messages
+
+def is_epoch_start(message, marker):
+
+    if marker == 'nmea':
+        return message[:1] == b'$' and message[3:6] == b'RMC'
+
+    return message[:2] == UBX_SYNC and tuple(message[2:4]) == UBX_NAV_PVT
+
+def nmea_sentence(body):
+
+    checksum = reduce(lambda x, y: x ^ y, body.encode('ascii'), 0)
+
+    return f'${body}*{checksum:02X}\r\n'.encode('ascii')
+
+def builtin_epoch(epoch_time):
+
+    utc = gmtime(epoch_time)
+
+    utc_time = strftime('%H%M%S', utc) + '.00'
+    utc_date = strftime('%d%m%y', utc)
+
+    latitude, ns = BUILTIN_LATITUDE
+    longitude, ew = BUILTIN_LONGITUDE
+
+    return [nmea_sentence(f'GPRMC,{utc_time},A,{latitude},{ns},{longitude},{ew},0.054,,{utc_date},,,A'),
+            nmea_sentence('GPVTG,,T,,M,0.054,N,0.100,K,A'),
+            nmea_sentence(f'GPGGA,{utc_time},{latitude},{ns},{longitude},{ew},1,09,0.97,{BUILTIN_ALTITUDE},M,48.5,M,,'),
+            nmea_sentence('GPGSA,A,3,02,05,11,13,15,18,20,24,29,,,,1.68,0.97,1.37'),
+            nmea_sentence(f'GPGLL,{latitude},{ns},{longitude},{ew},{utc_time},A,A')]
+
+class GnssPlayback():
+
+    def __init__(self, file_path=GNSS_FILE):
+
+        self.file_path = file_path
+        self.epochs = []
+
+        if self.file_path:
+            self.load()
+
+    def load(self):
+
+        try:
+            with open(self.file_path, 'rb') as f:
+                messages = split_messages(f.read())
+        except OSError as e:
+            logger.error(f'GNSS log {self.file_path} not read => built-in fix')
+            logger.error(str(e))
+            return
+
+        marker = 'nmea' if any(is_epoch_start(message, 'nmea') for message in messages) else 'ubx'
+
+        for message in messages:
+            if is_epoch_start(message, marker) or not self.epochs:
+                self.epochs.append([])
+            self.epochs[-1].append(message)
+
+        logger.info(f'GNSS log {self.file_path}: {len(messages)} messages, {len(self.epochs)} epochs')
+
+    def epoch(self, index, epoch_time):
+
+        if self.epochs:
+            return self.epochs[index % len(self.epochs)]
+
+        return builtin_epoch(epoch_time)
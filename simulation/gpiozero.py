@@ -0,0 +1,82 @@
+import pigpio
+
+# Simulated gpiozero => CPUTemperature of the computer (thermal zone 0) and OutputDevice on the simulated pins
+
+THERMAL_ZONE_FILE = '/sys/class/thermal/thermal_zone0/temp'
+
+class CPUTemperature():
+
+    def __init__(self, sensor_file=THERMAL_ZONE_FILE, min_temp=0.0, max_temp=100.0, threshold=80.0):
+
+        self.sensor_file = sensor_file
+        self.min_temp = min_temp
+        self.max_temp = max_temp
+        self.threshold = threshold
+
+    @property
+    def temperature(self):
+
+        # No thermal zone (container, virtual machine) => constant temperature
+        try:
+            with open(self.sensor_file, 'r') as f:
+                return int(f.read().strip()) / 1000
+        except (OSError, ValueError):
+            return 45.0
+
+    @property
+    def value(self):
+
+        return min(1.0, max(0.0, (self.temperature - self.min_temp) / (self.max_temp - self.min_temp)))
+
+    @property
+    def is_active(self):
+
+        return self.temperature > self.threshold
+
+    def close(self):
+
+        pass
+
+class OutputDevice():
+
+    def __init__(self, pin=None, active_high=True, initial_value=False, pin_factory=None):
+
+        self.pin = pin
+        self.active_high = active_high
+
+        self.pi = pigpio.pi()
+        self.pi.set_mode(self.pin, pigpio.OUTPUT)
+
+        if initial_value is not None:
+            self.value = initial_value
+
+    @property
+    def value(self):
+
+        return int(self.pi.read(self.pin) == self.active_high)
+
+    @value.setter
+    def value(self, value):
+
+        self.pi.write(self.pin, int(bool(value) == self.active_high))
+
+    @property
+    def is_active(self):
+
+        return bool(self.value)
+
+    def on(self):
+
+        self.value = 1
+
+    def off(self):
+
+        self.value = 0
+
+    def toggle(self):
+
+        self.value = not self.value
+
+    def close(self):
+
+        self.pi.stop()
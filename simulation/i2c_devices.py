@@ -0,0 +1,162 @@
+from time import time, localtime, mktime
+from math import sin, pi
+import random
+
+from simulated_hardware import SharedState, pwm_load, logger
+
+# Devices of the simulated I2C bus, used by the simulated smbus and pigpio
+#
+# WittyPi (0x08) => registers of the WittyPi 4 firmware, RTC in BCD (registers 58 to 64) following the
+# system time (with the offset set by set_date), voltages and current depending on the LEDs lit
+# SHT31 (0x45) => single shot measurement, temperature and humidity following the time of the day
+#
+# Absent address => OSError 121 (Remote I/O error) as with the real bus
+
+WITTYPI_FIRMWARE_ID = 0x26
+
+WITTYPI_RTC_REGISTERS = range(58, 65)
+
+def to_bcd(value):
+
+    return ((value // 10) << 4) + value % 10
+
+def from_bcd(value):
+
+    return ((value & 0xF0) >> 4) * 10 + (value & 0x0F)
+
+def crc8(data):
+
+    # CRC of the Sensirion sensors (polynomial 0x31, initialisation 0xFF)
+    crc = 0xFF
+
+    for byte in data:
+        crc ^= byte
+        for i in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+
+    return crc
+
+class WittyPiDevice():
+
+    def __init__(self):
+
+        self.state = SharedState('wittypi', {'input_voltage': 12.1, 'registers': {}, 'rtc_offset': 0.0})
+
+        # RTC registers written one by one by set_date => offset computed when the year is written
+        self.rtc_pending = {}
+
+    def read_byte_data(self, register):
+
+        state = self.state.read()
+
+        if register == 0x00:
+            return WITTYPI_FIRMWARE_ID
+
+        if register in (0x01, 0x02):
+            return self.split_value(state['input_voltage'] - 0.05 * pwm_load(), register == 0x01)
+
+        if register in (0x03, 0x04):
+            return self.split_value(5.1, register == 0x03)
+
+        if register in (0x05, 0x06):
+            # Raspberry Pi and capture => ~0.6 A, each LED panel fully lit => +0.4 A
+            current = 0.6 + 0.4 * pwm_load() + random.uniform(-0.02, 0.02)
+            return self.split_value(current, register == 0x05)
+
+        if register in WITTYPI_RTC_REGISTERS:
+            date = localtime(time() + state['rtc_offset'])
+            return to_bcd([date.tm_sec, date.tm_min, date.tm_hour, date.tm_mday, (date.tm_wday + 1) % 7, date.tm_mon, date.tm_year % 100][register - 58])
+
+        return state['registers'].get(str(register), 0)
+
+    def write_byte_data(self, register, value):
+
+        if register in WITTYPI_RTC_REGISTERS:
+
+            self.rtc_pending[register] = from_bcd(value)
+
+            if all(register in self.rtc_pending for register in (58, 59, 60, 61, 63, 64)):
+
+                date = self.rtc_pending
+                rtc_time = mktime((2000 + date[64], date[63], date[61], date[60], date[59], date[58], 0, 0, -1))
+
+                with self.state.update() as state:
+                    state['rtc_offset'] = rtc_time - time()
+
+                logger.info(f"WittyPi RTC set (offset {rtc_time - time():.1f} seconds)")
+
+                self.rtc_pending = {}
+
+        else:
+
+            with self.state.update() as state:
+                state['registers'][str(register)] = value
+
+    def split_value(self, value, integer_part):
+
+        # Integer part in one register, hundredths in the next one
+        return int(value) if integer_part else int(round(100 * (value - int(value)))) % 100
+
+class SHT31Device():
+
+    def __init__(self):
+
+        self.measurement = [0] * 6
+
+    def read_byte(self):
+
+        return 0
+
+    def measure(self):
+
+        # Coldest at 5h, warmest at 17h, the humidity follows the temperature the other way
+        hour = localtime().tm_hour + localtime().tm_min / 60
+        temperature = 18 + 6 * sin(2 * pi * (hour - 11) / 24) + random.gauss(0, 0.1)
+        humidity = min(100.0, max(0.0, 65 - 3 * (temperature - 18) + random.gauss(0, 0.5)))
+
+        raw_temperature = int(round((temperature + 45) * 65535 / 175))
+        raw_humidity = int(round(humidity * 65535 / 100))
+
+        t = [raw_temperature >> 8, raw_temperature & 0xFF]
+        rh = [raw_humidity >> 8, raw_humidity & 0xFF]
+
+        self.measurement = t + [crc8(t)] + rh + [crc8(rh)]
+
+    def write_i2c_block_data(self, command, data):
+
+        # 0x2C 0x06 => single shot, high repeatability, clock stretching
+        if command == 0x2C:
+            self.measure()
+
+    def read_i2c_block_data(self, command, length=32):
+
+        return (self.measurement + [0xFF] * length)[:max(length, 6)]
+
+I2C_DEVICES = {0x08: WittyPiDevice, 0x45: SHT31Device}
+
+class I2CBus():
+
+    def __init__(self, bus):
+
+        self.bus = bus
+        self.devices = {}
+
+    def device(self, address):
+
+        if address not in I2C_DEVICES:
+            raise OSError(121, 'Remote I/O error')
+
+        if address not in self.devices:
+            self.devices[address] = I2C_DEVICES[address]()
+
+        return self.devices[address]
+
+    def call(self, address, method, *args):
+
+        device = self.device(address)
+
+        # Register access not implemented by the device => no acknowledge
+        if not hasattr(device, method):
+            raise OSError(121, 'Remote I/O error')
+
+        return getattr(device, method)(*args)
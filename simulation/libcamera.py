@@ -0,0 +1,47 @@
+from enum import IntEnum
+
+# Simulated libcamera => Transform and the control enums used by Camera2 (values of libcamera)
+
+class Transform():
+
+    def __init__(self, hflip=False, vflip=False, transpose=False):
+
+        self.hflip = hflip
+        self.vflip = vflip
+        self.transpose = transpose
+
+    def __repr__(self):
+
+        return f'<libcamera.Transform hflip={int(self.hflip)} vflip={int(self.vflip)} transpose={int(self.transpose)}>'
+
+class controls():
+
+    class AeExposureModeEnum(IntEnum):
+        Normal = 0
+        Short = 1
+        Long = 2
+        Custom = 3
+
+    class AfModeEnum(IntEnum):
+        Manual = 0
+        Auto = 1
+        Continuous = 2
+
+    class AfRangeEnum(IntEnum):
+        Normal = 0
+        Macro = 1
+        Full = 2
+
+    class AfSpeedEnum(IntEnum):
+        Normal = 0
+        Fast = 1
+
+    class AwbModeEnum(IntEnum):
+        Auto = 0
+        Incandescent = 1
+        Tungsten = 2
+        Fluorescent = 3
+        Indoor = 4
+        Daylight = 5
+        Cloudy = 6
+        Custom = 7
@@ -0,0 +1,426 @@
+from time import monotonic_ns, sleep
+from threading import Thread, Lock
+import random
+
+from simulated_hardware import CAMERA_MODEL, logger
+
+# Simulated Picamera2 => Raspberry Pi camera (imx708 by default, see simulated_hardware.py)
+#
+# The sensor streams frames continuously once started: frame k read from
+# SensorTimestamp(k) = start + k * frame duration, completed readout_time later
+# Frame duration of the sensor mode, longer when the exposure time or FrameDurationLimits need it
+#
+# capture_request() as picamera2:
+# flush=False => last completed frame not returned yet (may be older than the call), else the next one
+# flush=True => first frame read after the call, flush=time.monotonic_ns() => first frame read after this time
+#
+# Frames replayed from camera_frames.py, copied by make_array() as by picamera2
+
+SENSORS = {
+    'imx708': {'size': (4608, 2592), 'autofocus': True,
+               'modes': [((1536, 864), 120.13, (768, 432, 3072, 1728)),
+                         ((2304, 1296), 56.03, (0, 0, 4608, 2592)),
+                         ((4608, 2592), 14.35, (0, 0, 4608, 2592))]},
+    'imx219': {'size': (3280, 2464), 'autofocus': False,
+               'modes': [((640, 480), 103.33, (1000, 752, 1280, 960)),
+                         ((1640, 1232), 41.85, (0, 0, 3280, 2464)),
+                         ((1920, 1080), 47.57, (680, 692, 1920, 1080)),
+                         ((3280, 2464), 21.19, (0, 0, 3280, 2464))]},
+    'ov5647': {'size': (2592, 1944), 'autofocus': False,
+               'modes': [((640, 480), 58.92, (16, 0, 2560, 1920)),
+                         ((1296, 972), 43.25, (0, 0, 2592, 1944)),
+                         ((1920, 1080), 30.62, (348, 434, 1928, 1080)),
+                         ((2592, 1944), 15.63, (0, 0, 2592, 1944))]},
+    'imx477': {'size': (4056, 3040), 'autofocus': False,
+               'modes': [((1332, 990), 120.05, (696, 528, 2664, 1980)),
+                         ((2028, 1080), 50.03, (0, 440, 4056, 2160)),
+                         ((2028, 1520), 40.01, (0, 0, 4056, 3040)),
+                         ((4056, 3040), 10.0, (0, 0, 4056, 3040))]}}
+
+# Exposure time chosen by the auto exposure (microseconds)
+AUTO_EXPOSURE_TIME = 10000
+
+# Readout of the sensor => part of the minimum frame duration of the mode
+READOUT_RATIO = 0.9
+
+class Controls():
+
+    # Controls set as attributes => dictionary for create_xxx_configuration() and set_controls()
+
+    def __init__(self, picam2, controls=None):
+
+        object.__setattr__(self, '_controls', dict(controls or {}))
+
+    def __setattr__(self, name, value):
+
+        self._controls[name] = value
+
+    def __getattr__(self, name):
+
+        try:
+            return self._controls[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def make_dict(self):
+
+        return dict(self._controls)
+
+class CompletedRequest():
+
+    def __init__(self, picam2, frame, metadata):
+
+        self.picam2 = picam2
+        self.frame = frame
+        self.metadata = metadata
+        self.config = picam2.camera_config
+
+        self.released = False
+
+    def make_array(self, name='main'):
+
+        return self.frame[name].copy()
+
+    def get_metadata(self):
+
+        return dict(self.metadata)
+
+    def release(self):
+
+        if not self.released:
+            self.released = True
+            self.picam2.request_released()
+
+class MappedArray():
+
+    # Array of the buffer of the request, without copy
+
+    def __init__(self, request, stream, reshape=True, write=True):
+
+        self.request = request
+        self.stream = stream
+
+    def __enter__(self):
+
+        self.array = self.request.frame[self.stream]
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.array = None
+
+class Picamera2():
+
+    def __init__(self, camera_num=0, tuning=None):
+
+        # One camera connected, as on the Entomoscope
+        if camera_num != 0:
+            raise IndexError('list index out of range')
+
+        if CAMERA_MODEL not in SENSORS:
+            raise RuntimeError(f'camera model {CAMERA_MODEL} not simulated ({", ".join(SENSORS)})')
+
+        self.sensor = SENSORS[CAMERA_MODEL]
+
+        width, height = self.sensor['size']
+
+        self.camera_properties = {'Model': CAMERA_MODEL,
+                                  'Location': 2,
+                                  'Rotation': 180,
+                                  'PixelArraySize': (width, height),
+                                  'PixelArrayActiveAreas': [(0, 0, width, height)],
+                                  'ScalerCropMaximum': (0, 0, width, height)}
+
+        self.sensor_modes = [{'format': 'SRGGB10_CSI2P', 'unpacked': 'SRGGB10', 'bit_depth': 10, 'size': size, 'fps': fps,
+                              'crop_limits': crop_limits, 'exposure_limits': (9, 77208384, None)} for size, fps, crop_limits in self.sensor['modes']]
+
+        self.camera_controls = {'AeEnable': (False, True, True),
+                                'AeExposureMode': (0, 3, 0),
+                                'AnalogueGain': (1.0, 16.0, 1.0),
+                                'AwbEnable': (False, True, None),
+                                'AwbMode': (0, 7, 0),
+                                'ExposureTime': (26, 77208384, 20000),
+                                'ExposureValue': (-8.0, 8.0, 0.0),
+                                'FrameDurationLimits': (8333, 77208384, None),
+                                'ScalerCrop': ((0, 0, 64, 64), (0, 0, width, height), (0, 0, width, height))}
+
+        if self.sensor['autofocus']:
+            self.camera_controls.update({'AfMode': (0, 2, 0),
+                                         'AfRange': (0, 2, 0),
+                                         'AfSpeed': (0, 1, 0),
+                                         'LensPosition': (0.0, 15.0, 1.0)})
+
+        self.camera_config = None
+        self.controls = {}
+        self.sensor_mode = None
+        self.frames = None
+
+        self.started = False
+        self.lock = Lock()
+
+        # Frame clock => SensorTimestamp(k) = base_time + (k - base_index) * frame_duration
+        self.frame_duration = 0
+        self.readout_time = 0
+        self.base_index = 0
+        self.base_time = 0
+        self.last_index = -1
+
+        self.num_requests = 0
+
+        self.encoder = None
+        self.encoder_thread = None
+
+        logger.info(f'camera {CAMERA_MODEL} opened')
+
+    def create_configuration(self, use_case, main, lores, sensor, controls, buffer_count, default_main, default_controls, transform=None, **kwargs):
+
+        main = dict(main or {})
+        main.setdefault('format', 'BGR888')
+        main.setdefault('size', default_main)
+
+        if lores:
+            lores = dict(lores)
+            lores.setdefault('format', 'YUV420')
+
+        configuration_controls = dict(default_controls)
+        configuration_controls.update(controls or {})
+
+        return {'use_case': use_case,
+                'transform': transform,
+                'buffer_count': buffer_count,
+                'queue': True,
+                'main': main,
+                'lores': lores,
+                'raw': None,
+                'display': None,
+                'encode': None,
+                'sensor': dict(sensor or {}),
+                'controls': configuration_controls}
+
+    def create_still_configuration(self, main={}, lores=None, raw=None, transform=None, colour_space=None, buffer_count=1, controls={}, display=None, encode=None, sensor={}, queue=True):
+
+        return self.create_configuration('still', main, lores, sensor, controls, buffer_count, self.sensor['size'],
+                                         {'FrameDurationLimits': (100, 1000000000)}, transform=transform)
+
+    def create_video_configuration(self, main={}, lores=None, raw=None, transform=None, colour_space=None, buffer_count=6, controls={}, display='main', encode='main', sensor={}, queue=True):
+
+        return self.create_configuration('video', main, lores, sensor, controls, buffer_count, (1280, 720),
+                                         {'FrameDurationLimits': (33333, 33333)}, transform=transform)
+
+    def create_preview_configuration(self, main={}, lores=None, raw=None, transform=None, colour_space=None, buffer_count=4, controls={}, display='main', encode='main', sensor={}, queue=True):
+
+        return self.create_configuration('preview', main, lores, sensor, controls, buffer_count, (640, 480),
+                                         {'FrameDurationLimits': (100, 83333)}, transform=transform)
+
+    def configure(self, camera_config=None):
+
+        if self.started:
+            raise RuntimeError('Camera must be stopped before configuring')
+
+        if camera_config is None:
+            camera_config = self.create_preview_configuration()
+
+        # Sensor mode requested, else the smallest mode covering the main stream
+        output_size = tuple(camera_config['sensor'].get('output_size') or ())
+        main_size = tuple(camera_config['main']['size'])
+
+        modes = [mode for mode in self.sensor_modes if tuple(mode['size']) == output_size]
+        if not modes:
+            modes = [mode for mode in self.sensor_modes if mode['size'][0] >= main_size[0] and mode['size'][1] >= main_size[1]] or self.sensor_modes[-1:]
+        self.sensor_mode = modes[0]
+
+        self.camera_config = camera_config
+        self.controls = dict(camera_config['controls'])
+
+        lores_size = tuple(camera_config['lores']['size']) if camera_config['lores'] else None
+
+        # Converted once => no decoding during the captures
+        from camera_frames import CameraFrames
+        self.frames = CameraFrames(main_size, lores_size, 1 / self.sensor_mode['fps'])
+
+        self.readout_time = int(READOUT_RATIO * 1E9 / self.sensor_mode['fps'])
+        self.frame_duration = self.get_frame_duration()
+
+        logger.info(f"camera configured: sensor mode {self.sensor_mode['size']} {self.sensor_mode['fps']} fps, "
+                    f"main {main_size}, lores {lores_size}, {1E9 / self.frame_duration:.2f} fps")
+
+    def get_exposure_time(self):
+
+        if self.controls.get('AeEnable', True) or not self.controls.get('ExposureTime'):
+            return AUTO_EXPOSURE_TIME
+
+        return self.controls['ExposureTime']
+
+    def get_frame_duration(self):
+
+        # Nanoseconds => mode limit, FrameDurationLimits minimum, exposure time
+        frame_duration = 1E9 / self.sensor_mode['fps']
+
+        limits = self.controls.get('FrameDurationLimits')
+        if limits:
+            frame_duration = max(frame_duration, 1000 * limits[0])
+
+        return int(max(frame_duration, 1000 * self.get_exposure_time()))
+
+    def start(self, config=None, show_preview=False):
+
+        if config is not None or self.camera_config is None:
+            self.configure(config)
+
+        with self.lock:
+            self.base_time = monotonic_ns()
+            self.base_index = 0
+            self.last_index = -1
+
+        self.started = True
+
+        logger.info('camera started')
+
+    def stop(self):
+
+        if self.encoder:
+            self.stop_encoder()
+
+        self.started = False
+
+    def close(self):
+
+        self.stop()
+
+        logger.info('camera closed')
+
+    def set_controls(self, controls):
+
+        with self.lock:
+
+            self.controls.update(controls)
+
+            # New frame duration from the next frame
+            frame_duration = self.get_frame_duration()
+
+            if frame_duration != self.frame_duration:
+                if self.started:
+                    next_index = self.index_at(monotonic_ns()) + 1
+                    self.base_time = self.sensor_timestamp(next_index)
+                    self.base_index = next_index
+                self.frame_duration = frame_duration
+
+    def sensor_timestamp(self, index):
+
+        return self.base_time + (index - self.base_index) * self.frame_duration
+
+    def index_at(self, timestamp):
+
+        # Last frame whose readout started at timestamp
+        return self.base_index + (timestamp - self.base_time) // self.frame_duration
+
+    def capture_request(self, flush=False, wait=None, signal_function=None):
+
+        if not self.started:
+            raise RuntimeError('Camera is not running')
+
+        now = monotonic_ns()
+
+        with self.lock:
+
+            if flush is False:
+                # Last completed frame if not returned yet
+                index = max(self.last_index + 1, self.index_at(now - self.readout_time))
+            else:
+                threshold = now if flush is True else flush
+                index = max(self.last_index + 1, self.index_at(threshold - 1) + 1)
+
+            self.last_index = index
+
+            sensor_timestamp = self.sensor_timestamp(index)
+            frame_duration = self.frame_duration
+
+        # Request completed at the end of the readout
+        delay = sensor_timestamp + self.readout_time - monotonic_ns()
+        if delay > 0:
+            sleep(delay / 1E9)
+
+        exposure_time = self.get_exposure_time()
+
+        metadata = {'SensorTimestamp': sensor_timestamp,
+                    'ExposureTime': exposure_time,
+                    'FrameDuration': frame_duration // 1000,
+                    'AnalogueGain': self.controls.get('AnalogueGain', 1.0) if not self.controls.get('AeEnable', True) else 1.0,
+                    'DigitalGain': 1.0,
+                    'ColourGains': (1.9, 1.6),
+                    'ColourTemperature': 4500,
+                    'Lux': round(random.uniform(380, 420), 1),
+                    'ScalerCrop': self.controls.get('ScalerCrop', self.sensor_mode['crop_limits']),
+                    'SensorTemperature': 40.0,
+                    'FocusFoM': random.randint(900, 1100)}
+
+        if self.sensor['autofocus']:
+            metadata['LensPosition'] = self.controls.get('LensPosition', 1.0)
+            metadata['AfState'] = 0
+
+        with self.lock:
+            self.num_requests += 1
+            # All the buffers held => libcamera would drop the frames until a request is released
+            if self.num_requests > self.camera_config['buffer_count']:
+                logger.warning(f"{self.num_requests} requests held with {self.camera_config['buffer_count']} buffers")
+
+        return CompletedRequest(self, self.frames.frame(index), metadata)
+
+    def request_released(self):
+
+        with self.lock:
+            self.num_requests -= 1
+
+    def capture_metadata(self, wait=None):
+
+        request = self.capture_request()
+        metadata = request.get_metadata()
+        request.release()
+
+        return metadata
+
+    def capture_array(self, name='main', wait=None):
+
+        request = self.capture_request()
+        array = request.make_array(name)
+        request.release()
+
+        return array
+
+    def start_encoder(self, encoder=None, output=None, pts=None, quality=None, name=None):
+
+        if encoder is not None:
+            self.encoder = encoder
+        if output is not None:
+            self.encoder.output = output
+
+        self.encoder.running = True
+        self.encoder_thread = Thread(target=self.encode, name='picamera2_encoder', daemon=True)
+        self.encoder_thread.start()
+
+    def stop_encoder(self, encoders=None):
+
+        if self.encoder:
+            self.encoder.running = False
+            if self.encoder_thread:
+                self.encoder_thread.join()
+            self.encoder_thread = None
+            self.encoder = None
+
+    def encode(self):
+
+        # Every frame of the stream encoded => frame rate of the camera
+        while self.encoder.running:
+
+            if not self.started:
+                sleep(0.01)
+                continue
+
+            request = self.capture_request()
+            self.encoder.encode(request.frame['main'], request.metadata['SensorTimestamp'])
+            request.release()
+
+    def set_overlay(self, overlay):
+
+        pass
@@ -0,0 +1,23 @@
+from cv2 import imencode, IMWRITE_JPEG_QUALITY
+
+# Simulated picamera2 encoders => MJPEG frames encoded with OpenCV by the encoder thread of Picamera2
+
+class MJPEGEncoder():
+
+    def __init__(self, bitrate=None, q=None):
+
+        self.bitrate = bitrate
+        self.output = []
+        self.running = False
+
+        # No quality from the bitrate with OpenCV => quality of the preview
+        self.quality = 85
+
+    def encode(self, frame, timestamp):
+
+        jpeg_data = imencode('.jpg', frame, [int(IMWRITE_JPEG_QUALITY), self.quality])[1].tobytes()
+
+        outputs = self.output if isinstance(self.output, list) else [self.output]
+
+        for output in outputs:
+            output.outputframe(jpeg_data, keyframe=True, timestamp=timestamp // 1000)
@@ -0,0 +1,13 @@
+# Simulated picamera2 outputs => frames written to a file like object
+
+class FileOutput():
+
+    def __init__(self, file=None, pts=None, split=None):
+
+        self.file = file
+
+    def outputframe(self, frame, keyframe=True, timestamp=None):
+
+        if self.file is not None:
+            self.file.write(frame)
+            self.file.flush()
@@ -0,0 +1,222 @@
+from time import monotonic, sleep
+from threading import Thread, Lock
+
+from simulated_hardware import PINS, logger
+from i2c_devices import I2CBus
+
+# Simulated pigpio => levels and PWM of the pins kept in the shared state, as by pigpiod
+# => a pin written by a script is read by all the others
+#
+# Callbacks are called by a thread polling the shared state => an edge written by another
+# process (shutdown.py, server.py...) is seen within POLL_INTERVAL seconds
+#
+# I2C => devices of the simulated I2C bus (see i2c_devices.py)
+
+INPUT = 0
+OUTPUT = 1
+
+PUD_OFF = 0
+PUD_DOWN = 1
+PUD_UP = 2
+
+RISING_EDGE = 0
+FALLING_EDGE = 1
+EITHER_EDGE = 2
+
+TIMEOUT = 2
+
+POLL_INTERVAL = 0.02
+
+class error(Exception):
+
+    pass
+
+class _callback():
+
+    def __init__(self, pi, pin, edge, func):
+
+        self.pi = pi
+        self.pin = pin
+        self.edge = edge
+        self.func = func
+
+    def cancel(self):
+
+        self.pi.cancel_callback(self)
+
+class pi():
+
+    def __init__(self, host='localhost', port=8888):
+
+        self.connected = True
+
+        self.callbacks = []
+        self.callbacks_lock = Lock()
+        self.callbacks_thread = None
+
+        self.i2c_bus = I2CBus(1)
+        self.i2c_handles = {}
+
+    def read(self, gpio):
+
+        return PINS.read()['levels'].get(str(gpio), 0)
+
+    def write(self, gpio, level):
+
+        with PINS.update() as pins:
+            pins['levels'][str(gpio)] = 1 if level else 0
+            pins['dutycycles'].pop(str(gpio), None)
+
+        return 0
+
+    def set_mode(self, gpio, mode):
+
+        with PINS.update() as pins:
+            pins['modes'][str(gpio)] = mode
+
+        return 0
+
+    def get_mode(self, gpio):
+
+        return PINS.read()['modes'].get(str(gpio), INPUT)
+
+    def set_pull_up_down(self, gpio, pud):
+
+        return 0
+
+    def set_glitch_filter(self, gpio, steady):
+
+        return 0
+
+    def set_PWM_range(self, gpio, range_):
+
+        with PINS.update() as pins:
+            pins['ranges'][str(gpio)] = range_
+
+        return 0
+
+    def get_PWM_range(self, gpio):
+
+        return PINS.read()['ranges'].get(str(gpio), 255)
+
+    def set_PWM_frequency(self, gpio, frequency):
+
+        return frequency
+
+    def set_PWM_dutycycle(self, gpio, dutycycle):
+
+        # Level of a PWM pin => high while the duty cycle is not 0
+        with PINS.update() as pins:
+            pins['dutycycles'][str(gpio)] = dutycycle
+            pins['levels'][str(gpio)] = 1 if dutycycle else 0
+
+        return 0
+
+    def get_PWM_dutycycle(self, gpio):
+
+        return PINS.read()['dutycycles'].get(str(gpio), 0)
+
+    def get_current_tick(self):
+
+        # Microseconds, 32 bits wrap around as pigpiod
+        return int(1E6 * monotonic()) & 0xFFFFFFFF
+
+    def callback(self, user_gpio, edge=RISING_EDGE, func=None):
+
+        callback = _callback(self, user_gpio, edge, func)
+
+        with self.callbacks_lock:
+            self.callbacks.append(callback)
+            if not self.callbacks_thread:
+                self.callbacks_thread = Thread(target=self.poll_levels, name='pigpio_callbacks', daemon=True)
+                self.callbacks_thread.start()
+
+        return callback
+
+    def cancel_callback(self, callback):
+
+        with self.callbacks_lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+    def poll_levels(self):
+
+        last_mtime = PINS.mtime()
+        levels = PINS.read()['levels']
+
+        while self.connected:
+
+            sleep(POLL_INTERVAL)
+
+            mtime = PINS.mtime()
+            if mtime == last_mtime:
+                continue
+            last_mtime = mtime
+
+            new_levels = PINS.read()['levels']
+
+            with self.callbacks_lock:
+                callbacks = list(self.callbacks)
+
+            for callback in callbacks:
+
+                previous_level = levels.get(str(callback.pin), 0)
+                level = new_levels.get(str(callback.pin), 0)
+
+                if level == previous_level:
+                    continue
+
+                if callback.edge == EITHER_EDGE or (callback.edge == RISING_EDGE) == (level == 1):
+                    try:
+                        callback.func(callback.pin, level, self.get_current_tick())
+                    except Exception as e:
+                        logger.error(f'pigpio callback of pin {callback.pin}')
+                        logger.error(str(e))
+
+            levels = new_levels
+
+    def i2c_open(self, i2c_bus, i2c_address, i2c_flags=0):
+
+        handle = len(self.i2c_handles)
+        self.i2c_handles[handle] = i2c_address
+
+        return handle
+
+    def i2c_close(self, handle):
+
+        self.i2c_handles.pop(handle, None)
+
+        return 0
+
+    def i2c_call(self, handle, method, *args):
+
+        try:
+            return self.i2c_bus.call(self.i2c_handles[handle], method, *args)
+        except (KeyError, OSError):
+            raise error('I2C read failed')
+
+    def i2c_read_byte_data(self, handle, i2c_reg):
+
+        return self.i2c_call(handle, 'read_byte_data', i2c_reg)
+
+    def i2c_write_byte_data(self, handle, i2c_reg, byte_val):
+
+        self.i2c_call(handle, 'write_byte_data', i2c_reg, byte_val)
+
+        return 0
+
+    def i2c_read_device(self, handle, count):
+
+        data = self.i2c_call(handle, 'read_i2c_block_data', 0, count)[:count]
+
+        return len(data), bytearray(data)
+
+    def i2c_write_device(self, handle, data):
+
+        self.i2c_call(handle, 'write_i2c_block_data', data[0], list(data[1:]))
+
+        return 0
+
+    def stop(self):
+
+        self.connected = False
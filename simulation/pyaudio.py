@@ -0,0 +1,171 @@
+import wave
+from time import perf_counter, sleep
+
+import numpy as np
+
+from simulated_hardware import WAV_FILE, logger
+
+# Simulated PyAudio => AudioMoth USB microphone recording in real time
+#
+# WAV file (ENTOMOSCOPE_SIMULATION_WAV) played back in a loop, converted to the sample rate of the
+# stream (first channel only), synthetic background noise with chirps otherwise
+# read() returns when the samples would have been recorded => same timing as the microphone
+
+paFloat32 = 1
+paInt32 = 2
+paInt24 = 4
+paInt16 = 8
+paInt8 = 16
+paUInt8 = 32
+
+SAMPLE_SIZES = {paFloat32: 4, paInt32: 4, paInt24: 3, paInt16: 2, paInt8: 1, paUInt8: 1}
+
+DEVICES = [{'index': 0, 'name': 'AudioMoth USB Microphone: Audio (hw:2,0)', 'maxInputChannels': 1, 'maxOutputChannels': 0, 'defaultSampleRate': 48000.0}]
+
+paInputOverflowed = -9981
+
+# Samples not read for this duration (seconds) are lost
+OVERFLOW_DURATION = 0.5
+
+# Duration of the synthetic sound played in a loop (seconds)
+SYNTHETIC_DURATION = 10
+
+def synthetic_samples(rate):
+
+    # Background noise and 30 ms chirps from 4 to 8 kHz every 0.5 s (orthoptera-like)
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0, 300, SYNTHETIC_DURATION * rate)
+
+    t = np.arange(int(0.03 * rate)) / rate
+    chirp = 4000 * np.sin(2 * np.pi * (4000 * t + 4000 / 0.03 / 2 * t ** 2)) * np.hanning(len(t))
+
+    for start in range(0, len(samples) - len(chirp), rate // 2):
+        samples[start:start + len(chirp)] += chirp
+
+    return samples
+
+def wav_samples(file_path, rate):
+
+    with wave.open(file_path, 'rb') as wavefile:
+        sample_width = wavefile.getsampwidth()
+        channels = wavefile.getnchannels()
+        wav_rate = wavefile.getframerate()
+        frames = wavefile.readframes(wavefile.getnframes())
+
+    if sample_width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float64) - 128) * 256
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float64)
+    elif sample_width == 4:
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float64) / 65536
+    else:
+        raise ValueError(f'{sample_width * 8} bits WAV file not supported')
+
+    samples = samples[::channels]
+
+    # Linear interpolation => sample rate of the stream
+    if wav_rate != rate:
+        samples = np.interp(np.arange(0, len(samples) * rate / wav_rate) * wav_rate / rate, np.arange(len(samples)), samples)
+
+    return samples
+
+class Stream():
+
+    def __init__(self, rate, channels, format, frames_per_buffer):
+
+        self.rate = rate
+        self.channels = channels
+        self.format = format
+        self.frames_per_buffer = frames_per_buffer
+
+        samples = None
+
+        if WAV_FILE:
+            try:
+                samples = wav_samples(WAV_FILE, rate)
+                logger.info(f'microphone => {WAV_FILE} at {rate} Hz')
+            except (OSError, EOFError, ValueError, wave.Error) as e:
+                logger.error(f'{WAV_FILE} not read => synthetic sound')
+                logger.error(str(e))
+
+        if samples is None or not len(samples):
+            samples = synthetic_samples(rate)
+
+        self.samples = np.clip(samples, -32768, 32767).astype('<i2')
+
+        self.position = 0
+        self.num_frames = 0
+        self.start_time = perf_counter()
+        self.active = True
+
+    def read(self, num_frames, exception_on_overflow=True):
+
+        # Stream not read fast enough => samples lost, as when the buffer of the driver overflows
+        overflow = self.get_read_available() > OVERFLOW_DURATION * self.rate
+        if overflow:
+            self.num_frames = int((perf_counter() - self.start_time) * self.rate)
+            if exception_on_overflow:
+                raise OSError(paInputOverflowed, 'Input overflowed')
+
+        # Samples available when the last one has been recorded
+        self.num_frames += num_frames
+        delay = self.start_time + self.num_frames / self.rate - perf_counter()
+        if delay > 0:
+            sleep(delay)
+
+        indexes = (self.position + np.arange(num_frames)) % len(self.samples)
+        self.position = (self.position + num_frames) % len(self.samples)
+
+        return np.repeat(self.samples[indexes], self.channels).tobytes()
+
+    def get_read_available(self):
+
+        return max(0, int((perf_counter() - self.start_time) * self.rate) - self.num_frames)
+
+    def is_active(self):
+
+        return self.active
+
+    def start_stream(self):
+
+        # Samples not read while stopped are lost
+        self.active = True
+        self.num_frames = 0
+        self.start_time = perf_counter()
+
+    def stop_stream(self):
+
+        self.active = False
+
+    def close(self):
+
+        self.active = False
+
+class PyAudio():
+
+    def get_device_count(self):
+
+        return len(DEVICES)
+
+    def get_device_info_by_index(self, device_index):
+
+        return dict(DEVICES[device_index])
+
+    def get_default_input_device_info(self):
+
+        return dict(DEVICES[0])
+
+    def get_sample_size(self, format):
+
+        return SAMPLE_SIZES[format]
+
+    def open(self, rate, channels, format, input=False, output=False, input_device_index=None, frames_per_buffer=1024, **kwargs):
+
+        if format != paInt16:
+            raise ValueError('only paInt16 is supported by the simulated microphone')
+
+        return Stream(rate, channels, format, frames_per_buffer)
+
+    def terminate(self):
+
+        pass
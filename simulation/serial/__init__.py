@@ -0,0 +1,128 @@
+from time import time, sleep
+from math import ceil
+from collections import deque
+
+from gnss_playback import GnssPlayback
+
+# Simulated pyserial => port of the simulated u-blox GNSS receiver (see gnss_playback.py)
+#
+# One epoch per second, on the second as the receiver, each message received after its
+# transmission time at the baud rate => in_waiting grows while the epoch is sent
+
+RX_BUFFER_SIZE = 4096
+
+class SerialException(IOError):
+
+    pass
+
+class Serial():
+
+    def __init__(self, port=None, baudrate=9600, timeout=None, **kwargs):
+
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+
+        self.is_open = False
+
+        self.playback = GnssPlayback()
+
+        self.rx_buffer = bytearray()
+        self.scheduled = deque()
+        self.next_epoch = 0
+
+        if self.port:
+            self.open()
+
+    def open(self):
+
+        if self.port is None:
+            raise SerialException('Port must be configured before it can be used.')
+
+        self.is_open = True
+
+        self.rx_buffer = bytearray()
+        self.scheduled = deque()
+
+        self.start_time = ceil(time())
+        self.next_epoch = 0
+
+    def close(self):
+
+        self.is_open = False
+
+    def receive(self):
+
+        if not self.is_open:
+            raise SerialException('Attempting to use a port that is not open')
+
+        now = time()
+
+        # Port not read for a long time => only the last epochs are received
+        self.next_epoch = max(self.next_epoch, int(now - self.start_time) - 1)
+
+        # Epochs started since the last call => messages scheduled at the baud rate (10 bits per byte)
+        while self.start_time + self.next_epoch <= now:
+
+            epoch_time = self.start_time + self.next_epoch
+            transmission_time = epoch_time
+
+            for message in self.playback.epoch(self.next_epoch, epoch_time):
+                transmission_time += 10 * len(message) / self.baudrate
+                self.scheduled.append((transmission_time, message))
+
+            self.next_epoch += 1
+
+        while self.scheduled and self.scheduled[0][0] <= now:
+            self.rx_buffer += self.scheduled.popleft()[1]
+
+        # Port not read => oldest bytes lost, as with the buffer of the driver
+        if len(self.rx_buffer) > RX_BUFFER_SIZE:
+            del self.rx_buffer[:-RX_BUFFER_SIZE]
+
+    @property
+    def in_waiting(self):
+
+        self.receive()
+
+        return len(self.rx_buffer)
+
+    def read(self, size=1):
+
+        self.receive()
+
+        # Blocking read until the timeout (no timeout => until size bytes received)
+        start_time = time()
+        while len(self.rx_buffer) < size and (self.timeout is None or time() - start_time < self.timeout):
+            sleep(0.01)
+            self.receive()
+
+        data = bytes(self.rx_buffer[:size])
+        del self.rx_buffer[:size]
+
+        return data
+
+    def readline(self):
+
+        self.receive()
+
+        start_time = time()
+        while b'\n' not in self.rx_buffer and (self.timeout is None or time() - start_time < self.timeout):
+            sleep(0.01)
+            self.receive()
+
+        end = self.rx_buffer.find(b'\n') + 1 or len(self.rx_buffer)
+
+        data = bytes(self.rx_buffer[:end])
+        del self.rx_buffer[:end]
+
+        return data
+
+    def write(self, data):
+
+        # Commands to the receiver ignored
+        return len(data)
+
+    def reset_input_buffer(self):
+
+        self.rx_buffer = bytearray()
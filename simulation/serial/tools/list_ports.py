@@ -0,0 +1,7 @@
+# Simulated pyserial port list => the simulated u-blox 7 GNSS receiver only
+
+GNSS_PORT = ('/dev/ttyACM0', 'u-blox 7 - GPS/GNSS Receiver', 'USB VID:PID=1546:01A7 LOCATION=1-1.3:1.0')
+
+def comports(include_links=False):
+
+    return [GNSS_PORT]
@@ -0,0 +1,92 @@
+import os
+import fcntl
+from json import dumps, loads
+from contextlib import contextmanager
+
+import logging
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
+
+# Settings and shared state of the simulated hardware (ENTOMOSCOPE_HARDWARE=simulated, see hardware.py)
+#
+# ENTOMOSCOPE_SIMULATION_STATE => folder of the state shared by the processes (default /tmp/entomoscope_simulation)
+# ENTOMOSCOPE_SIMULATION_CAMERA => sensor of the simulated camera, imx708 (default, v3), imx219, ov5647 or imx477
+# ENTOMOSCOPE_SIMULATION_FRAMES => folder of JPEG/PNG images replayed by the camera (synthetic frames otherwise)
+# ENTOMOSCOPE_SIMULATION_GNSS => NMEA (.nmea/.txt) or u-blox (.ubx) log played back by the GNSS (built-in fix otherwise)
+# ENTOMOSCOPE_SIMULATION_WAV => WAV file played back by the microphone (synthetic noise and chirps otherwise)
+#
+# Pins, PWM, WittyPi registers and AudioMoth configuration are kept in JSON files of the state folder
+# => a pin written by shutdown.py or server.py is seen by the capture scripts, as with pigpiod
+
+STATE_FOLDER = os.environ.get('ENTOMOSCOPE_SIMULATION_STATE', '/tmp/entomoscope_simulation')
+
+CAMERA_MODEL = os.environ.get('ENTOMOSCOPE_SIMULATION_CAMERA', 'imx708')
+FRAMES_FOLDER = os.environ.get('ENTOMOSCOPE_SIMULATION_FRAMES')
+GNSS_FILE = os.environ.get('ENTOMOSCOPE_SIMULATION_GNSS')
+WAV_FILE = os.environ.get('ENTOMOSCOPE_SIMULATION_WAV')
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_simulated_hardware')
+logger.setLevel(logging.INFO)
+h = logging.FileHandler(os.path.join(today_log_path, TODAY + '_' + this_script + '.log'))
+f = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+h.setFormatter(f)
+logger.addHandler(h)
+
+class SharedState():
+
+    # One JSON file per simulated device, read by any process, updated under a file lock
+    # Written then renamed => never read partially written
+
+    def __init__(self, name, default):
+
+        self.file_path = os.path.join(STATE_FOLDER, name + '.json')
+        self.default = default
+
+        os.makedirs(STATE_FOLDER, exist_ok=True)
+
+    def read(self):
+
+        try:
+            with open(self.file_path, 'r') as f:
+                return loads(f.read())
+        except (OSError, ValueError):
+            return loads(dumps(self.default))
+
+    def mtime(self):
+
+        try:
+            return os.stat(self.file_path).st_mtime_ns
+        except OSError:
+            return 0
+
+    @contextmanager
+    def update(self):
+
+        with open(self.file_path + '.lock', 'w') as lock:
+
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            state = self.read()
+
+            yield state
+
+            tmp_file_path = f'{self.file_path}.{os.getpid()}.tmp'
+            with open(tmp_file_path, 'w') as f:
+                f.write(dumps(state, indent=4, sort_keys=True))
+            os.replace(tmp_file_path, self.file_path)
+
+# Levels, modes and PWM of the GPIO pins (keys: pin numbers as strings)
+PINS = SharedState('pins', {'dutycycles': {}, 'levels': {}, 'modes': {}, 'ranges': {}})
+
+def pwm_load():
+
+    # Sum of the PWM duty cycles (0 to 1 per pin) => LEDs lit, for the simulated current
+    pins = PINS.read()
+
+    return sum(dutycycle / pins['ranges'].get(pin, 255) for pin, dutycycle in pins['dutycycles'].items())
@@ -0,0 +1,33 @@
+from i2c_devices import I2CBus
+
+# Simulated smbus => WittyPi and SHT31 of the simulated I2C bus (see i2c_devices.py)
+
+class SMBus():
+
+    def __init__(self, bus=None):
+
+        self.i2c_bus = I2CBus(bus)
+
+    def read_byte(self, address):
+
+        return self.i2c_bus.call(address, 'read_byte')
+
+    def read_byte_data(self, address, register):
+
+        return self.i2c_bus.call(address, 'read_byte_data', register)
+
+    def write_byte_data(self, address, register, value):
+
+        self.i2c_bus.call(address, 'write_byte_data', register, value)
+
+    def read_i2c_block_data(self, address, register, length=32):
+
+        return self.i2c_bus.call(address, 'read_i2c_block_data', register, length)
+
+    def write_i2c_block_data(self, address, register, data):
+
+        self.i2c_bus.call(address, 'write_i2c_block_data', register, data)
+
+    def close(self):
+
+        pass
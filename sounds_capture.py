@@ -3,6 +3,7 @@ from time import time, sleep
 from datetime import datetime
 import logging
 
+import hardware
 import pigpio
 
 pi = pigpio.pi()
@@ -1,10 +1,11 @@
 import os
-from time import time, sleep
+from time import time, sleep, perf_counter
 from datetime import datetime
 
 import logging
 from logging.handlers import RotatingFileHandler
 
+import hardware
 import pigpio
 
 pi = pigpio.pi()
@@ -13,18 +14,24 @@ from configuration2 import Configuration2
 
 from peripherals.microphone2 import Microphone2
 from peripherals.pinout import SOUNDS_CAPTURE_ACTIVITY_PIN, SHUTDOWN_PIN
+from peripherals.signals import Signals
+
+from capture_metrics import CaptureMetrics
 
 from globals_parameters import SOUNDS_CAPTURE_FOLDER, LOGS_DESKTOP_FOLDER, TODAY
 
 this_script = os.path.basename(__file__)[:-3]
 
+# Niveaux des broches mis à jour sur front (callbacks pigpio) => pas de requête pigpiod dans la boucle d'enregistrement
+signals = Signals(pi, SHUTDOWN_PIN, SOUNDS_CAPTURE_ACTIVITY_PIN)
+
 def isSignalToShutdownReceived():
 
-    return pi.read(SHUTDOWN_PIN)
+    return signals.shutdown()
 
 def isSignalToStandByReceived():
 
-    return pi.read(SOUNDS_CAPTURE_ACTIVITY_PIN)
+    return signals.standby()
 
 def main():
 
@@ -48,15 +55,11 @@ def main():
 
         logger.info('in standby mode. Wait for resume signal to start capturing sounds')
 
-        while isSignalToStandByReceived():
-
-            if isSignalToShutdownReceived():
-
-                logger.info('shutdown signal received')
-                logger.info('stopped')
-                exit()
+        if not signals.wait_for_resume():
 
-            sleep(0.5)
+            logger.info('shutdown signal received')
+            logger.info('stopped')
+            exit()
 
         logger.info('resume signal received')
 
@@ -112,6 +115,12 @@ def main():
             configuration.copy_to(file_path)
             logger.info(f'configuration file saved to {file_path}')
 
+            # Durée des enregistrements et des écritures => fichier CSV de la nuit, trace par heure si activée
+            metrics = CaptureMetrics(configuration, 'sounds_capture', SOUNDS_CAPTURE_FOLDER, trace=configuration.sounds_capture['trace'])
+            metrics.start()
+            if configuration.sounds_capture['trace']:
+                logger.info(f'capture stages traced to {SOUNDS_CAPTURE_FOLDER}')
+
             logger.info('start capturing sounds')
 
             while True:
@@ -144,6 +153,8 @@ def main():
 
                         logger.info('start recording')
 
+                        s = perf_counter()
+
                         while total_samples > 0:
 
                             samples = min(total_samples, microphone.CHUNK_SIZE)
@@ -162,18 +173,22 @@ def main():
 
                         logger.info('stop recording')
 
+                        if metrics:
+                            metrics.record('record', perf_counter() - s)
+                            s = perf_counter()
+
                         microphone.save_recording(file_path, data)
                         logger.info(f'recording saved to {file_path}')
 
+                        if metrics:
+                            metrics.record('wav_write', perf_counter() - s)
+
                     if isSignalToStandByReceived() or standby_signal_received:
 
                         logger.info('in standby mode. Wait for signal to resume')
 
-                        while isSignalToStandByReceived():
-                            if isSignalToShutdownReceived():
-                                shutdown_signal_received = True
-                                break
-                            sleep(0.5)
+                        if not signals.wait_for_resume():
+                            shutdown_signal_received = True
 
                         if not isSignalToStandByReceived():
 
@@ -200,12 +215,18 @@ def main():
                         logger.info('shutdown signal received')
                         break
 
+                    # Off => attente de la prochaine période On ou d'un front sur les broches standby/shutdown
+                    if off:
+                        signals.wait(max(0.01, previous_off_time + off_duration - time()))
+
                 except BaseException as e:
 
                     logger.error(str(e))
 
                     break
 
+            metrics.stop()
+
         else:
 
             logger.error('audio stream not opened')
@@ -216,6 +237,8 @@ def main():
 
         logger.error('microphone not found')
 
+    signals.cancel()
+
     logger.info('stopped')
 
 if __name__=='__main__':
@@ -3,6 +3,7 @@ import os
 from datetime import datetime
 import logging
 
+import hardware
 import pigpio
 
 from peripherals.pinout import IMAGES_CAPTURE_ACTIVITY_PIN, SOUNDS_CAPTURE_ACTIVITY_PIN, SHUTDOWN_PIN
@@ -6,6 +6,7 @@ import logging
 
 from subprocess import check_output
 
+import hardware
 import pigpio
 
 from peripherals.pinout2 import IMAGES_CAPTURE_ACTIVITY_PIN, SOUNDS_CAPTURE_ACTIVITY_PIN, SHUTDOWN_PIN
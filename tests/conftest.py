@@ -0,0 +1,45 @@
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+# globals_parameters creates the Desktop/Logs and Desktop/Data folders of the user at import
+# => home folder of the tests in a temporary folder, set before any module of the repository is imported
+TESTS_HOME = tempfile.mkdtemp(prefix='entomoscope_tests_')
+os.environ['HOME'] = TESTS_HOME
+os.mkdir(os.path.join(TESTS_HOME, 'Desktop'))
+
+# Modules importing pigpio use the simulation folder (hardware.py), the pins are faked by the tests
+os.environ['ENTOMOSCOPE_HARDWARE'] = 'simulated'
+
+# Scripts imported from the repository root, as when they are run on the Entomoscope
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import globals_parameters
+
+from configuration2 import Configuration2
+
+def pytest_unconfigure(config):
+
+    shutil.rmtree(TESTS_HOME, ignore_errors=True)
+
+@pytest.fixture(autouse=True)
+def logs_folder(tmp_path, monkeypatch):
+
+    # Log files opened during a test (e.g. by a module imported late) also go to tmp_path
+    logs_folder = tmp_path / 'Logs'
+    (logs_folder / globals_parameters.TODAY).mkdir(parents=True)
+    monkeypatch.setattr(globals_parameters, 'LOGS_DESKTOP_FOLDER', str(logs_folder))
+
+    return logs_folder
+
+@pytest.fixture
+def configuration():
+
+    # Default values of configuration2.py, no configuration file read or written
+    configuration = Configuration2.__new__(Configuration2)
+    configuration.set_default_values()
+
+    return configuration
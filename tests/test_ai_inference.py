@@ -0,0 +1,127 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from ai_inference import Detections, make_tiles, nms, box_ios, predict_tiled, get_detection_args
+
+class FakeTensor():
+
+    def __init__(self, array):
+
+        self.array = np.asarray(array, dtype=np.float32)
+
+    def cpu(self):
+
+        return self
+
+    def numpy(self):
+
+        return self.array
+
+class BoxModel():
+
+    # Predicts the parts of one frame box seen by each tile (tile normalized coordinates)
+
+    def __init__(self, frame_box, frame_size):
+
+        self.frame_box = frame_box
+        self.frame_size = frame_size
+        self.tiles = []
+
+    def predict(self, crops, **kwargs):
+
+        predictions = []
+
+        for crop in crops:
+
+            left, top, right, bottom = self.tiles.pop(0)
+            box_left, box_top, box_right, box_bottom = self.frame_box
+
+            # Part of the box inside the tile
+            l, t, r, b = max(left, box_left), max(top, box_top), min(right, box_right), min(bottom, box_bottom)
+
+            if r > l and b > t:
+                width, height = right - left, bottom - top
+                xywhn = [[((l + r) / 2 - left) / width, ((t + b) / 2 - top) / height, (r - l) / width, (b - t) / height]]
+                conf, cls = [0.9], [0]
+            else:
+                xywhn, conf, cls = np.zeros((0, 4)), [], []
+
+            boxes = SimpleNamespace(xywhn=FakeTensor(xywhn), conf=FakeTensor(conf), cls=FakeTensor(cls))
+            predictions.append(SimpleNamespace(boxes=boxes, speed={'preprocess': 1.0, 'inference': 2.0, 'postprocess': 1.0}))
+
+        return predictions
+
+def test_tiles_cover_the_frame():
+
+    tiles = make_tiles(1000, 700, 400, 0.2)
+
+    covered = np.zeros((700, 1000), dtype=bool)
+    for left, top, right, bottom in tiles:
+        assert right - left == 400 and bottom - top == 400
+        covered[top:bottom, left:right] = True
+
+    assert covered.all()
+
+def test_single_tile_for_a_small_frame():
+
+    assert make_tiles(300, 200, 640, 0.2) == [(0, 0, 300, 200)]
+
+def test_nms_keeps_best_box_per_class():
+
+    data = np.array([[0.5, 0.5, 0.2, 0.2, 0.6, 0],
+                     [0.51, 0.5, 0.2, 0.2, 0.9, 0],
+                     [0.5, 0.5, 0.2, 0.2, 0.8, 1],
+                     [0.1, 0.1, 0.05, 0.05, 0.7, 0]], dtype=np.float32)
+
+    kept = nms(data, 0.5)
+
+    assert np.allclose(sorted(kept[:, 4].tolist()), [0.7, 0.8, 0.9])
+
+def test_nms_ios_merges_box_cut_by_a_tile_border():
+
+    # Whole box and its right quarter => same insect with the intersection over the smaller box
+    data = np.array([[0.5, 0.5, 0.2, 0.2, 0.9, 0],
+                     [0.575, 0.5, 0.05, 0.2, 0.8, 0]], dtype=np.float32)
+
+    assert len(nms(data, 0.5)) == 2
+    assert len(nms(data, 0.5, overlap=box_ios)) == 1
+
+def test_predict_tiled_merges_across_tiles():
+
+    width, height = 1000, 700
+    tiled_args = {'tile_size': 400, 'overlap': 0.2, 'batch_size': 0, 'merge_threshold': 0.5}
+
+    # Box inside the overlap of several tiles
+    frame_box = (300, 280, 360, 340)
+    model = BoxModel(frame_box, (width, height))
+    model.tiles = make_tiles(width, height, tiled_args['tile_size'], tiled_args['overlap'])
+
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+
+    detections = predict_tiled(model, frame, tiled_args, {}, timestamp=12.0)
+
+    assert isinstance(detections, Detections)
+    assert len(detections) == 1
+    assert detections.timestamp == 12.0
+    assert np.allclose(detections.xywhn[0], [330 / width, 310 / height, 60 / width, 60 / height], atol=1e-3)
+
+def test_batch_size_kept_with_pytorch(configuration):
+
+    configuration.ai_detection['backend'] = 'pytorch'
+
+    detection_args = get_detection_args(configuration)
+
+    assert detection_args['tiled']['batch_size'] == configuration.ai_detection['tiled']['batch_size']
+    assert detection_args['cascade']['batch_size'] == configuration.ai_detection['cascade']['batch_size']
+
+def test_batch_size_one_with_exported_model(configuration):
+
+    # Exported models have a static batch of 1
+    configuration.ai_detection['backend'] = 'onnx'
+
+    detection_args = get_detection_args(configuration)
+
+    assert detection_args['tiled']['batch_size'] == 1
+    assert detection_args['cascade']['batch_size'] == 1
+    assert configuration.ai_detection['tiled']['batch_size'] == 0
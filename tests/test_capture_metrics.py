@@ -0,0 +1,94 @@
+import csv
+
+import pytest
+
+from capture_metrics import CaptureMetrics, Stage, percentile, CSV_HEADER
+
+def capture_metrics(configuration, folder, enable=True, prometheus_folder=None):
+
+    configuration.metrics['enable'] = enable
+    configuration.metrics['prometheus_folder'] = str(prometheus_folder) if prometheus_folder else ''
+
+    return CaptureMetrics(configuration, 'images_capture', str(folder))
+
+def test_percentile_nearest_rank():
+
+    values = list(range(1, 101))
+
+    assert percentile(values, 0.5) == 51
+    assert percentile(values, 0.99) == 100
+    assert percentile([3], 0.9) == 3
+
+def test_stage_report_resets_the_interval():
+
+    stage = Stage(window=2)
+
+    for duration in (1.0, 2.0, 3.0):
+        stage.add(duration)
+
+    report = stage.report()
+
+    assert report['count'] == 3
+    assert report['total'] == 6.0
+    # Last window durations only
+    assert report['mean'] == 2.5
+    assert report['max'] == 3.0
+
+    stage.add(4.0)
+    report = stage.report()
+
+    assert report['count'] == 1
+    assert report['num_total'] == 4
+    assert report['sum_total'] == 10.0
+
+def test_disabled_metrics_are_false(configuration, tmp_path):
+
+    metrics = capture_metrics(configuration, tmp_path, enable=False)
+
+    assert not metrics
+    metrics.record('inference', 0.1)
+    assert metrics.stages == {}
+
+def test_csv_report(configuration, tmp_path):
+
+    metrics = capture_metrics(configuration, tmp_path)
+
+    with metrics.span('inference'):
+        pass
+    metrics.record('jpeg_encode', 0.010)
+    metrics.record('jpeg_encode', 0.030)
+
+    metrics.report()
+    # Nothing recorded since the last report => no row
+    metrics.report()
+
+    with open(metrics.csv_file_path, newline='') as csv_file:
+        rows = list(csv.reader(csv_file, delimiter=';'))
+
+    assert rows[0] == CSV_HEADER
+    assert [row[2] for row in rows[1:]] == ['inference', 'jpeg_encode']
+    assert rows[2][3] == '2'
+    assert rows[2][5] == '20.00'
+
+def test_prometheus_textfile(configuration, tmp_path):
+
+    prometheus_folder = tmp_path / 'prometheus'
+    prometheus_folder.mkdir()
+
+    metrics = capture_metrics(configuration, tmp_path, prometheus_folder=prometheus_folder)
+
+    metrics.record('inference', 0.5)
+    metrics.report()
+
+    lines = (prometheus_folder / 'entomoscope_images_capture.prom').read_text().splitlines()
+
+    assert 'entomoscope_stage_duration_seconds{script="images_capture",stage="inference",quantile="0.5"} 0.500000' in lines
+    assert 'entomoscope_stage_duration_seconds_count{script="images_capture",stage="inference"} 1' in lines
+    assert not (prometheus_folder / 'entomoscope_images_capture.prom.tmp').exists()
+
+@pytest.mark.parametrize('prometheus_folder', [None, 'missing'])
+def test_prometheus_folder_not_available(configuration, tmp_path, prometheus_folder):
+
+    metrics = capture_metrics(configuration, tmp_path, prometheus_folder=prometheus_folder and tmp_path / prometheus_folder)
+
+    assert metrics.prometheus_file_path is None
@@ -0,0 +1,49 @@
+from capture_scheduler import CaptureScheduler
+
+def capture_scheduler(configuration, enable=True):
+
+    configuration.images_capture['adaptive']['enable'] = enable
+
+    return CaptureScheduler(configuration)
+
+def test_disabled_keeps_time_step(configuration):
+
+    scheduler = capture_scheduler(configuration, enable=False)
+
+    assert scheduler.update(True) == configuration.images_capture['time_step']
+    assert scheduler.update(False) == configuration.images_capture['time_step']
+
+def test_activity_sets_min_time_step(configuration):
+
+    scheduler = capture_scheduler(configuration)
+
+    assert scheduler.update(True) == configuration.images_capture['adaptive']['min_time_step']
+
+def test_no_activity_backs_off_up_to_max_time_step(configuration):
+
+    configuration.images_capture['adaptive'].update({'backoff': 2, 'min_time_step': 1, 'max_time_step': 10})
+    scheduler = capture_scheduler(configuration)
+
+    scheduler.update(True)
+    time_steps = [scheduler.update(False) for i in range(5)]
+
+    assert time_steps == [2, 4, 8, 10, 10]
+
+def test_activity_after_backoff(configuration):
+
+    configuration.images_capture['adaptive'].update({'backoff': 2, 'min_time_step': 1, 'max_time_step': 10})
+    scheduler = capture_scheduler(configuration)
+
+    for i in range(5):
+        scheduler.update(False)
+
+    assert scheduler.update(True) == 1
+
+def test_reset_to_default_time_step(configuration):
+
+    scheduler = capture_scheduler(configuration)
+
+    scheduler.update(True)
+    scheduler.reset()
+
+    assert scheduler.time_step == configuration.images_capture['time_step']
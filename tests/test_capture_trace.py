@@ -0,0 +1,71 @@
+import json
+from datetime import datetime
+
+from capture_metrics import CaptureTrace
+
+def read_events(file_path):
+
+    # Closing ] optional => added when the file was cut
+    text = file_path.read_text().rstrip()
+    if not text.endswith(']'):
+        text += ']'
+
+    return json.loads(text)
+
+def test_spans_written_as_complete_events(tmp_path):
+
+    trace = CaptureTrace('images_capture', str(tmp_path))
+    trace.start()
+
+    start = datetime(2026, 6, 1, 22, 15).timestamp()
+    trace.add('inference', start, 0.25)
+    trace.add('jpeg_encode', start + 1, 0.01)
+    trace.stop()
+
+    events = read_events(tmp_path / '20260601_22_images_capture_trace.json')
+    spans = [event for event in events if event['ph'] == 'X']
+
+    assert [span['name'] for span in spans] == ['inference', 'jpeg_encode']
+    assert spans[0]['ts'] == round(1E6 * start)
+    assert spans[0]['dur'] == 250000
+    assert trace.num_events == 2
+
+    # Process and thread names for the trace viewers
+    assert [event['name'] for event in events if event['ph'] == 'M'] == ['process_name', 'thread_name']
+
+def test_one_file_per_hour(tmp_path):
+
+    trace = CaptureTrace('images_capture', str(tmp_path))
+    trace.start()
+
+    trace.add('inference', datetime(2026, 6, 1, 22, 59).timestamp(), 0.1)
+    trace.add('inference', datetime(2026, 6, 1, 23, 1).timestamp(), 0.1)
+    trace.stop()
+
+    assert sorted(path.name for path in tmp_path.glob('*_trace*.json')) == ['20260601_22_images_capture_trace.json', '20260601_23_images_capture_trace.json']
+
+def test_restart_within_the_hour(tmp_path):
+
+    start = datetime(2026, 6, 1, 22, 15).timestamp()
+
+    for i in range(2):
+        trace = CaptureTrace('images_capture', str(tmp_path))
+        trace.start()
+        trace.add('inference', start + i, 0.1)
+        trace.stop()
+
+    assert sorted(path.name for path in tmp_path.glob('*_trace*.json')) == ['20260601_22_images_capture_trace.json', '20260601_22_images_capture_trace_1.json']
+
+def test_file_cut_before_the_end_is_readable(tmp_path):
+
+    trace = CaptureTrace('images_capture', str(tmp_path))
+
+    trace.write('inference', datetime(2026, 6, 1, 22, 15).timestamp(), 0.1, 1, 'main')
+    trace.file.flush()
+
+    # No closing ] => power failure
+    events = read_events(tmp_path / '20260601_22_images_capture_trace.json')
+
+    assert events[-1]['name'] == 'inference'
+
+    trace.close()
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from data_migration import Migration, Journal, conflict_free_path
+
+@pytest.fixture
+def folders(tmp_path):
+
+    source = tmp_path / 'sd'
+    destination = tmp_path / 'external'
+    (source / 'night').mkdir(parents=True)
+    (destination / 'night').mkdir(parents=True)
+
+    return source, destination
+
+@pytest.fixture
+def migration(configuration, folders, tmp_path):
+
+    configuration.files['migration']['min_age'] = 0
+
+    migration = Migration(configuration, str(folders[0]), str(folders[1]))
+    migration.journal = Journal(str(tmp_path / 'journal.jsonl'))
+
+    return migration
+
+def write(file_path, data):
+
+    file_path.write_bytes(data)
+    os.utime(file_path, (0, 0))
+
+def test_file_moved(migration, folders):
+
+    source, destination = folders
+    write(source / 'night' / 'a.jpg', b'image')
+
+    migration.run()
+
+    assert not (source / 'night' / 'a.jpg').exists()
+    assert (destination / 'night' / 'a.jpg').read_bytes() == b'image'
+
+def test_newer_destination_kept(migration, folders):
+
+    source, destination = folders
+    write(source / 'night' / 'environment.csv', b'sd card')
+    (destination / 'night' / 'environment.csv').write_bytes(b'external disk')
+
+    migration.run()
+
+    assert not (source / 'night' / 'environment.csv').exists()
+    assert (destination / 'night' / 'environment.csv').read_bytes() == b'external disk'
+    assert (destination / 'night' / 'environment_sd.csv').read_bytes() == b'sd card'
+
+def test_identical_destination_only_deletes_source(migration, folders):
+
+    source, destination = folders
+    write(source / 'night' / 'a.jpg', b'image')
+    (destination / 'night' / 'a.jpg').write_bytes(b'image')
+
+    migration.run()
+
+    assert not (source / 'night' / 'a.jpg').exists()
+    assert sorted(os.listdir(destination / 'night')) == ['a.jpg']
+
+def test_conflict_names(tmp_path):
+
+    (tmp_path / 'detections.sqlite').write_bytes(b'')
+    (tmp_path / 'detections_sd.sqlite').write_bytes(b'')
+
+    assert conflict_free_path(str(tmp_path / 'detections.sqlite')) == str(tmp_path / 'detections_sd1.sqlite')
+
+def test_interrupted_copy_resumed(migration, folders):
+
+    source, destination = folders
+    write(source / 'night' / 'a.jpg', b'image')
+
+    # Power cut during the copy => journal at copying, .part file incomplete
+    migration.journal.open()
+    migration.journal.append('copying', str(source / 'night' / 'a.jpg'), str(destination / 'night' / 'a.jpg'))
+    migration.journal.close()
+    (destination / 'night' / 'a.jpg.part').write_bytes(b'ima')
+
+    migration.run()
+
+    assert (destination / 'night' / 'a.jpg').read_bytes() == b'image'
+    assert not (destination / 'night' / 'a.jpg.part').exists()
+    assert not (source / 'night' / 'a.jpg').exists()
+
+def test_resume_error_does_not_abort_run(migration, folders, monkeypatch):
+
+    source, destination = folders
+    write(source / 'night' / 'a.jpg', b'a')
+    write(source / 'night' / 'b.jpg', b'b')
+
+    migration.journal.open()
+    migration.journal.append('copying', str(source / 'night' / 'a.jpg'), str(destination / 'night' / 'a.jpg'))
+    migration.journal.close()
+
+    move = Migration.move
+
+    def failing_move(self, file_path, digest=None):
+        if file_path.endswith('a.jpg'):
+            raise OSError('disk error')
+        return move(self, file_path, digest)
+
+    monkeypatch.setattr(Migration, 'move', failing_move)
+    # tmp_path is not a mount point
+    monkeypatch.setattr(Migration, 'destination_available', lambda self: True)
+
+    migration.run()
+
+    assert (destination / 'night' / 'b.jpg').read_bytes() == b'b'
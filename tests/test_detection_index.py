@@ -0,0 +1,112 @@
+import sqlite3
+
+import numpy as np
+
+from ai_inference import Detections
+from detection_index import DetectionRecords, open_index, make_record, write_records, read_captures
+
+def detections(*boxes):
+
+    # x, y, w, h, conf, cls
+    return Detections(np.array(boxes, dtype=np.float32).reshape(-1, 6))
+
+def record(timestamp, name, *boxes, source='capture'):
+
+    box_files = {i: f'{name}_box_{i}.jpg' for i in range(1, len(boxes) + 1)}
+
+    return make_record(timestamp, '/night/' + name, [name + '_boxes_conf.txt'], detections(*boxes), box_files,
+                        {'ExposureTime': 2000, 'Lux': 3.5}, {'temperature': '12.5'}, source)
+
+def write(index_file_path, records):
+
+    connection = open_index(index_file_path)
+    write_records(connection, records)
+    connection.close()
+
+def test_records_read_back(tmp_path):
+
+    index_file_path = str(tmp_path / 'detections.sqlite')
+
+    write(index_file_path, [record(1, 'a', [0.5, 0.5, 0.1, 0.1, 0.9, 0], [0.2, 0.2, 0.1, 0.1, 0.8, 1]),
+                            record(2, 'b', [0.5, 0.5, 0.1, 0.1, 0.7, 0])])
+
+    captures = read_captures(index_file_path)
+
+    assert [capture['file_path'] for capture in captures] == ['a', 'b']
+    assert captures[0]['num_boxes'] == 2
+    assert captures[0]['files'] == ['a_boxes_conf.txt']
+    assert captures[0]['environment'] == {'temperature': '12.5'}
+    assert captures[0]['exposure_time'] == 2000
+    assert [box['file_name'] for box in captures[0]['boxes']] == ['a_box_1.jpg', 'a_box_2.jpg']
+    assert captures[0]['boxes'][1]['cls'] == 1
+
+def test_read_between_timestamps(tmp_path):
+
+    index_file_path = str(tmp_path / 'detections.sqlite')
+
+    write(index_file_path, [record(t, str(t), [0.5, 0.5, 0.1, 0.1, 0.9, 0]) for t in range(10)])
+
+    captures = read_captures(index_file_path, 3, 5)
+
+    assert [capture['timestamp'] for capture in captures] == [3, 4, 5]
+    assert all(len(capture['boxes']) == 1 for capture in captures)
+
+def test_detected_again_keeps_history(tmp_path):
+
+    index_file_path = str(tmp_path / 'detections.sqlite')
+
+    write(index_file_path, [record(1, 'a', [0.5, 0.5, 0.1, 0.1, 0.9, 0])])
+    write(index_file_path, [record(1, 'a', [0.5, 0.5, 0.1, 0.1, 0.6, 0], [0.2, 0.2, 0.1, 0.1, 0.8, 1], source='redetection')])
+
+    captures = read_captures(index_file_path)
+
+    assert len(captures) == 1
+    assert captures[0]['source'] == 'redetection'
+    assert len(captures[0]['boxes']) == 2
+
+    connection = sqlite3.connect(index_file_path)
+    assert connection.execute('SELECT COUNT(*) FROM captures').fetchone()[0] == 2
+    assert connection.execute('SELECT COUNT(*) FROM boxes').fetchone()[0] == 3
+    connection.close()
+
+def test_no_box_any_more(tmp_path):
+
+    index_file_path = str(tmp_path / 'detections.sqlite')
+
+    write(index_file_path, [record(1, 'a', [0.5, 0.5, 0.1, 0.1, 0.9, 0]), record(2, 'b', [0.5, 0.5, 0.1, 0.1, 0.9, 0])])
+    write(index_file_path, [record(1, 'a', source='redetection')])
+
+    assert [capture['file_path'] for capture in read_captures(index_file_path)] == ['b']
+
+def test_source_column_added_to_old_index(tmp_path):
+
+    index_file_path = str(tmp_path / 'detections.sqlite')
+
+    # Index written before the source column
+    connection = sqlite3.connect(index_file_path)
+    connection.execute('CREATE TABLE captures (id INTEGER PRIMARY KEY, timestamp REAL NOT NULL, file_path TEXT NOT NULL, files TEXT NOT NULL, num_boxes INTEGER NOT NULL, '
+                        'exposure_time INTEGER, analogue_gain REAL, lux REAL, colour_temperature INTEGER, environment TEXT)')
+    connection.execute("INSERT INTO captures (timestamp, file_path, files, num_boxes) VALUES (1, 'a', '[]', 1)")
+    connection.commit()
+    connection.close()
+
+    write(index_file_path, [record(2, 'b', [0.5, 0.5, 0.1, 0.1, 0.9, 0], source='redetection')])
+
+    captures = read_captures(index_file_path)
+
+    assert [(capture['file_path'], capture['source']) for capture in captures] == [('a', 'capture'), ('b', 'redetection')]
+
+def test_records_collected_for_another_process(configuration, tmp_path):
+
+    # images_replay.py workers => records returned to the main process, no index file written by the workers
+    index = DetectionRecords(configuration, str(tmp_path))
+    index.start()
+    index.add(1, '/night/a', ['a_boxes_conf.txt'], detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), {1: 'a_box_1.jpg'}, {})
+    index.stop()
+
+    assert not (tmp_path / 'detections.sqlite').exists()
+    assert index.num_records == 1
+
+    write(index.index_file_path, index.records)
+
+    assert [capture['file_path'] for capture in read_captures(index.index_file_path)] == ['a']
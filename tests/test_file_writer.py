@@ -0,0 +1,74 @@
+import shutil
+from collections import namedtuple
+
+import pytest
+
+import file_writer
+from file_writer import FileWriter
+
+DiskUsage = namedtuple('DiskUsage', 'total used free')
+
+@pytest.fixture
+def free_mb(monkeypatch):
+
+    # Free space of the disk (MB) seen by the FileWriter
+    free = {'mb': 100000}
+    monkeypatch.setattr(shutil, 'disk_usage', lambda folder: DiskUsage(0, 0, free['mb'] * 1E6))
+
+    return free
+
+@pytest.fixture
+def write_behind(configuration):
+
+    # drop_crops below 2000 MB, low_quality below 1000 MB, paused below 300 MB
+    configuration.files['write_behind'].update({'drop_crops_free_mb': 2000, 'low_quality_free_mb': 1000, 'pause_free_mb': 300, 'check_interval': 0})
+
+    return configuration
+
+@pytest.mark.parametrize('mb, level', [(5000, 'normal'), (1500, 'drop_crops'), (500, 'low_quality'), (100, 'paused')])
+def test_storage_levels(write_behind, free_mb, tmp_path, mb, level):
+
+    free_mb['mb'] = mb
+
+    writer = FileWriter(write_behind, str(tmp_path))
+
+    assert file_writer.STORAGE_LEVELS[writer.level] == level
+    assert writer.drop_crops == (level != 'normal')
+    assert writer.quality == (write_behind.files['write_behind']['low_quality'] if level in ('low_quality', 'paused') else None)
+    assert writer.paused == (level == 'paused')
+
+def test_paused_writes_dropped(write_behind, free_mb, tmp_path):
+
+    write_behind.files['write_behind']['enable'] = False
+    free_mb['mb'] = 100
+
+    writer = FileWriter(write_behind, str(tmp_path))
+    writer.start()
+    writer.write(str(tmp_path / 'a.jpg'), b'data')
+    writer.stop()
+
+    assert not (tmp_path / 'a.jpg').exists()
+    assert writer.num_dropped == 1
+
+@pytest.mark.parametrize('enable', [False, True])
+def test_resumed_when_space_freed(write_behind, free_mb, tmp_path, enable):
+
+    write_behind.files['write_behind']['enable'] = enable
+    free_mb['mb'] = 100
+
+    writer = FileWriter(write_behind, str(tmp_path))
+    writer.start()
+
+    assert writer.paused
+
+    # Without writer thread, write() is not called while paused => checked by paused itself
+    free_mb['mb'] = 5000
+    if enable:
+        writer.check_free_space()
+
+    assert not writer.paused
+
+    writer.write(str(tmp_path / 'a.jpg'), b'data')
+    writer.stop()
+
+    assert (tmp_path / 'a.jpg').read_bytes() == b'data'
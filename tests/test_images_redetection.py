@@ -0,0 +1,81 @@
+import json
+from datetime import datetime
+
+from images_redetection import Checkpoint, remove_results, capture_time
+
+def test_checkpoint_saved_and_loaded(tmp_path):
+
+    checkpoint_file_path = str(tmp_path / 'redetection_checkpoint.json')
+
+    checkpoint = Checkpoint(checkpoint_file_path, 'yolo.pt')
+    checkpoint.save('night_1', '/data/night_1/20260601221500_000000_no_ai_detection.jpg')
+
+    checkpoint = Checkpoint(checkpoint_file_path, 'yolo.pt')
+    checkpoint.load()
+
+    assert checkpoint.last_images == {'night_1': '20260601221500_000000_no_ai_detection.jpg'}
+    assert not (tmp_path / 'redetection_checkpoint.json.tmp').exists()
+
+def test_remaining_images_after_the_last_one(tmp_path):
+
+    checkpoint = Checkpoint(str(tmp_path / 'redetection_checkpoint.json'), 'yolo.pt')
+    images = [f'/data/night_1/2026060122150{i}_000000_no_ai_detection.jpg' for i in range(5)]
+
+    assert checkpoint.remaining('night_1', images) == images
+
+    checkpoint.save('night_1', images[2])
+
+    assert checkpoint.remaining('night_1', images) == images[3:]
+    assert checkpoint.remaining('night_2', images) == images
+
+def test_remaining_with_images_added_since(tmp_path):
+
+    # Images migrated from the SD card after the checkpoint => sorted before the last image processed, not detected
+    checkpoint = Checkpoint(str(tmp_path / 'redetection_checkpoint.json'), 'yolo.pt')
+    checkpoint.save('night_1', '/data/night_1/20260601221502_000000_no_ai_detection.jpg')
+
+    images = [f'/data/night_1/2026060122150{i}_000000_no_ai_detection.jpg' for i in range(5)]
+
+    assert checkpoint.remaining('night_1', images) == images[3:]
+
+def test_checkpoint_of_another_model_ignored(tmp_path):
+
+    checkpoint_file_path = str(tmp_path / 'redetection_checkpoint.json')
+
+    Checkpoint(checkpoint_file_path, 'yolo.pt').save('night_1', 'a_no_ai_detection.jpg')
+
+    checkpoint = Checkpoint(checkpoint_file_path, 'yolo_v2.pt')
+    checkpoint.load()
+
+    assert checkpoint.last_images == {}
+
+def test_checkpoint_with_positions_ignored(tmp_path):
+
+    checkpoint_file_path = tmp_path / 'redetection_checkpoint.json'
+    checkpoint_file_path.write_text(json.dumps({'model': 'yolo.pt', 'positions': {'night_1': 10}}))
+
+    checkpoint = Checkpoint(str(checkpoint_file_path), 'yolo.pt')
+    checkpoint.load()
+
+    assert checkpoint.last_images == {}
+
+def test_previous_results_removed(tmp_path):
+
+    base_path = str(tmp_path / '20260601221500_000000')
+
+    for suffix in ('_no_ai_detection.jpg', '_boxes_conf.txt', '_boxes_conf.jpg', '_box_1.jpg', '_box_2.jpg', '_box_12.jpg'):
+        open(base_path + suffix, 'w').close()
+    open(str(tmp_path / '20260601221505_000000_box_1.jpg'), 'w').close()
+
+    remove_results(base_path)
+
+    assert sorted(path.name for path in tmp_path.glob('2026*')) == ['20260601221500_000000_no_ai_detection.jpg', '20260601221505_000000_box_1.jpg']
+
+def test_remove_results_without_files(tmp_path):
+
+    remove_results(str(tmp_path / '20260601221500_000000'))
+
+def test_capture_time_from_file_name():
+
+    assert capture_time('/data/night_1/20260601221500_250000') == datetime(2026, 6, 1, 22, 15, 0, 250000).timestamp()
+    assert capture_time('/data/night_1/20260601221500') == datetime(2026, 6, 1, 22, 15).timestamp()
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from cv2 import imencode, imdecode, IMREAD_COLOR
+
+from jpeg_metadata import embed_metadata, extract_metadata, read_metadata, MAX_CHUNK_SIZE
+
+@pytest.fixture
+def jpeg_data():
+
+    return imencode('.jpg', np.full((32, 48, 3), 128, dtype=np.uint8))[1].tobytes()
+
+def test_round_trip(jpeg_data):
+
+    metadata = {'ExposureTime': 10000, 'Lux': 12.5, 'EntomoscopeSiteID': 'test'}
+
+    assert extract_metadata(embed_metadata(jpeg_data, metadata)) == metadata
+
+def test_large_metadata_split_over_segments(jpeg_data):
+
+    metadata = {'Comment': 'x' * (2 * MAX_CHUNK_SIZE + 10)}
+
+    data = embed_metadata(jpeg_data, metadata)
+
+    assert data.count(b'Entomoscope\x00') == 3
+    assert extract_metadata(data) == metadata
+
+def test_image_still_decoded(jpeg_data):
+
+    image = imdecode(np.frombuffer(embed_metadata(jpeg_data, {'a': 1}), dtype=np.uint8), IMREAD_COLOR)
+
+    assert image.shape == (32, 48, 3)
+
+def test_no_metadata(jpeg_data):
+
+    assert extract_metadata(jpeg_data) is None
+
+def test_not_a_jpeg():
+
+    with pytest.raises(ValueError):
+        extract_metadata(b'not a jpeg')
+
+def test_read_file(jpeg_data, tmp_path):
+
+    file_path = tmp_path / 'capture.jpg'
+    file_path.write_bytes(embed_metadata(jpeg_data, {'SensorTimestamp': 1}))
+
+    assert read_metadata(str(file_path)) == {'SensorTimestamp': 1}
@@ -0,0 +1,87 @@
+import numpy as np
+
+from motion_gate import MotionGate
+
+def frame(value=0):
+
+    return np.full((48, 64, 3), value, dtype=np.uint8)
+
+def motion_gate(configuration, enable=True):
+
+    configuration.ai_detection['motion_gate']['enable'] = enable
+
+    return MotionGate(configuration)
+
+def test_disabled_by_default(configuration):
+
+    gate = MotionGate(configuration)
+
+    assert not gate.enable
+    assert gate.check(frame(), 0)
+    assert gate.check(frame(), 1)
+    assert gate.motion
+    assert gate.num_skipped == 0
+
+def test_static_frames_skipped(configuration):
+
+    gate = motion_gate(configuration)
+
+    # First frame => background initialized and keyframe
+    assert gate.check(frame(), 1000)
+    assert not gate.check(frame(), 1001)
+    assert not gate.check(frame(), 1002)
+    assert gate.num_run == 1
+    assert gate.num_skipped == 2
+
+def test_changed_pixels_run_detection(configuration):
+
+    gate = motion_gate(configuration)
+
+    gate.check(frame(), 1000)
+    changed = frame()
+    changed[10:30, 10:30] = 255
+
+    assert gate.check(changed, 1001)
+    assert gate.motion
+    assert gate.ratio == (20 * 20) / (48 * 64)
+
+def test_small_change_below_threshold(configuration):
+
+    gate = motion_gate(configuration)
+
+    gate.check(frame(), 1000)
+
+    # Difference below pixel_threshold => no motion
+    assert not gate.check(frame(configuration.ai_detection['motion_gate']['pixel_threshold'] - 1), 1001)
+    assert gate.ratio == 0
+
+def test_keyframe_interval(configuration):
+
+    gate = motion_gate(configuration)
+    keyframe_interval = configuration.ai_detection['motion_gate']['keyframe_interval']
+
+    gate.check(frame(), 1000)
+
+    assert not gate.check(frame(), 1000 + keyframe_interval - 1)
+    assert gate.check(frame(), 1000 + keyframe_interval)
+    assert not gate.motion
+
+def test_capture_time_going_backwards_is_keyframe(configuration):
+
+    gate = motion_gate(configuration)
+
+    gate.check(frame(), 1000)
+
+    # Another night replayed => keyframe even though less than keyframe_interval elapsed
+    assert gate.check(frame(), 10)
+    assert gate.last_keyframe_time == 10
+
+def test_background_follows_slow_changes(configuration):
+
+    gate = motion_gate(configuration)
+    alpha = configuration.ai_detection['motion_gate']['background_alpha']
+
+    gate.check(frame(), 1000)
+    gate.check(frame(10), 1001)
+
+    assert np.allclose(gate.background, 10 * alpha)
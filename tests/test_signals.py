@@ -0,0 +1,144 @@
+from threading import Timer
+
+from peripherals.signals import Signals
+
+SHUTDOWN_PIN = 22
+STANDBY_PIN = 27
+
+class FakeCallback():
+
+    def __init__(self, pi, pin, func):
+
+        self.pi = pi
+        self.pin = pin
+        self.func = func
+
+    def cancel(self):
+
+        self.pi.callbacks.remove(self)
+
+class FakePi():
+
+    # Pin levels written by the tests, edges sent to the callbacks unless notify is False (edge missed by pigpiod)
+
+    def __init__(self, levels=None):
+
+        self.levels = {SHUTDOWN_PIN: 0, STANDBY_PIN: 0}
+        self.levels.update(levels or {})
+        self.callbacks = []
+
+    def read(self, pin):
+
+        return self.levels[pin]
+
+    def set_glitch_filter(self, pin, steady):
+
+        pass
+
+    def callback(self, pin, edge, func):
+
+        callback = FakeCallback(self, pin, func)
+        self.callbacks.append(callback)
+
+        return callback
+
+    def write(self, pin, level, notify=True):
+
+        self.levels[pin] = level
+        if notify:
+            for callback in list(self.callbacks):
+                if callback.pin == pin:
+                    callback.func(pin, level, 0)
+
+def signals(pi):
+
+    signals = Signals(pi, SHUTDOWN_PIN, STANDBY_PIN)
+    signals.poll_interval = 0.05
+
+    return signals
+
+def test_initial_levels():
+
+    s = signals(FakePi({STANDBY_PIN: 1}))
+
+    assert not s.shutdown()
+    assert s.standby()
+
+def test_edges_update_levels():
+
+    pi = FakePi()
+    s = signals(pi)
+
+    pi.write(SHUTDOWN_PIN, 1)
+
+    assert s.shutdown()
+
+def test_watchdog_timeout_ignored():
+
+    s = signals(FakePi({STANDBY_PIN: 1}))
+
+    s.on_edge(STANDBY_PIN, 2, 0)
+
+    assert s.standby()
+
+def test_wait_returns_on_edge():
+
+    pi = FakePi()
+    s = signals(pi)
+
+    timer = Timer(0.05, pi.write, (STANDBY_PIN, 1))
+    timer.start()
+    s.wait(5)
+    timer.join()
+
+    assert s.standby()
+
+def test_wait_for_resume():
+
+    pi = FakePi({STANDBY_PIN: 1})
+    s = signals(pi)
+
+    timer = Timer(0.05, pi.write, (STANDBY_PIN, 0))
+    timer.start()
+    resumed = s.wait_for_resume(5)
+    timer.join()
+
+    assert resumed is True
+
+def test_wait_for_resume_shutdown():
+
+    pi = FakePi({STANDBY_PIN: 1})
+    s = signals(pi)
+
+    timer = Timer(0.05, pi.write, (SHUTDOWN_PIN, 1))
+    timer.start()
+    resumed = s.wait_for_resume(5)
+    timer.join()
+
+    assert resumed is False
+
+def test_wait_for_resume_timeout():
+
+    s = signals(FakePi({STANDBY_PIN: 1}))
+
+    assert s.wait_for_resume(0.1) is None
+
+def test_missed_edge_read_while_waiting():
+
+    pi = FakePi({STANDBY_PIN: 1})
+    s = signals(pi)
+
+    # No callback => level only seen by the pins read every poll_interval
+    pi.write(STANDBY_PIN, 0, notify=False)
+
+    assert s.wait_for_resume(5) is True
+
+def test_cancel_callbacks():
+
+    pi = FakePi()
+    s = signals(pi)
+
+    s.cancel()
+
+    assert pi.callbacks == []
+    assert s.callbacks == []
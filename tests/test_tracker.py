@@ -0,0 +1,94 @@
+import numpy as np
+
+from ai_inference import Detections
+from tracker import Tracker
+
+def detections(*boxes):
+
+    # x, y, w, h, conf, cls
+    return Detections(np.array(boxes, dtype=np.float32).reshape(-1, 6))
+
+def enabled_tracker(configuration):
+
+    configuration.ai_detection['tracker']['enable'] = True
+
+    return Tracker(configuration)
+
+def test_new_boxes_are_saved(configuration):
+
+    tracker = enabled_tracker(configuration)
+
+    track_ids, save = tracker.update(detections([0.2, 0.2, 0.1, 0.1, 0.9, 0], [0.7, 0.7, 0.1, 0.1, 0.9, 0]), 0)
+
+    assert track_ids.tolist() == [1, 2]
+    assert save.tolist() == [True, True]
+
+def test_resting_insect_not_saved_again(configuration):
+
+    tracker = enabled_tracker(configuration)
+
+    tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), 0)
+    track_ids, save = tracker.update(detections([0.51, 0.5, 0.1, 0.1, 0.9, 0]), 10)
+
+    assert track_ids.tolist() == [1]
+    assert save.tolist() == [False]
+
+def test_better_confidence_is_saved(configuration):
+
+    tracker = enabled_tracker(configuration)
+
+    tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.8, 0]), 0)
+    track_ids, save = tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.8 + 2 * tracker.confidence_gain, 0]), 10)
+
+    assert track_ids.tolist() == [1]
+    assert save.tolist() == [True]
+
+def test_refresh_interval(configuration):
+
+    tracker = enabled_tracker(configuration)
+
+    tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), 0)
+    tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), tracker.refresh_interval / 2)
+    track_ids, save = tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), tracker.refresh_interval)
+
+    assert save.tolist() == [True]
+
+def test_other_class_is_a_new_track(configuration):
+
+    tracker = enabled_tracker(configuration)
+
+    tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), 0)
+    track_ids, save = tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 1]), 10)
+
+    assert track_ids.tolist() == [2]
+    assert save.tolist() == [True]
+
+def test_track_closed_after_max_age(configuration):
+
+    tracker = enabled_tracker(configuration)
+
+    tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), 0)
+    track_ids, save = tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), tracker.max_age + 1)
+
+    assert track_ids.tolist() == [2]
+    assert save.tolist() == [True]
+
+def test_disabled_by_default_saves_everything(configuration):
+
+    tracker = Tracker(configuration)
+
+    tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), 0)
+    track_ids, save = tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), 10)
+
+    assert save.tolist() == [True]
+
+def test_skipped_fraction(configuration):
+
+    tracker = enabled_tracker(configuration)
+
+    tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), 0)
+    tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), 10)
+    tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), 20)
+    tracker.update(detections([0.5, 0.5, 0.1, 0.1, 0.9, 0]), 30)
+
+    assert str(tracker) == '1 tracks, 1 boxes saved, 3 boxes skipped (75.0 % skipped)'
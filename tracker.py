@@ -0,0 +1,146 @@
+#! /usr/bin/python3
+
+import os
+
+import logging
+
+import numpy as np
+
+from ai_inference import box_iou
+
+from globals_parameters import LOGS_DESKTOP_FOLDER, TODAY
+
+this_script = os.path.basename(__file__)[:-3]
+
+today_log_path = os.path.join(LOGS_DESKTOP_FOLDER, TODAY)
+if not os.path.exists(today_log_path):
+    os.mkdir(today_log_path)
+
+logger = logging.getLogger('entomoscope_tracker')
+logger.setLevel(logging.INFO)
+h = logging.FileHandler(os.path.join(today_log_path, TODAY + '_' + this_script + '.log'))
+f = logging.Formatter('%(asctime)s;%(levelname)s;%(filename)s;%(lineno)d;"%(message)s"', datefmt='%d/%m/%Y;%H:%M:%S')
+h.setFormatter(f)
+logger.addHandler(h)
+
+class Track():
+
+    def __init__(self, track_id, box, cls, conf, timestamp):
+
+        self.track_id = track_id
+        self.box = box
+        self.cls = cls
+        self.best_conf = conf
+        self.first_time = timestamp
+        self.last_time = timestamp
+        self.last_saved_time = None
+        self.num_observations = 0
+
+class Tracker():
+
+    # Boxes of successive detections matched by IoU (or centroid distance for small boxes
+    # that moved a little) => one track per insect resting on the screen.
+    # An observation is saved when its track is new, when its confidence beats the best one
+    # of the track, or when the last save of the track is older than refresh_interval.
+
+    def __init__(self, configuration):
+
+        self.enable = configuration.ai_detection['tracker']['enable']
+        self.iou_threshold = configuration.ai_detection['tracker']['iou_threshold']
+        self.centroid_distance = configuration.ai_detection['tracker']['centroid_distance']
+        self.max_age = configuration.ai_detection['tracker']['max_age']
+        self.refresh_interval = configuration.ai_detection['tracker']['refresh_interval']
+        self.confidence_gain = configuration.ai_detection['tracker']['confidence_gain']
+
+        self.tracks = []
+        self.next_track_id = 1
+
+        self.num_saved = 0
+        self.num_skipped = 0
+
+    def match(self, detections):
+
+        # Greedy matching, best scores first => pairs of (detection index, track)
+        if len(detections) == 0 or not self.tracks:
+            return []
+
+        track_boxes = np.array([track.box for track in self.tracks], dtype=np.float32)
+        track_cls = np.array([track.cls for track in self.tracks])
+
+        iou = box_iou(detections.xywhn, track_boxes)
+
+        # Centroid distance relative to the track box diagonal
+        distance = np.linalg.norm(detections.xywhn[:, None, 0:2] - track_boxes[None, :, 0:2], axis=2)
+        distance /= np.maximum(np.linalg.norm(track_boxes[None, :, 2:4], axis=2), 1e-9)
+
+        score = np.where(iou >= self.iou_threshold, iou, 0.0)
+        score = np.maximum(score, np.where(distance <= self.centroid_distance, 1e-3, 0.0))
+        score[detections.cls[:, None] != track_cls[None, :]] = 0.0
+
+        pairs = []
+        used_detections = set()
+        used_tracks = set()
+
+        for i, j in zip(*np.unravel_index(np.argsort(-score, axis=None), score.shape)):
+            if score[i, j] <= 0:
+                break
+            if i in used_detections or j in used_tracks:
+                continue
+            used_detections.add(i)
+            used_tracks.add(j)
+            pairs.append((i, self.tracks[j]))
+
+        return pairs
+
+    def update(self, detections, timestamp):
+
+        # => track id of each box and whether the box has to be saved
+        track_ids = np.zeros(len(detections), dtype=int)
+        save = np.ones(len(detections), dtype=bool)
+
+        if not self.enable:
+            return track_ids, save
+
+        # Tracks not seen for max_age seconds are closed
+        for track in self.tracks:
+            if timestamp - track.last_time > self.max_age:
+                logger.info(f'track {track.track_id} closed after {track.num_observations} observations ({track.last_time - track.first_time:.0f} seconds)')
+        self.tracks = [track for track in self.tracks if timestamp - track.last_time <= self.max_age]
+
+        matched = dict(self.match(detections))
+
+        for i, (box, conf, cls) in enumerate(zip(detections.xywhn, detections.conf.tolist(), detections.cls.tolist())):
+
+            track = matched.get(i)
+
+            if track is None:
+                track = Track(self.next_track_id, box.copy(), cls, conf, timestamp)
+                self.next_track_id += 1
+                self.tracks.append(track)
+                save[i] = True
+            else:
+                save[i] = (conf > track.best_conf + self.confidence_gain
+                            or timestamp - track.last_saved_time >= self.refresh_interval)
+                track.box = box.copy()
+                track.best_conf = max(track.best_conf, conf)
+                track.last_time = timestamp
+
+            if save[i]:
+                track.last_saved_time = timestamp
+                self.num_saved += 1
+            else:
+                self.num_skipped += 1
+
+            track.num_observations += 1
+            track_ids[i] = track.track_id
+
+        return track_ids, save
+
+    def __str__(self):
+
+        total = self.num_saved + self.num_skipped
+
+        if total:
+            return f'{self.next_track_id - 1} tracks, {self.num_saved} boxes saved, {self.num_skipped} boxes skipped ({100 * self.num_skipped / total:.1f} % skipped)'
+        else:
+            return 'no box tracked'